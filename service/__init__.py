@@ -2,3 +2,4 @@
 
 from .models import *
 from .views import *
+from .bootstrap import init_app
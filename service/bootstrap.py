@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from common.util.log import get_logger
+from .controls.domain.job import job_runner
+from .controls.domain.split.service import BillPeriodSplitService
+
+logger = get_logger('bootstrap')
+
+__all__ = [
+    "init_app"
+]
+
+
+def init_app(app):
+    """ 应用启动时调用，按应用配置启动后台组件
+
+    JOB_RUNNER_ENABLED: 是否启动后台任务执行器，默认不启动，分账、导入导出在请求内直接执行
+    JOB_RUNNER_WORKER_NUM: 工作线程数
+    JOB_RUNNER_POLL_INTERVAL: 空闲时领取待执行任务的时间间隔，单位秒
+    JOB_RUNNER_LEASE_TIMEOUT: 执行中的任务心跳超时的时间，单位秒，超时的任务被重置后重新执行
+    JOB_RUNNER_RETENTION: 已结束的任务保留的时间，单位秒，超过后删除任务及其导入导出文件
+    SPLIT_PARALLEL_ENABLED: 是否开启并行分账，默认关闭
+    SPLIT_PARALLEL_WORKERS: 并行分账的工作进程数，默认为CPU核数
+    SPLIT_PARALLEL_CHUNK_SIZE: 并行分账每个分片包含的原始账单数
+    """
+    config = app.config
+
+    BillPeriodSplitService.configure_parallel(enabled=config.get('SPLIT_PARALLEL_ENABLED', False),
+                                              workers=config.get('SPLIT_PARALLEL_WORKERS'),
+                                              chunk_size=config.get('SPLIT_PARALLEL_CHUNK_SIZE', 5000))
+    logger.info(f'parallel split {"enabled" if BillPeriodSplitService.parallel_config.enabled else "disabled"}.')
+
+    if config.get('JOB_RUNNER_ENABLED', False):
+        job_runner.start(app,
+                         worker_num=config.get('JOB_RUNNER_WORKER_NUM', 2),
+                         poll_interval=config.get('JOB_RUNNER_POLL_INTERVAL', 5.0),
+                         lease_timeout=config.get('JOB_RUNNER_LEASE_TIMEOUT', 600.0),
+                         retention=config.get('JOB_RUNNER_RETENTION', 86400.0))
+    else:
+        logger.info(f'job runner disabled, jobs will be executed inline.')
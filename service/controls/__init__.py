@@ -16,7 +16,7 @@ class MetaCtl(BusinessApp, ModelCtlBase):
 
     @classmethod
     def sync_businesses(cls):
-        BusinessApp.sync()
+        return BusinessApp.sync()
 
 
 class UserCtl(UserApp, ModelCtlBase):
@@ -27,7 +27,7 @@ class BillPeriodCtl(BillPeriodApp, ModelCtlBase):
     model_cls = BillPeriod
 
 
-class SplitRuleCtl(ModelCtlBase):
+class SplitRuleCtl(SplitRuleApp, ModelCtlBase):
     model_cls = SplitRule
 
     @classmethod
@@ -38,16 +38,19 @@ class SplitRuleCtl(ModelCtlBase):
         split_rule_ = SplitRule.create(**kwargs)
 
         aggr.create_split_rule(split_rule_)
+        cls.split_incrementally(split_rule_.id)
 
         return cls(split_rule_)
 
     def patch(self, **kwargs):
         bill_period_id = self.model.bill_period_id
+        previous_bill_matchers = dict(self.model.bill_matchers or {})
 
         aggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
         super(SplitRuleCtl, self).patch(**kwargs)
 
         aggr.update_split_rule(self.model)
+        self.split_incrementally(self.model.id, previous_bill_matchers)
 
         return self
 
@@ -73,6 +76,7 @@ class OriginalBillCtl(OriginalBillApp, ModelCtlBase):
         aggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
         super(OriginalBillCtl, self).patch(**kwargs)
         aggr.update_original_bill(self.model)
+        self.split_incrementally(self.model.id)
 
         return self
 
@@ -100,3 +104,13 @@ class LedgerBillCtl(LedgerBillApp, ModelCtlBase):
         aggr.update_ledger_bill(self.model)
 
         return self
+
+    def delete(self):
+        bill_period_id = self.model.bill_period_id
+        if bill_period_id is None:
+            # 已从计费周期中分离的总账账单不影响报表
+            super(LedgerBillCtl, self).delete()
+            return
+
+        aggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        aggr.delete_ledger_bill(self.model)
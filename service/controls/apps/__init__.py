@@ -10,3 +10,4 @@ from .bill import *
 from .meta import *
 from .bill_period import *
 from .user import *
+from .job import *
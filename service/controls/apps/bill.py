@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from typing import List
+from typing import List, Optional
 from service.models import *
-from ..domain.split.service import LedgerBillSplitService
+from ..domain.split.service import BillPeriodSplitService, LedgerBillSplitService
 
 
 class LedgerBillApp:
@@ -18,6 +18,15 @@ class LedgerBillApp:
 
 
 class OriginalBillApp:
+    @classmethod
+    def split_incrementally(cls, original_bill_id: int):
+        """ 原始账单更新后，仅对该原始账单重新分账，替换其总账账单 """
+        original_bill: OriginalBill = OriginalBill.query.filter_by(id=original_bill_id).first()
+        if not original_bill:
+            OriginalBill.raise_not_found(id=original_bill_id)
+
+        BillPeriodSplitService.split_original_bills_incrementally(original_bill.bill_period_id, [original_bill.id])
+
     @classmethod
     def get_split_results(cls, original_bill_id: int) -> List[LedgerBill]:
         return LedgerBill.query.filter_by(parent_id=original_bill_id).all()
@@ -26,3 +35,14 @@ class OriginalBillApp:
     def get_query_op_func_of_split_results(cls, original_bill_id: int):
         return lambda query: query\
             .filter_by(parent_id=original_bill_id).filter(Bill.bill_period_id.isnot(None))
+
+
+class SplitRuleApp:
+    @classmethod
+    def split_incrementally(cls, split_rule_id: int, previous_bill_matchers: Optional[dict] = None):
+        """ 分账规则创建或更新后，仅对受影响的原始账单重新分账
+
+        :param split_rule_id: 创建或更新的分账规则ID
+        :param previous_bill_matchers: 分账规则更新前的匹配器，创建分账规则时为None
+        """
+        BillPeriodSplitService.split_original_bills_affected_by_split_rule(split_rule_id, previous_bill_matchers)
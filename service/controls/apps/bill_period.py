@@ -1,21 +1,28 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+import json
 import os
-from typing import List, IO, Any
+from typing import List, IO, Any, Callable, Iterator, Optional, Tuple
 
+from openpyxl import load_workbook
 from werkzeug.exceptions import BadRequest, Conflict
 
 import common.static as const
 from common.util.excel import ExcelHelper, Workbook
 from service.models import *
 from ..domain.bill.aggr import BillPeriodAggr
+from ..domain.bill.repo import repo as bill_repo
 from ..domain.bill.spec import original_bill_spec
+from ..domain.bill.val_obj import BillPeriodStatistics
+from ..domain.job import JobContext, job_runner
+from ..domain.report.cache import export_cache
 from ..domain.split.service import BillPeriodSplitService
 from .dto import SimpleSplitRule
-from .common import FileMixin, DecodeMatrixDataFromBillMixin
+from .common import FileMixin, StreamingFileMixin, DecodeMatrixDataFromBillMixin
 
 
-class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
+class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, StreamingFileMixin, FileMixin):
     """ 导入导出服务 """
 
     __split_rule_header_cn_2_en: dict = {
@@ -37,25 +44,48 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
     __path_of_original_bills_standard_template_file = os.path.join(const.STATIC_PATH, '原始账单导入模板2021.12.17.xlsx')
     __path_of_split_rules_standard_template_file = os.path.join(const.STATIC_PATH, '分账规则模板2021.12.21.xlsx')
 
+    # 导入原始账单时，每批解析、校验、写入的原始账单数
+    original_bill_import_batch_size: int = 2000
+
     @classmethod
     def import_original_bills_from_storage_obj(cls, storage_obj: IO, bill_period_id: int):
         """ 导入原始账单到指定计费周期 """
+        file_path = cls.save_original_bills_file(storage_obj, bill_period_id)
+        try:
+            cls.import_original_bills_from_file(file_path, bill_period_id)
+        finally:
+            cls._remove_file(file_path)
 
+    @classmethod
+    def save_original_bills_file(cls, storage_obj: IO, bill_period_id: int) -> str:
+        """ 储存待导入指定计费周期的原始账单文件，返回文件路径 """
         bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
-
-        # 储存文件，并加载数据
         file_path = cls.__generate_file_path(bill_period_aggr, const.STATIC_FOPT_IMPORT, const.STATIC_FT_ORIGINAL_BILL)
         cls._save_file(storage_obj, file_path)
+        return file_path
 
-        matrix_data = cls.__load_matrix_data_of_xlsx_file(file_path)
-        if len(matrix_data) <= 1:
-            raise BadRequest('未能解析到原始账单条目，请检查文件，重新上传。')
+    @classmethod
+    def import_original_bills_from_file(
+            cls, file_path: str, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None):
+        """ 从已储存的文件导入原始账单到指定计费周期
+
+        以只读模式逐行读取工作表，按批解析、修复、校验并写入原始账单，内存占用只与批大小有关，与文件大小无关
+
+        :param progress: 每批写入后汇报进度，参数为(已导入的原始账单数, 工作表的数据行数)
+        """
+        bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
 
-        # 解析原始账单条目
-        original_bills: List[OriginalBill] = cls.__decode_original_bills_from_matrix_data(matrix_data)
+        # 逐批解析原始账单条目
+        batches = cls.__iter_original_bill_row_batches_of_xlsx_file(file_path)
+        if progress is not None:
+            batches = cls.__iter_batches_with_progress(batches, progress, cls.__count_lines_of_xlsx_file(file_path))
+
+        first_batch = next(batches, None)
+        if not first_batch:
+            raise BadRequest('未能解析到原始账单条目，请检查文件，重新上传。')
 
         # 导入至计费周期内
-        bill_period_aggr.set_original_bills(original_bills)
+        bill_period_aggr.set_original_bill_rows(itertools.chain([first_batch], batches))
 
     @classmethod
     def import_split_rules_from_storage_obj(cls, storage_obj: IO, bill_period_id: int):
@@ -66,7 +96,10 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
         file_path = cls.__generate_file_path(bill_period_aggr, const.STATIC_FOPT_IMPORT, const.STATIC_FT_SPLIT_RULE)
         cls._save_file(storage_obj, file_path)
 
-        matrix_data = cls.__load_matrix_data_of_xlsx_file(file_path)
+        try:
+            matrix_data = cls.__load_matrix_data_of_xlsx_file(file_path)
+        finally:
+            cls._remove_file(file_path)
         if len(matrix_data) <= 1:
             raise BadRequest('未能解析到分账规则条目，请检查文件，重新上传。')
 
@@ -77,22 +110,28 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
         bill_period_aggr.set_split_rules(split_rules)
 
     @classmethod
-    def export_original_bills(cls, bill_period_id: int) -> IO:
-        """ 导出指定计费周期的原始账单 """
-        bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
-        file_path = cls.__generate_file_path(bill_period_aggr, const.STATIC_FOPT_EXPORT, const.STATIC_FT_ORIGINAL_BILL)
-        matrix_data: List[List[Any]] = cls._decode_matrix_data_from_bills(bill_period_aggr.original_bills)
-        ExcelHelper.save_matrix_data_into_file(matrix_data, file_path)
-        return cls._read_file(file_path)
+    def export_original_bills(
+            cls, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None) -> IO:
+        """ 导出指定计费周期的原始账单到文件 """
+        return cls.__export_bills_into_file(bill_period_id, const.BILL_TYPE_ORIGINAL, progress)
 
     @classmethod
-    def export_ledger_bills(cls, bill_period_id: int) -> IO:
-        """ 导出指定计费周期的总账账单 """
-        bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
-        file_path = cls.__generate_file_path(bill_period_aggr, const.STATIC_FOPT_EXPORT, const.STATIC_FT_LEDGER_BILL)
-        matrix_data: List[List[Any]] = cls._decode_matrix_data_from_bills(bill_period_aggr.ledger_bills)
-        ExcelHelper.save_matrix_data_into_file(matrix_data, file_path)
-        return cls._read_file(file_path)
+    def export_ledger_bills(
+            cls, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None) -> IO:
+        """ 导出指定计费周期的总账账单到文件 """
+        return cls.__export_bills_into_file(bill_period_id, const.BILL_TYPE_LEDGER, progress)
+
+    @classmethod
+    def stream_original_bills(
+            cls, bill_period_id: int, file_format: str = StreamingFileMixin.FILE_FORMAT_XLSX) -> Tuple[str, Iterator[bytes]]:
+        """ 流式导出指定计费周期的原始账单，返回(文件名, 逐块返回的文件内容) """
+        return cls.__stream_bills(bill_period_id, const.BILL_TYPE_ORIGINAL, file_format)
+
+    @classmethod
+    def stream_ledger_bills(
+            cls, bill_period_id: int, file_format: str = StreamingFileMixin.FILE_FORMAT_XLSX) -> Tuple[str, Iterator[bytes]]:
+        """ 流式导出指定计费周期的总账账单，返回(文件名, 逐块返回的文件内容) """
+        return cls.__stream_bills(bill_period_id, const.BILL_TYPE_LEDGER, file_format)
 
     @classmethod
     def export_original_bills_standard_template(cls) -> IO:
@@ -105,31 +144,58 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
         return cls._read_file(cls.__path_of_split_rules_standard_template_file)
 
     @classmethod
-    def __decode_original_bills_from_matrix_data(cls, matrix_data: List[List[Any]]) -> List[OriginalBill]:
-        """ 从excel文件文本字符串中解析出原始账单列表 """
-        original_bills: List[OriginalBill] = []
+    def __iter_original_bill_row_batches_of_xlsx_file(cls, file_path: str) -> Iterator[List[BillRow]]:
+        """ 逐批从excel文件中解析出原始账单行，每批最多original_bill_import_batch_size条，全空的行忽略，类型异常按批修复 """
+        lines = cls.__iter_lines_of_xlsx_file(file_path)
 
-        headers = matrix_data[0]
-        spec = original_bill_spec()
-        for line in matrix_data[1:]:
+        headers = next(lines, None)
+        if headers is None:
+            return
 
-            original_bill = OriginalBill.create()
-            original_bill.type = const.BILL_TYPE_ORIGINAL
+        # 列下标 -> 属性名
+        index_2_attr_name = dict()
+        for i, header in enumerate(headers):
+            if header is None:
+                continue
 
-            for i in range(len(line)):
-                if headers[i] is None:
-                    continue
+            attr_name_cn = str(header).strip()
+            if attr_name_cn in cls._bill_header_cn_2_en:
+                index_2_attr_name[i] = cls._bill_header_cn_2_en[attr_name_cn]
 
-                attr_name_cn = headers[i].strip()
-                if attr_name_cn in cls._bill_header_cn_2_en:
-                    attr_name_en = cls._bill_header_cn_2_en[attr_name_cn]
-                    attr_value = line[i]
-                    setattr(original_bill, attr_name_en, attr_value)
-
-            spec.fix_known_exception_cases(original_bill)
-            original_bills.append(original_bill)
+        empty_values = dict.fromkeys(BILL_ROW_FIELDS)
+        empty_values['type'] = const.BILL_TYPE_ORIGINAL
 
-        return original_bills
+        spec = original_bill_spec()
+        batch: List[BillRow] = []
+        for line in lines:
+            if all(value is None for value in line):
+                continue
+
+            values = dict(empty_values)
+            for i, attr_name_en in index_2_attr_name.items():
+                if i < len(line):
+                    values[attr_name_en] = line[i]
+
+            batch.append(BillRow(**values))
+
+            if len(batch) >= cls.original_bill_import_batch_size:
+                yield spec.fix_known_exception_cases_of_bill_rows(batch)
+                batch = []
+
+        if batch:
+            yield spec.fix_known_exception_cases_of_bill_rows(batch)
+
+    @staticmethod
+    def __iter_batches_with_progress(
+            batches: Iterator[List[BillRow]],
+            progress: Callable[[int, int], None], total: Optional[int]) -> Iterator[List[BillRow]]:
+        """ 每批被处理完成（即取下一批）时汇报进度 """
+        processed = 0
+        progress(processed, total)
+        for batch in batches:
+            yield batch
+            processed += len(batch)
+            progress(processed, total)
 
     @classmethod
     def __decode_split_rules_from_matrix_data(cls, matrix_data: List[List[Any]]) -> List[SplitRule]:
@@ -160,14 +226,62 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
 
         return split_rules
 
+    @classmethod
+    def __export_bills_into_file(
+            cls, bill_period_id: int, bill_type: int, progress: Optional[Callable[[int, int], None]]) -> IO:
+        bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        file_path = cls.__generate_file_path(bill_period_aggr, const.STATIC_FOPT_EXPORT,
+                                             cls.__get_static_file_type(bill_type))
+
+        total = bill_period_aggr.get_bill_cnt(bill_type) if progress is not None else None
+        lines = cls._iter_lines_of_bill_values(
+            bill_period_aggr.iter_bill_values(bill_type, cls._get_bill_attr_names()), progress, total)
+        try:
+            cls._write_xlsx_file(lines, file_path)
+        except Exception:
+            cls._remove_file(file_path)
+            raise
+        return cls._read_file(file_path)
+
+    @classmethod
+    def __stream_bills(cls, bill_period_id: int, bill_type: int, file_format: str) -> Tuple[str, Iterator[bytes]]:
+        bill_period_aggr: BillPeriodAggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        file_name = cls.__generate_file_name(bill_period_aggr, const.STATIC_FOPT_EXPORT,
+                                             cls.__get_static_file_type(bill_type), file_format)
+
+        def generate() -> Iterator[bytes]:
+            lines = cls._iter_lines_of_bill_values(
+                bill_period_aggr.iter_bill_values(bill_type, cls._get_bill_attr_names()))
+            return cls._iter_file_bytes(lines, file_format)
+
+        # 已锁定的计费周期的总账账单不再变化，导出的文件可以缓存
+        if bill_type != const.BILL_TYPE_LEDGER or not bill_period_aggr.is_locked:
+            return file_name, generate()
+
+        key = export_cache.make_key(const.STATIC_FT_LEDGER_BILL, [bill_period_aggr.bill_period], file_format=file_format)
+        return file_name, cls._iter_file_bytes_with_cache(key, [bill_period_aggr.bill_period.id], generate)
+
+    @staticmethod
+    def __get_static_file_type(bill_type: int) -> const.StaticFileType:
+        if bill_type == const.BILL_TYPE_ORIGINAL:
+            return const.STATIC_FT_ORIGINAL_BILL
+        return const.STATIC_FT_LEDGER_BILL
+
     @classmethod
     def __generate_file_path(
             cls, bill_period_aggr: BillPeriodAggr,
             op_type: const.StaticFileOpType,
             static_file_type: const.StaticFileType) -> str:
-        return os.path.join(cls._base_path,
-                            f'{bill_period_aggr.bill_period.pretty_str}'
-                            f'_{static_file_type}_{op_type}.{cls._file_suffix}')
+        return cls._create_unique_file_path(
+            cls.__generate_file_name(bill_period_aggr, op_type, static_file_type, cls._file_suffix))
+
+    @staticmethod
+    def __generate_file_name(
+            bill_period_aggr: BillPeriodAggr,
+            op_type: const.StaticFileOpType,
+            static_file_type: const.StaticFileType,
+            file_suffix: str) -> str:
+        return f'{bill_period_aggr.bill_period.pretty_str}_{static_file_type}_{op_type}.{file_suffix}'
 
     @classmethod
     def __load_matrix_data_of_xlsx_file(cls, file_path: str) -> List[List[Any]]:
@@ -185,14 +299,45 @@ class ImportAndExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
 
         return matrix_data
 
+    @classmethod
+    def __count_lines_of_xlsx_file(cls, file_path: str) -> Optional[int]:
+        """ 根据工作表记录的范围获取数据行数（不含表头），不逐行读取；文件未记录范围时返回None """
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+
+        try:
+            max_row = wb.worksheets[0].max_row
+        finally:
+            wb.close()
+
+        return max(max_row - 1, 0) if max_row else None
+
+    @classmethod
+    def __iter_lines_of_xlsx_file(cls, file_path: str) -> Iterator[tuple]:
+        """ 以只读模式逐行读取给定的文件，不将整个工作表加载到内存
+
+        :param file_path: 仅包含一个工作表的excel文件路径
+        :return: 逐行返回单元格的值
+        """
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+
+        try:
+            if len(wb.sheetnames) != 1:
+                raise BadRequest('文件中包含多个工作表，无法解析目标，请确保上传的excel文件中仅包含一个工作表。')
+
+            yield from wb.worksheets[0].iter_rows(values_only=True)
+        finally:
+            wb.close()
+
 
 class SplitMixin:
     """ 分账服务 """
     @classmethod
-    def split(cls, bill_period_id: int):
+    def split(cls, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None):
         """ 对指定计费周期进行分账
 
         如果存在异常的原始账单，不允许操作，需要先解决后才允许操作
+
+        :param progress: 汇报分账进度，参数为(已分账的原始账单数, 原始账单总数)
         """
         aggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
 
@@ -203,10 +348,86 @@ class SplitMixin:
         if len(exception_original_bills) > 0:
             raise Conflict(f'存在异常的原始账单，请处理后重试。')
 
-        BillPeriodSplitService.split_original_bills_of_bill_period(bill_period_id)
+        BillPeriodSplitService.split_original_bills_of_bill_period(bill_period_id, progress)
+
+    @classmethod
+    def preview_split(cls, bill_period_id: int) -> Iterator[str]:
+        """ 预览对指定计费周期进行分账的结果，不修改计费周期
+
+        :return: 预览分账结果与现有总账账单的差异，每行一条JSON记录（NDJSON）
+        """
+        BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
 
+        # 分账在返回前完成，差异记录在响应时逐条生成
+        records = BillPeriodSplitService.preview_split_original_bills_of_bill_period(bill_period_id)
+        return (json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+
+class JobMixin(ImportAndExportMixin, SplitMixin):
+    """ 后台任务服务
+
+    分账、导入导出原始账单、导出总账账单耗时较长，提交为后台任务，返回任务，调用方通过任务ID查询进度与结果，参考JobRunner
+    """
+    JOB_KIND_SPLIT = 'split'
+    JOB_KIND_IMPORT_ORIGINAL_BILLS = 'import_original_bills'
+    JOB_KIND_EXPORT_ORIGINAL_BILLS = 'export_original_bills'
+    JOB_KIND_EXPORT_LEDGER_BILLS = 'export_ledger_bills'
+
+    @classmethod
+    def register_jobs(cls):
+        to_register = {
+            cls.JOB_KIND_SPLIT: cls.__split_job,
+            cls.JOB_KIND_IMPORT_ORIGINAL_BILLS: cls.__import_original_bills_job,
+            cls.JOB_KIND_EXPORT_ORIGINAL_BILLS: cls.__export_original_bills_job,
+            cls.JOB_KIND_EXPORT_LEDGER_BILLS: cls.__export_ledger_bills_job
+        }
+        for kind, handler in to_register.items():
+            job_runner.register(kind, handler)
 
-class BillPeriodApp(ImportAndExportMixin, SplitMixin):
+    @classmethod
+    def submit_split(cls, bill_period_id: int) -> dict:
+        BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        return job_runner.submit(cls.JOB_KIND_SPLIT, bill_period_id)
+
+    @classmethod
+    def submit_import_original_bills(cls, storage_obj: IO, bill_period_id: int) -> dict:
+        """ 在请求内储存上传的文件，由后台任务解析并导入 """
+        file_path = cls.save_original_bills_file(storage_obj, bill_period_id)
+        return job_runner.submit(cls.JOB_KIND_IMPORT_ORIGINAL_BILLS, bill_period_id, file_path=file_path)
+
+    @classmethod
+    def submit_export_original_bills(cls, bill_period_id: int) -> dict:
+        BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        return job_runner.submit(cls.JOB_KIND_EXPORT_ORIGINAL_BILLS, bill_period_id)
+
+    @classmethod
+    def submit_export_ledger_bills(cls, bill_period_id: int) -> dict:
+        BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
+        return job_runner.submit(cls.JOB_KIND_EXPORT_LEDGER_BILLS, bill_period_id)
+
+    @classmethod
+    def __split_job(cls, ctx: JobContext, bill_period_id: int):
+        cls.split(bill_period_id, ctx.progress)
+
+    @classmethod
+    def __import_original_bills_job(cls, ctx: JobContext, bill_period_id: int, file_path: str):
+        try:
+            cls.import_original_bills_from_file(file_path, bill_period_id, ctx.progress)
+        finally:
+            cls._remove_file(file_path)
+
+    @classmethod
+    def __export_original_bills_job(cls, ctx: JobContext, bill_period_id: int) -> dict:
+        with cls.export_original_bills(bill_period_id, ctx.progress) as storage_obj:
+            return dict(file_path=storage_obj.name)
+
+    @classmethod
+    def __export_ledger_bills_job(cls, ctx: JobContext, bill_period_id: int) -> dict:
+        with cls.export_ledger_bills(bill_period_id, ctx.progress) as storage_obj:
+            return dict(file_path=storage_obj.name)
+
+
+class BillPeriodApp(JobMixin):
     """ 计费周期服务 """
     @classmethod
     def create(cls, year: int, month: int) -> BillPeriod:
@@ -227,3 +448,12 @@ class BillPeriodApp(ImportAndExportMixin, SplitMixin):
     def unlock(cls, bill_period_id: int):
         aggr = BillPeriodAggr.get_by_id_or_raise_404(bill_period_id)
         aggr.unlock()
+
+    @classmethod
+    def get_statistics(cls, bill_period_ids: List[int]) -> List[BillPeriodStatistics]:
+        """ 批量获取计费周期的账单统计，顺序与bill_period_ids一致，一页计费周期只需一次分组统计 """
+        statistics = bill_repo.get_statistics(bill_period_ids)
+        return [statistics[bill_period_id] for bill_period_id in bill_period_ids]
+
+
+BillPeriodApp.register_jobs()
@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, IO, Any, Optional
-
-from common.util.auth import get_user_info, User, get_uc_user
+import csv
+import io
+import itertools
+import os
+import shutil
+import tempfile
+from typing import List, IO, Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from openpyxl import Workbook
+from werkzeug.exceptions import BadRequest
+
+from common.util.auth import get_user_info
 import common.static as const
 from service.models import *
-from ..domain.meta.repo import repo as meta_repo
+from ..domain.meta.spec import business_index
+from ..domain.report.cache import export_cache
 from ..domain.user.aggr import UserAggr
 
 
@@ -13,19 +23,16 @@ def assure_has_permission_of_given_business_ids(business_ids: List[int]):
     user_info = get_user_info()
 
     if not user_info.is_admin:
-        uc_user: User = get_uc_user()
-        user_aggr: UserAggr = UserAggr.get_by_email_or_404(uc_user.email)
+        user_aggr: UserAggr = UserAggr.get_by_uc_user_id_or_401(user_info.id)
         user_aggr.assure_has_permission_of_all_given_business_ids(business_ids)
 
 
 def convert_business_ids_2_business_modelx_codes(business_ids: List[int]) -> List[Optional[str]]:
-    business_modelx_codes: List[Optional[str]] = [business.modelx_code
-                                                  for business in meta_repo.get_businesses()
-                                                  if business.id in business_ids]
-    if 0 in business_ids:
-        business_modelx_codes.append(None)
+    """ 通过缓存的业务索引转换，业务ID为0时表示不属于任何业务，转换为None
 
-    return business_modelx_codes
+    其他进程修改的业务最长在meta_spec_cache的ttl后生效
+    """
+    return business_index().get_modelx_codes(business_ids)
 
 
 class FileMixin:
@@ -41,7 +48,25 @@ class FileMixin:
     @classmethod
     def _save_file(cls, storage_obj: IO, file_path: str):
         with open(file_path, mode="wb") as f:
-            f.write(storage_obj.read())
+            shutil.copyfileobj(storage_obj, f)
+
+    @classmethod
+    def _remove_file(cls, file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def _create_unique_file_path(cls, file_name: str) -> str:
+        """ 以文件名为前缀创建唯一的空文件并返回路径，并发的导入导出不会相互覆盖
+
+        文件不会被覆盖，须由调用方删除：上传的文件在导入后删除，导出任务生成的文件在清理任务时删除
+        """
+        stem, suffix = os.path.splitext(file_name)
+        fd, file_path = tempfile.mkstemp(prefix=f'{stem}_', suffix=suffix, dir=cls._base_path)
+        os.close(fd)
+        return file_path
 
 
 class DecodeMatrixDataFromBillMixin:
@@ -70,19 +95,117 @@ class DecodeMatrixDataFromBillMixin:
     }
 
     @classmethod
-    def _decode_matrix_data_from_bills(cls, bills: List[Bill]) -> List[List[Any]]:
-        headers = list(cls._bill_header_cn_2_en.keys())
+    def _get_bill_attr_names(cls) -> List[str]:
+        """ 导出的列对应的账单属性名，与表头的顺序一致 """
+        return list(cls._bill_header_cn_2_en.values())
+
+    @classmethod
+    def _iter_lines_of_bill_values(
+            cls, bill_values: Iterator[Tuple[Any, ...]],
+            progress: Optional[Callable[[int, int], None]] = None, total: Optional[int] = None) -> Iterator[Sequence[Any]]:
+        """ 逐行返回表头及账单的属性值，没有任何账单时抛出BadRequest
+
+        首条账单在调用时即获取，以便在开始输出前抛出异常，其余账单在迭代时逐条获取
+
+        :param bill_values: 账单的属性值，顺序与_get_bill_attr_names一致
+        :param progress: 汇报进度，参数为(已输出的账单数, 账单总数)
+        :param total: 账单总数
+        """
+        first = next(bill_values, None)
+        if first is None:
+            raise BadRequest('没有可导出的账单。')
+
+        return cls.__iter_lines(itertools.chain([first], bill_values), progress, total)
+
+    @classmethod
+    def __iter_lines(
+            cls, bill_values: Iterator[Tuple[Any, ...]],
+            progress: Optional[Callable[[int, int], None]], total: Optional[int]) -> Iterator[Sequence[Any]]:
+        yield list(cls._bill_header_cn_2_en.keys())
 
-        matrix_data: List[List[Any]] = [headers]
+        for i, values in enumerate(bill_values):
+            if progress is not None:
+                progress(i, total)
+            yield values
 
-        for bill_ in bills:
 
-            row = []
-            for attr_name_cn in headers:
-                attr_name_en = cls._bill_header_cn_2_en[attr_name_cn]
-                attr_val = getattr(bill_, attr_name_en, None)
-                row.append(attr_val)
+class StreamingFileMixin:
+    """ 流式导出文件
 
-            matrix_data.append(row)
+    1. xlsx：使用只写模式的工作簿逐行写入，已写入的行暂存在临时文件中，内存占用与行数无关，但全部行写入后才能输出
+    2. csv：逐行编码，每积累一定大小即输出，查询完成前即可输出首个字节，适用于数据量大的导出
 
-        return matrix_data
+    """
+    FILE_FORMAT_XLSX = 'xlsx'
+    FILE_FORMAT_CSV = 'csv'
+
+    # 每次输出的字节数
+    _stream_chunk_size: int = 64 * 1024
+
+    @classmethod
+    def _write_xlsx_file(cls, lines: Iterable[Sequence[Any]], file: Union[str, IO]):
+        """ 逐行写入xlsx文件 """
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for line in lines:
+            ws.append(line)
+        wb.save(file)
+
+    @classmethod
+    def _iter_file_bytes(cls, lines: Iterable[Sequence[Any]], file_format: str) -> Iterator[bytes]:
+        """ 逐块返回指定格式的文件内容，文件格式不支持时立即抛出BadRequest """
+        if file_format == cls.FILE_FORMAT_XLSX:
+            return cls.__iter_xlsx_bytes(lines)
+        if file_format == cls.FILE_FORMAT_CSV:
+            return cls.__iter_csv_bytes(lines)
+        raise BadRequest(f'不支持的文件格式：{file_format}，可选：{cls.FILE_FORMAT_XLSX}、{cls.FILE_FORMAT_CSV}。')
+
+    @classmethod
+    def _iter_file_bytes_with_cache(
+            cls, key: str, bill_period_ids: List[int], generate: Callable[[], Iterator[bytes]]) -> Iterator[bytes]:
+        """ 逐块返回已锁定计费周期的导出文件，命中缓存时直接返回缓存的文件，否则边生成边缓存
+
+        :param key: 缓存键，由export_cache.make_key生成
+        :param bill_period_ids: 导出涉及的计费周期，任一计费周期解锁或总账账单变化时缓存失效
+        :param generate: 生成文件内容，未命中时立即调用，以便在开始输出前抛出异常
+        """
+        cached = export_cache.open(key)
+        if cached is not None:
+            return cls._iter_file_chunks(cached)
+        # 在读取导出数据前获取版本，读取后计费周期被失效时不缓存
+        versions = export_cache.get_versions(bill_period_ids)
+        return export_cache.iter_and_put(key, bill_period_ids, generate(), versions)
+
+    @classmethod
+    def _iter_file_chunks(cls, file: IO) -> Iterator[bytes]:
+        """ 从当前位置逐块返回已打开的文件的内容，返回完毕后关闭文件 """
+        with file:
+            while True:
+                chunk = file.read(cls._stream_chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @classmethod
+    def __iter_xlsx_bytes(cls, lines: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+        with tempfile.TemporaryFile() as f:
+            cls._write_xlsx_file(lines, f)
+            f.seek(0)
+            yield from cls._iter_file_chunks(f)
+
+    @classmethod
+    def __iter_csv_bytes(cls, lines: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        # 带BOM，Excel打开时能够正确识别UTF-8编码的中文
+        buffer.write('\ufeff')
+        for line in lines:
+            writer.writerow(line)
+            if buffer.tell() >= cls._stream_chunk_size:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
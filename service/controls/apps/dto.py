@@ -17,8 +17,12 @@ import common.util.decimal as decimal
 
 @ex_dataclass
 class ReportOverview:
+    """ 报表概览，bills仅为当前页的报表账单 """
     total: float = field(required=True)
     bills: List[ReportBill] = field(required=True)
+    bill_cnt: int = field(default=0)            # 报表账单总数
+    page_size: int = field(default=None)
+    next_cursor: int = field(default=None)      # 下一页的游标，即当前页最后一条报表账单的ID，没有下一页时为None
 
 
 @ex_dataclass
@@ -39,7 +43,13 @@ class ReportDetails(EXpack):
         bill_dict_list = []
         for bill in self.overview.bills:
             bill_dict_list.append(bill.to_dict(excludes=['type', 'parent_id']))
-        res['overview']['bills'] = bill_dict_list
+        res['overview']['bills'] = dict(
+            data=bill_dict_list,
+            total=self.overview.bill_cnt,
+            page_size=self.overview.page_size,
+            next_cursor=self.overview.next_cursor)
+        for k in ['bill_cnt', 'page_size', 'next_cursor']:
+            res['overview'].pop(k, None)
         return res
 
 
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import os
+from typing import IO, List, Optional
+
+from werkzeug.exceptions import NotFound, Conflict
+
+from ..domain.job import repo as job_repo, job_runner, JOB_STATE_SUCCEEDED
+
+
+class JobApp:
+    """ 查询后台任务（如分账、导入导出）的执行状态 """
+    @classmethod
+    def get_job(cls, job_id: int) -> dict:
+        job = job_repo.get(job_id)
+        if job is None:
+            raise NotFound(f'Job({job_id}) not found.')
+        return job
+
+    @classmethod
+    def get_jobs(cls, bill_period_id: Optional[int] = None) -> List[dict]:
+        """ 获取任务列表，按创建时间倒序排列 """
+        return job_repo.get_list(bill_period_id)
+
+    @classmethod
+    def cancel_job(cls, job_id: int) -> dict:
+        """ 取消任务，执行中的任务在下次汇报进度时取消，已完成的部分回滚 """
+        cls.get_job(job_id)
+        if not job_runner.cancel(job_id):
+            raise Conflict(f'Job({job_id}) has finished.')
+        return cls.get_job(job_id)
+
+    @classmethod
+    def get_job_file(cls, job_id: int) -> IO:
+        """ 获取导出任务生成的文件 """
+        job = cls.get_job(job_id)
+        if job['state'] != JOB_STATE_SUCCEEDED:
+            raise Conflict(f'Job({job_id}) is {job["state"]}.')
+
+        file_path = (job['result'] or dict()).get('file_path')
+        if not file_path or not os.path.exists(file_path):
+            raise NotFound(f'File of job({job_id}) not found.')
+        return open(file_path, mode='rb')
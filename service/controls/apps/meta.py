@@ -1,40 +1,51 @@
 # -*- coding: utf-8 -*-
 
-import json
 from typing import List
 
+from werkzeug.exceptions import InternalServerError
+
 import common.static as const
 from common.util.api import *****Api, ModelXBusiness
 from ..domain.meta.entity import Business
+from ..domain.meta.modelx import IModelXBusiness, IModelXSource
 from ..domain.meta.repo import repo
+from ..domain.meta.val_obj import BusinessSyncResult
 from common.util.log import get_logger
 
 
 logger = get_logger('app:meta')
 
 
+class ModelXApiSource(IModelXSource):
+    """ 通过ModelX接口获取业务 """
+    def get_businesses(self) -> List[ModelXBusiness]:
+        return *****Api.modelx_get_businesses()
+
+
 class BusinessApp:
+    source: IModelXSource = ModelXApiSource()
+
     @classmethod
-    def sync(cls):
-        """ 执行同步操作 """
+    def sync(cls) -> BusinessSyncResult:
+        """ 执行同步操作，内容未变化的业务不做写入，可定时重复执行 """
         logger.debug(f'start synchronizing business.')
-        modelx_businesses = cls.__fetch_modelx_business()
-        logger.debug(f'generated modelx businesses: {json.dumps(modelx_businesses)}.')
+        modelx_businesses = cls.source.get_businesses()
+        logger.debug(f'fetched {len(modelx_businesses)} modelx businesses.')
+
+        if not modelx_businesses:
+            # ModelX返回空列表时多为接口异常，不能据此删除全部业务
+            raise InternalServerError('ModelX返回的业务为空，已跳过同步')
 
         business_entities = [
             cls.__convert_modelx_business_2_business_entity(modelx_business)
             for modelx_business in modelx_businesses]
 
-        repo.set_businesses(business_entities)
-        logger.debug(f'business synchronized.')
-
-    @classmethod
-    def __fetch_modelx_business(cls) -> List[ModelXBusiness]:
-        """ 从modelx读取业务数据 """
-        return *****Api.modelx_get_businesses()
+        result = repo.set_businesses(business_entities)
+        logger.debug(f'business synchronized: {result.to_dict()}.')
+        return result
 
     @staticmethod
-    def __convert_modelx_business_2_business_entity(modelx_business: ModelXBusiness) -> Business:
+    def __convert_modelx_business_2_business_entity(modelx_business: IModelXBusiness) -> Business:
         business_entity = Business()
         business_entity.type = const.META_TYPE_BUSINESS
         business_entity.other = dict(
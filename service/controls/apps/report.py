@@ -1,63 +1,107 @@
 # -*- coding: utf-8 -*-
 
-import os
-from typing import Any, IO
+from typing import Iterator, List, Optional, Tuple
 
-from sqlalchemy import and_
+from sqlalchemy import desc
 
-from common.util.excel import ExcelHelper
-from .common import DecodeMatrixDataFromBillMixin, FileMixin
+from .common import DecodeMatrixDataFromBillMixin, StreamingFileMixin
 from .common import assure_has_permission_of_given_business_ids, convert_business_ids_2_business_modelx_codes
 from .dto import *
 from ..domain.bill.aggr import BillPeriodAggr
 from ..domain.report.aggr import *
+from ..domain.report.cache import export_cache
 from ..domain.report.repo import repo as report_repo
 from ..domain.report.service import *
 
 
-class ExportMixin(DecodeMatrixDataFromBillMixin, FileMixin):
+class ExportMixin(DecodeMatrixDataFromBillMixin, StreamingFileMixin):
     """ 导出服务 """
     @classmethod
-    def _export_report_bills(cls, report_bills: List[ReportBill]) -> IO:
-        """ 导出报表账单 """
-        file_path = cls.__generate_file_path()
-        matrix_data: List[List[Any]] = cls._decode_matrix_data_from_bills(report_bills)
-        ExcelHelper.save_matrix_data_into_file(matrix_data, file_path)
-        return cls._read_file(file_path)
+    def _stream_report_bills(
+            cls, bill_periods: List[BillPeriod], business_modelx_codes: List[Optional[str]],
+            file_format: str) -> Tuple[str, Iterator[bytes]]:
+        """ 流式导出已锁定计费周期的报表账单，返回(文件名, 逐块返回的文件内容)，重复导出时直接返回缓存的文件 """
+        bill_period_ids = [bill_period.id for bill_period in bill_periods]
+
+        def generate() -> Iterator[bytes]:
+            lines = cls.__iter_lines_of_report_bills(bill_period_ids, business_modelx_codes)
+            return cls._iter_file_bytes(lines, file_format)
+
+        key = export_cache.make_key(const.STATIC_FT_REPORT_BILL, bill_periods,
+                                    business_modelx_codes=sorted(business_modelx_codes, key=str),
+                                    file_format=file_format)
+        return cls.__generate_file_name(file_format), cls._iter_file_bytes_with_cache(key, bill_period_ids, generate)
 
     @classmethod
-    def __generate_file_path(cls) -> str:
-        return os.path.join(cls._base_path,
-                            f'{const.STATIC_FT_REPORT_BILL}_{const.STATIC_FOPT_EXPORT}.{cls._file_suffix}')
+    def __iter_lines_of_report_bills(cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]):
+        return cls._iter_lines_of_bill_values(
+            report_repo.iter_report_bill_values(bill_period_ids, business_modelx_codes, cls._get_bill_attr_names()))
+
+    @staticmethod
+    def __generate_file_name(file_suffix: str) -> str:
+        return f'{const.STATIC_FT_REPORT_BILL}_{const.STATIC_FOPT_EXPORT}.{file_suffix}'
 
 
 class ReportApp(ExportMixin):
-    """ 生成报表详情，报表详情包含概览信息和各类维度的统计数据 """
+    """ 生成报表详情，报表详情包含概览信息和各类维度的统计数据
+
+    概览中的报表账单按ID进行键集分页，每次只查询、序列化一页；统计数据由数据库分组统计或报表快照得到
+    """
+    report_bill_page_size = 20
+    report_bill_max_page_size = 1000
+
+    @classmethod
+    def get_reports_of_bill_periods(cls, bill_periods: List[BillPeriod]) -> List[Report]:
+        """ 获取一页计费周期的报表，报表状态所需的总账账单数由一次分组统计得到 """
+        return report_repo.get_reports_of_bill_periods(bill_periods)
+
     @classmethod
-    def get_reports(cls) -> List[Report]:
-        """ 获取报表列表 """
-        return report_repo.get_reports()
+    def get_query_op_func_of_reports(cls):
+        """ 报表列表按账期倒序排列，供视图在数据库中分页，分页后由get_reports_of_bill_periods获取报表 """
+        return lambda query: query.order_by(desc(BillPeriod.timestamp), desc(BillPeriod.id))
 
     @classmethod
     def get_report_details_filter_by_business_ids(
             cls,
             start_bill_period_id: int, end_bill_period_id: int,
-            business_ids: List[int]) -> ReportDetails:
+            business_ids: List[int],
+            cursor: Optional[int] = None, page_size: Optional[int] = None) -> ReportDetails:
+        """ 获取报表详情
 
-        report_bills = cls.__get_report_bills_filter_by_business_ids(
+        :param cursor: 报表账单分页游标，即上一页的next_cursor，为None时获取第一页
+        :param page_size: 每页的报表账单数
+        """
+        page_size = cls.__get_page_size(page_size)
+
+        bill_periods, business_modelx_codes = cls.__get_bill_periods_and_business_modelx_codes(
             start_bill_period_id, end_bill_period_id, business_ids)
+        bill_period_ids = [bill_period.id for bill_period in bill_periods]
+
+        # 多取一条，用于判断是否存在下一页
+        report_bills = report_repo.get_report_bills_after(
+            bill_period_ids, business_modelx_codes, cursor, page_size + 1)
+        next_cursor = report_bills[page_size - 1].id if len(report_bills) > page_size else None
+        report_bills = report_bills[:page_size]
+
+        statistics = ReportService.statistic_bill_periods(bill_period_ids, business_modelx_codes)
 
-        return cls.__get_report_details(report_bills)
+        report_details = cls.__get_report_details(report_bills, statistics)
+        report_details.overview.page_size = page_size
+        report_details.overview.next_cursor = next_cursor
+        return report_details
 
     @classmethod
-    def export_report_bills_filter_by_business_ids(
+    def stream_report_bills_filter_by_business_ids(
             cls, start_bill_period_id: int, end_bill_period_id: int,
-            business_ids: List[int]) -> IO:
+            business_ids: List[int], file_format: str = StreamingFileMixin.FILE_FORMAT_XLSX) -> Tuple[str, Iterator[bytes]]:
+        """ 流式导出报表账单，账单通过服务端游标逐批查询、逐行写入，返回(文件名, 逐块返回的文件内容)
 
-        report_bills = cls.__get_report_bills_filter_by_business_ids(
+        导出的文件按(计费周期及其锁定状态、更新时间, 业务, 文件格式)缓存，计费周期解锁或总账账单变化时失效
+        """
+        bill_periods, business_modelx_codes = cls.__get_bill_periods_and_business_modelx_codes(
             start_bill_period_id, end_bill_period_id, business_ids)
 
-        return cls._export_report_bills(report_bills)
+        return cls._stream_report_bills(bill_periods, business_modelx_codes, file_format)
 
     @classmethod
     def get_report_details_filter_by_department(
@@ -65,72 +109,51 @@ class ReportApp(ExportMixin):
         raise NotImplementedError
 
     @classmethod
-    def __get_report_bills_filter_by_business_ids(
-            cls, start_bill_period_id: int, end_bill_period_id: int, business_ids: List[int]) -> List[ReportBill]:
+    def __get_bill_periods_and_business_modelx_codes(
+            cls, start_bill_period_id: int, end_bill_period_id: int,
+            business_ids: List[int]) -> Tuple[List[BillPeriod], List[Optional[str]]]:
+        """ 获取时间范围内的计费周期及业务ID对应的业务编码，计费周期须均已锁定 """
 
         assure_has_permission_of_given_business_ids(business_ids)
 
         business_modelx_codes = convert_business_ids_2_business_modelx_codes(business_ids)
 
-        start_bill_period_aggr = BillPeriodAggr.get_by_id_or_raise_404(start_bill_period_id)
-        end_bill_period_aggr = BillPeriodAggr.get_by_id_or_raise_404(end_bill_period_id)
-
-        bill_periods: List[BillPeriod] = BillPeriod.query.filter(
-            and_(BillPeriod.timestamp >= start_bill_period_aggr.bill_period.timestamp,
-                 BillPeriod.timestamp <= end_bill_period_aggr.bill_period.timestamp)).all()
+        # 一条查询得到范围内的计费周期及其锁定状态
+        bill_periods = report_repo.get_bill_periods_in_range(start_bill_period_id, end_bill_period_id)
+        bill_period_ids = {bill_period.id for bill_period in bill_periods}
+        if start_bill_period_id not in bill_period_ids or end_bill_period_id not in bill_period_ids:
+            # 起止计费周期不存在或起始晚于截止时，与逐个获取时的行为一致
+            BillPeriodAggr.get_by_id_or_raise_404(start_bill_period_id)
+            BillPeriodAggr.get_by_id_or_raise_404(end_bill_period_id)
+            bill_periods = []
 
-        report_bills = []
         for bill_period in bill_periods:
-            bill_period_aggr = BillPeriodAggr(bill_period)
+            if not bill_period.is_locked:
+                raise BadRequest(f'计费周期（{bill_period.pretty_str}）状态异常：未锁定。')
 
-            if bill_period_aggr.is_locked:
-                report_aggr = ReportAggr.get_by_bill_period_id(bill_period.id)
-                report_bills.extend(report_aggr.get_report_bills_by_business_modelx_codes(business_modelx_codes))
-            else:
-                raise BadRequest(f'计费周期（{bill_period_aggr.bill_period.pretty_str}）状态异常：未锁定。')
+        return bill_periods, business_modelx_codes
 
-        return report_bills
+    @classmethod
+    def __get_page_size(cls, page_size: Optional[int]) -> int:
+        if page_size is None:
+            return cls.report_bill_page_size
+        if page_size < 1 or page_size > cls.report_bill_max_page_size:
+            raise BadRequest(f'每页的报表账单数须在1至{cls.report_bill_max_page_size}之间。')
+        return page_size
 
     @classmethod
-    def __get_report_details(cls, report_bills: List[ReportBill]) -> ReportDetails:
+    def __get_report_details(cls, report_bills: List[ReportBill], statistics: ReportStatistics) -> ReportDetails:
         """ 获取报表详情 """
 
-        # 获取报表详情要素
-        total = cls.__calc_total(report_bills)
-        consumption_trend = cls.__statistic_consumption_trend(report_bills)
-        business_distribution = cls.__statistic_business_distribution(report_bills)
-        service_type_distribution = cls.__statistic_service_type_distribution(report_bills)
-        type_level_1_distribution = cls.__statistic_type_level_1_distribution(report_bills)
-
         # 组装概览和趋势分布图
-        overview = ReportOverview(bills=report_bills, total=total)
+        overview = ReportOverview(bills=report_bills, total=statistics.total, bill_cnt=statistics.bill_cnt)
         plots = ReportPlots(
-            consumption_trend=consumption_trend,
-            business_distribution=business_distribution,
-            service_type_distribution=service_type_distribution,
-            type_level_1_distribution=type_level_1_distribution)
+            consumption_trend=statistics.consumption_trend,
+            business_distribution=statistics.business_distribution,
+            service_type_distribution=statistics.service_type_distribution,
+            type_level_1_distribution=statistics.type_level_1_distribution)
 
         # 组装报表详情并返回
         report_details = ReportDetails(overview=overview, plots=plots)
 
         return report_details
-
-    @classmethod
-    def __calc_total(cls, report_bills: List[ReportBill]) -> float:
-        return ReportService.calc_total(report_bills)
-
-    @classmethod
-    def __statistic_consumption_trend(cls, report_bills: List[ReportBill]) -> List[ServiceTypeConsumptionTrend]:
-        return ReportService.statistic_consumption_trend(report_bills)
-
-    @classmethod
-    def __statistic_business_distribution(cls, report_bills: List[ReportBill]) -> List[BusinessDataPoint]:
-        return ReportService.statistic_business_distribution(report_bills)
-
-    @classmethod
-    def __statistic_service_type_distribution(cls, report_bills: List[ReportBill]) -> List[ServiceTypeDataPoint]:
-        return ReportService.statistic_service_type_distribution(report_bills)
-
-    @classmethod
-    def __statistic_type_level_1_distribution(cls, report_bills: List[ReportBill]) -> List[TypeLevel1DataPoint]:
-        return ReportService.statistic_type_level_1_distribution(report_bills)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8-
 
+import io
 import os
 import pytest
+from openpyxl import load_workbook
 from werkzeug.exceptions import BadRequest
 
 import common.static as const
@@ -106,6 +108,16 @@ class TestBillPeriodApp:
         total = decimal.quantize(sum([ledger_bill.actually_paid for ledger_bill in aggr.ledger_bills]))
         assert total == aggr.original_bills[0].actually_paid
 
+    def test_submit_split(self, bill_period_aggr_with_original_bills_and_split_rules):
+        aggr = bill_period_aggr_with_original_bills_and_split_rules
+
+        # 未启动任务执行器时，任务在当前请求内执行
+        job = BillPeriodApp.submit_split(aggr.bill_period.id)
+
+        assert job['state'] == 'succeeded'
+        assert (job['processed'], job['total']) == (1, 1)
+        assert len(aggr.ledger_bills) == 3
+
     @pytest.mark.skipif(not_has_sensitive_excel_file_of_original_bills(), reason="未发现未脱敏的完整月计费周期账单文件")
     def test_split_2(self, monkeypatch, shared_datadir, bill_subject_factory, provider_factory, bill_period_aggr):
         """ 使用12月测试数据测试，修复decimal相关异常 """
@@ -243,6 +255,19 @@ class TestBillPeriodApp:
 
         assert len(from_aggr.ledger_bills) == len(to_aggr.original_bills)
 
+    def test_stream_ledger_bills(self, bill_period_aggr, ledger_bill):
+        aggr = bill_period_aggr
+        aggr.set_ledger_bills([ledger_bill])
+
+        file_name, chunks = BillPeriodApp.stream_ledger_bills(aggr.bill_period.id, file_format='xlsx')
+        assert file_name.endswith('.xlsx')
+
+        wb = load_workbook(io.BytesIO(b''.join(chunks)), read_only=True)
+        assert len(list(wb.worksheets[0].iter_rows())) == 2
+
+        with pytest.raises(BadRequest):
+            BillPeriodApp.stream_ledger_bills(aggr.bill_period.id, file_format='pdf')
+
     def test_export_ledger_bills_2(self, bill_period_aggr):
         """ 因缺少数据导出失败 """
         aggr = bill_period_aggr
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import pytest
+from werkzeug.exceptions import InternalServerError
+
 from .meta import BusinessApp
+from ..domain.meta import business_index
+from ..domain.meta.modelx import LocalModelXBusiness, LocalModelXSource
 from ..domain.meta.repo import repo
 
 from *****_service.modelx_service import ModelxServiceRpc
@@ -48,3 +53,38 @@ class TestBusinessApp:
         BusinessApp.sync()
         businesses = repo.get_businesses()
         assert len(businesses) == num_of_business
+
+
+@pytest.fixture
+def modelx_source(monkeypatch) -> LocalModelXSource:
+    source = LocalModelXSource([
+        LocalModelXBusiness(id=f'test_sync_{i}', code=f'test_sync_{i}', name=f'同步测试{i}')
+        for i in range(3)])
+    monkeypatch.setattr(BusinessApp, 'source', source)
+    return source
+
+
+class TestBusinessAppWithLocalSource:
+    def test_sync(self, modelx_source):
+        result = BusinessApp.sync()
+        assert result.created == 3
+
+        # 内容未变化时不做写入
+        result = BusinessApp.sync()
+        assert not result.is_changed
+        assert result.unchanged == 3
+
+        modelx_source.businesses[0] = modelx_source.businesses[0]._replace(name='同步测试0-改名')
+        modelx_source.businesses.pop()
+        result = BusinessApp.sync()
+        assert (result.created, result.updated, result.deleted, result.unchanged) == (0, 1, 1, 1)
+
+        index = business_index()
+        assert index.get_name('test_sync_0') == '同步测试0-改名'
+        assert not index.has_modelx_code('test_sync_2')
+
+    def test_sync_empty(self, modelx_source):
+        modelx_source.businesses.clear()
+
+        with pytest.raises(InternalServerError):
+            BusinessApp.sync()
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 import pytest
 
+import common.static as const
 import service.controls.apps.common as common
 from .report import *
+from ..domain.report.cache import ExportCache
 
 
 @pytest.fixture
@@ -53,6 +57,24 @@ def mock_get_user_info():
 
 
 class TestReportApp:
+    def test_get_reports(self, bill_period_aggr_factory, parameters_of_get_report_details_filter_by_business_ids):
+        start_aggr, end_aggr, _ = parameters_of_get_report_details_filter_by_business_ids
+        unlocked_aggr = bill_period_aggr_factory(year=2021, month=12)
+
+        def get_reports(offset: int, limit: int) -> List[Report]:
+            # 与视图相同：按get_query_op_func_of_reports的排序在数据库中分页
+            query = ReportApp.get_query_op_func_of_reports()(BillPeriod.query)
+            return ReportApp.get_reports_of_bill_periods(query.offset(offset).limit(limit).all())
+
+        reports = get_reports(0, 2)
+        assert [report.bill_period_id for report in reports] == [unlocked_aggr.bill_period.id, end_aggr.bill_period.id]
+        assert reports[0].state == const.REPORT_STATE_NOT_GENE
+        assert reports[1].state == const.REPORT_STATE_GENERATED
+        assert reports[1].ledger_bill_cnt == 3
+
+        reports = get_reports(2, 2)
+        assert reports[0].bill_period_id == start_aggr.bill_period.id
+
     def test_get_report_details_filter_by_business_ids(
             self,
             monkeypatch,
@@ -95,6 +117,109 @@ class TestReportApp:
         assert len(details.plots.business_distribution) == 3      # b1 and b2 and None
         assert len(details.plots.type_level_1_distribution) == 2  # t1 and None
 
+    def test_get_report_details_filter_by_business_ids_paginated(
+            self,
+            monkeypatch,
+            parameters_of_get_report_details_filter_by_business_ids):
+        """ 报表账单按ID分页，统计数据不受分页影响 """
+        start_aggr, end_aggr, bids = parameters_of_get_report_details_filter_by_business_ids
+
+        monkeypatch.setattr(common, 'get_user_info', mock_get_user_info)
+
+        details = ReportApp.get_report_details_filter_by_business_ids(
+            start_aggr.bill_period.id, end_aggr.bill_period.id, bids, page_size=3)
+
+        assert len(details.overview.bills) == 3
+        assert details.overview.bill_cnt == 4
+        assert details.overview.total == 550000.0
+        assert details.overview.next_cursor == details.overview.bills[-1].id
+
+        next_details = ReportApp.get_report_details_filter_by_business_ids(
+            start_aggr.bill_period.id, end_aggr.bill_period.id, bids,
+            cursor=details.overview.next_cursor, page_size=3)
+
+        assert len(next_details.overview.bills) == 1
+        assert next_details.overview.next_cursor is None
+        assert next_details.overview.bills[0].id > details.overview.next_cursor
+
+    def test_stream_report_bills_filter_by_business_ids(
+            self,
+            monkeypatch,
+            parameters_of_get_report_details_filter_by_business_ids):
+        start_aggr, end_aggr, bids = parameters_of_get_report_details_filter_by_business_ids
+
+        monkeypatch.setattr(common, 'get_user_info', mock_get_user_info)
+
+        file_name, chunks = ReportApp.stream_report_bills_filter_by_business_ids(
+            start_aggr.bill_period.id, end_aggr.bill_period.id, bids, file_format='csv')
+
+        assert file_name.endswith('.csv')
+        lines = b''.join(chunks).decode('utf-8-sig').splitlines()
+        # 表头及4条报表账单
+        assert len(lines) == 5
+        assert lines[0].startswith('合同编号,')
+
+    def test_stream_report_bills_from_export_cache(
+            self,
+            monkeypatch, tmp_path,
+            parameters_of_get_report_details_filter_by_business_ids):
+        """ 重复导出时直接返回缓存的文件，计费周期解锁后缓存失效 """
+        start_aggr, end_aggr, bids = parameters_of_get_report_details_filter_by_business_ids
+
+        monkeypatch.setattr(common, 'get_user_info', mock_get_user_info)
+        monkeypatch.setattr(export_cache, 'cache_dir', str(tmp_path))
+
+        def stream():
+            _, chunks = ReportApp.stream_report_bills_filter_by_business_ids(
+                start_aggr.bill_period.id, end_aggr.bill_period.id, bids, file_format='csv')
+            return b''.join(chunks)
+
+        content = stream()
+
+        def iter_report_bill_values(*args, **kwargs):
+            raise AssertionError('export cache missed')
+
+        with monkeypatch.context() as m:
+            m.setattr(report_repo, 'iter_report_bill_values', iter_report_bill_values)
+            assert stream() == content
+
+        start_aggr.unlock()
+        assert not list(tmp_path.iterdir())
+
+    def test_export_cache_removes_tmp_files(self, tmp_path):
+        """ 中途中断的导出不遗留临时文件，遗留的过期临时文件在淘汰时删除 """
+        cache = ExportCache(str(tmp_path))
+
+        chunks = cache.iter_and_put('interrupted', [1], iter([b'a', b'b']))
+        assert next(chunks) == b'a'
+        chunks.close()
+        assert not list(tmp_path.iterdir())
+
+        stale_tmp_path = tmp_path / 'stale.tmp'
+        stale_tmp_path.write_bytes(b'a')
+        os.utime(stale_tmp_path, (0, 0))
+        writing_tmp_path = tmp_path / 'writing.tmp'
+        writing_tmp_path.write_bytes(b'a')
+
+        assert b''.join(cache.iter_and_put('completed', [1], iter([b'a', b'b']))) == b'ab'
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['completed', 'completed.json', 'writing.tmp']
+
+    def test_export_cache_skips_invalidated_during_export(self, tmp_path):
+        """ 导出期间计费周期被失效时，导出的旧数据不放入缓存 """
+        cache = ExportCache(str(tmp_path))
+
+        chunks = cache.iter_and_put('invalidated', [1, 2], iter([b'a', b'b']))
+        assert next(chunks) == b'a'
+        cache.invalidate_now(2)
+        assert b''.join(chunks) == b'b'
+        assert cache.open('invalidated') is None
+        assert not list(tmp_path.iterdir())
+
+        # 失效后开始的导出正常缓存
+        assert b''.join(cache.iter_and_put('invalidated', [1, 2], iter([b'a', b'b']))) == b'ab'
+        with cache.open('invalidated') as f:
+            assert f.read() == b'ab'
+
     def test_get_report_details_filter_by_business_ids_3(self, monkeypatch, bill_period_aggr):
         """ 因计费周期状态异常而失败 """
         start_aggr = bill_period_aggr
@@ -4,28 +4,35 @@
 # 1. 用于校验用户是否为指定的角色之一或为管理员
 # 2. 用于校验用户是否具有所有指定业务的权限或为管理员
 
-from typing import List
+from typing import List, Optional
 import common.static as const
 from ..domain.user.aggr import UserAggr
+from ..domain.user.service import UserPrincipalService
+from ..domain.user.uc import IUcClient
 from common.util.auth import get_user_info
 from common.util.api import *****Api, UcUser
 
 
+class UcApiClient(IUcClient):
+    """ 通过用户中心接口获取用户 """
+    def get_user(self, uc_user_id: int) -> Optional[UcUser]:
+        return *****Api.uc_get_user(uc_user_id)
+
+
+UserPrincipalService.uc_client = UcApiClient()
+
+
 def assure_is_admin_or_is_one_of_given_roles(roles: List[const.UserType]):
-    """ 校验用户是否为管理员或者为指定的角色之一，不是时抛出异常 """
+    """ 校验用户是否为管理员或者为指定的角色之一，不是时抛出异常
+
+    用户身份经缓存解析，同一请求内及ttl内的后续请求不再访问用户中心与数据库
+    """
     user_info = get_user_info()
 
     if user_info.is_admin:
         return
 
-    uc_user = *****Api.uc_get_user(user_info.id)
-
-    if not uc_user:
-        UserAggr.raise_401()
-
-    user_aggr = UserAggr.get_by_email(uc_user.email)
-    if not user_aggr:
-        UserAggr.raise_401()
+    user_aggr = UserAggr.get_by_uc_user_id_or_401(user_info.id)
 
     if user_aggr.is_admin:
         return
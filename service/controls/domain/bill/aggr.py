@@ -1,20 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import datetime
-from typing import List, Optional
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
 from werkzeug.exceptions import Conflict
 
 from common.util.log import get_logger
 from .iface import IBillPeriodAggr
-from .entity import BillPeriod, OriginalBill, LedgerBill, SplitRule
+from .entity import BillPeriod, OriginalBill, LedgerBill, SplitRule, BillRow
 from .event import \
     BillPeriodDeleted, BillPeriodCreated, \
-    OriginalBillCreated, LedgerBillCreated, \
+    OriginalBillCreated, OriginalBillsCreated, LedgerBillCreated, \
     BillPeriodOriginBillsReady, \
-    OriginalBillUpdated, LedgerBillUpdated, \
+    BillPeriodLocked, BillPeriodUnlocked, BillPeriodLedgerBillsChanged, \
+    OriginalBillUpdated, LedgerBillUpdated, LedgerBillDeleted, \
     SplitRuleCreated, SplitRuleUpdated
 from .repo import repo
+from .spec import original_bill_spec, ledger_bill_spec
+from .val_obj import BillPeriodStatistics
 from ..event import EventManager
 
 logger = get_logger('domain:BillPeriodAggr')
@@ -40,6 +43,15 @@ class BillPeriodAggr(IBillPeriodAggr):
     def ledger_bills(self) -> List[LedgerBill]:
         return self.bill_period.ledger_bills
 
+    def get_bill_cnt(self, bill_type: int) -> int:
+        return repo.get_bill_cnt(self.bill_period.id, bill_type)
+
+    def get_statistics(self) -> BillPeriodStatistics:
+        return repo.get_statistics([self.bill_period.id])[self.bill_period.id]
+
+    def iter_bill_values(self, bill_type: int, attr_names: List[str]) -> Iterator[Tuple[Any, ...]]:
+        return repo.iter_bill_values(self.bill_period.id, bill_type, attr_names)
+
     @property
     def split_rules(self) -> List[SplitRule]:
         return self.bill_period.split_rules
@@ -85,22 +97,22 @@ class BillPeriodAggr(IBillPeriodAggr):
         self.bill_period.year = year
         self.bill_period.month = month
         self.bill_period.timestamp = dt
-        self.bill_period.is_locked = is_locked
+        self.__set_is_locked(is_locked)
 
     def delete(self):
         self.bill_period.delete()
         # self.__notify_deleted()
 
     def lock(self):
-        self.bill_period.is_locked = True
+        self.__set_is_locked(True)
 
     def unlock(self):
-        self.bill_period.is_locked = False
+        self.__set_is_locked(False)
 
     def create_original_bill(self, original_bill: OriginalBill):
         """  创建原始账单 """
         self.bill_period.bills.append(original_bill)
-        self.__notify_original_bill_created(original_bill.id)
+        self.__notify_original_bill_created(original_bill)
 
     def update_original_bill(self, original_bill: OriginalBill):
         """ 更新原始账单 """
@@ -111,7 +123,7 @@ class BillPeriodAggr(IBillPeriodAggr):
         else:
             self.bill_period.bills.remove(current)
             self.bill_period.bills.append(new)
-            self.__notify_original_bill_updated(new.id)
+            self.__notify_original_bill_updated(new)
 
     def create_ledger_bill(self, ledger_bill: LedgerBill):
         """ 创建总账账单 """
@@ -121,7 +133,7 @@ class BillPeriodAggr(IBillPeriodAggr):
         ledger_bill.bill_period_id = self.bill_period.id
         self.bill_period.bills.append(ledger_bill)
 
-        self.__notify_ledger_bill_created(ledger_bill.id)
+        self.__notify_ledger_bill_created(ledger_bill)
 
     def update_ledger_bill(self, ledger_bill: LedgerBill):
         """ 更新总账账单 """
@@ -132,11 +144,20 @@ class BillPeriodAggr(IBillPeriodAggr):
         else:
             self.bill_period.bills.remove(current)
             self.bill_period.bills.append(new)
-            self.__notify_ledger_bill_updated(new.id)
+            self.__notify_ledger_bill_updated(new)
+
+    def delete_ledger_bill(self, ledger_bill: LedgerBill):
+        """ 删除总账账单 """
+        current = self.bill_period.bills.filter_by(id=ledger_bill.id).first()
+        if not current:
+            LedgerBill.raise_not_found(id=ledger_bill.id)
+        else:
+            current.delete()
+            self.__notify_ledger_bill_deleted(current)
 
     def create_split_rule(self, split_rule: SplitRule):
         self.bill_period.split_rules.append(split_rule)
-        self.__notify_split_rule_created(split_rule.id)
+        self.__notify_split_rule_created(split_rule)
 
     def update_split_rule(self, split_rule: SplitRule):
         """ 更新分账规则 """
@@ -150,24 +171,88 @@ class BillPeriodAggr(IBillPeriodAggr):
             SplitRule.raise_not_found(id=new.id)
 
         else:
-            self.__notify_split_rule_updated(new.id)
+            self.__notify_split_rule_updated(new)
 
     def set_original_bills(self, original_bills: List[OriginalBill]):
         """ 设置计费周期的原始账单
 
         计费周期内还未有原始账单时，直接设置即可；若计费周期内已有原始账单，则清空原有原始账单，再设置
 
+        替换以集合的方式完成：
+
+        1. 原有原始账单通过一条UPDATE语句软删除
+        2. 已持久化的原始账单通过一条UPDATE语句移入计费周期，未持久化的原始账单通过一条INSERT语句写入
+        3. 只发出一个原始账单批量创建事件，由事件处理函数对计费周期内的原始账单统一校验
+
+        """
+        repo.delete_original_bills(self.bill_period.id,
+                                   excluded_ids=[item.id for item in original_bills if item.id is not None])
+        repo.add_bills(self.bill_period.id, original_bills)
+
+        logger.info(f'{len(original_bills)} original bills set to bill period {self.bill_period.pretty_str}.')
+        self.__notify_original_bills_created()
+
+    def set_original_bill_rows(self, original_bill_row_batches: Iterable[List[BillRow]]) -> int:
+        """ 使用分批的账单行设置计费周期的原始账单，返回原始账单数
+
+        与set_original_bills的结果一致，区别在于：
+
+        1. 逐批校验原始账单并通过一条INSERT语句写入，同一时刻只有一批账单在内存中
+        2. 账单行在写入前已完成校验，不发出原始账单批量创建事件
+
         """
-        if len(self.original_bills) > 0:
-            self.__clean_original_bills()
+        spec = original_bill_spec()
 
-        for original_bill in original_bills:
-            self.create_original_bill(original_bill)
+        repo.delete_original_bills(self.bill_period.id)
+
+        cnt = 0
+        for original_bill_rows in original_bill_row_batches:
+            original_bill_rows = spec.append_exception_of_bill_rows(original_bill_rows)
+            repo.bulk_insert_bill_rows(self.bill_period.id, original_bill_rows)
+            cnt += len(original_bill_rows)
+
+        logger.info(f'{cnt} original bills set to bill period {self.bill_period.pretty_str}.')
+        return cnt
 
     def set_ledger_bills(self, ledger_bills: List[LedgerBill]):
         if len(self.ledger_bills) > 0:
             self.__clean_ledger_bills()
         self.__create_ledger_bills(ledger_bills)
+        self.__notify_ledger_bills_changed_if_locked()
+
+    def set_ledger_bill_rows(self, ledger_bill_rows: List[BillRow]):
+        """ 使用账单行批量设置计费周期的总账账单
+
+        与set_ledger_bills的结果一致，区别在于：
+
+        1. 写入前统一校验所有总账账单，而不是逐条发出总账账单创建事件
+        2. 原有总账账单通过一条UPDATE语句移出计费周期，新的总账账单通过一条INSERT语句写入
+
+        """
+        ledger_bill_rows = ledger_bill_spec().mark_exception_of_bill_rows(ledger_bill_rows)
+
+        repo.detach_ledger_bills(self.bill_period.id)
+        repo.bulk_insert_bill_rows(self.bill_period.id, ledger_bill_rows)
+
+        logger.info(f'{len(ledger_bill_rows)} ledger bills set to bill period {self.bill_period.pretty_str}.')
+
+        self.__notify_ledger_bills_changed_if_locked()
+
+    def replace_ledger_bill_rows_of_original_bills(self, original_bill_ids: List[int], ledger_bill_rows: List[BillRow]):
+        """ 使用账单行替换指定原始账单的总账账单，其他原始账单的总账账单保持不变
+
+        :param original_bill_ids: 重新分账的原始账单ID
+        :param ledger_bill_rows: 这些原始账单重新分账得到的总账账单行
+        """
+        ledger_bill_rows = ledger_bill_spec().mark_exception_of_bill_rows(ledger_bill_rows)
+
+        repo.detach_ledger_bills(self.bill_period.id, parent_ids=original_bill_ids)
+        repo.bulk_insert_bill_rows(self.bill_period.id, ledger_bill_rows)
+
+        logger.info(f'ledger bills of {len(original_bill_ids)} original bills replaced by '
+                    f'{len(ledger_bill_rows)} ledger bills in bill period {self.bill_period.pretty_str}.')
+
+        self.__notify_ledger_bills_changed_if_locked()
 
     def set_split_rules(self, split_rules: List[SplitRule]):
         if len(self.split_rules) > 0:
@@ -177,12 +262,19 @@ class BillPeriodAggr(IBillPeriodAggr):
             self.create_split_rule(split_rule)
 
     def notify_original_bills_ready(self):
+        """ 通知原始账单已就绪，由事件处理函数进行分账 """
         e = BillPeriodOriginBillsReady(self.bill_period.id)
         EventManager.emit(e)
 
-    def __clean_original_bills(self):
-        for original_bill in self.original_bills:
-            self.bill_period.bills.remove(original_bill)
+    def __set_is_locked(self, is_locked: bool):
+        """ 设置锁定状态，状态发生变化时发出锁定或解锁事件 """
+        was_locked = bool(self.bill_period.is_locked)
+        self.bill_period.is_locked = is_locked
+
+        if is_locked and not was_locked:
+            self.__notify_locked()
+        elif not is_locked and was_locked:
+            self.__notify_unlocked()
 
     def __clean_split_rules(self):
         for split_rule in self.split_rules:
@@ -204,34 +296,51 @@ class BillPeriodAggr(IBillPeriodAggr):
         e = BillPeriodDeleted(self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_original_bill_created(original_bill_id: int):
-        e = OriginalBillCreated(original_bill_id)
+    def __notify_locked(self):
+        e = BillPeriodLocked(self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_ledger_bill_created(ledger_bill_id: int):
-        e = LedgerBillCreated(ledger_bill_id)
+    def __notify_unlocked(self):
+        e = BillPeriodUnlocked(self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_split_rule_created(split_rule_id: int):
-        e = SplitRuleCreated(split_rule_id)
+    def __notify_ledger_bills_changed_if_locked(self):
+        """ 锁定期间总账账单被批量替换时发出事件，未锁定时不会影响报表，无需通知 """
+        if self.is_locked:
+            e = BillPeriodLedgerBillsChanged(self.bill_period.id)
+            EventManager.emit(e)
+
+    def __notify_original_bills_created(self):
+        e = OriginalBillsCreated(self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_original_bill_updated(original_bill_id: int):
-        e = OriginalBillUpdated(original_bill_id)
+    def __notify_original_bill_created(self, original_bill: OriginalBill):
+        # 事件携带实体及所属计费周期，处理事件时不再查询
+        e = OriginalBillCreated(original_bill.id, original_bill, self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_ledger_bill_updated(ledger_bill_id: int):
-        e = LedgerBillUpdated(ledger_bill_id)
+    def __notify_ledger_bill_created(self, ledger_bill: LedgerBill):
+        e = LedgerBillCreated(ledger_bill.id, ledger_bill, self.bill_period.id)
         EventManager.emit(e)
 
-    @staticmethod
-    def __notify_split_rule_updated(split_rule_id: int):
-        e = SplitRuleUpdated(split_rule_id)
+    def __notify_split_rule_created(self, split_rule: SplitRule):
+        e = SplitRuleCreated(split_rule.id, split_rule, self.bill_period.id)
+        EventManager.emit(e)
+
+    def __notify_original_bill_updated(self, original_bill: OriginalBill):
+        e = OriginalBillUpdated(original_bill.id, original_bill, self.bill_period.id)
+        EventManager.emit(e)
+
+    def __notify_ledger_bill_updated(self, ledger_bill: LedgerBill):
+        e = LedgerBillUpdated(ledger_bill.id, ledger_bill, self.bill_period.id)
+        EventManager.emit(e)
+
+    def __notify_ledger_bill_deleted(self, ledger_bill: LedgerBill):
+        e = LedgerBillDeleted(ledger_bill.id, self.bill_period.id)
+        EventManager.emit(e)
+
+    def __notify_split_rule_updated(self, split_rule: SplitRule):
+        e = SplitRuleUpdated(split_rule.id, split_rule, self.bill_period.id)
         EventManager.emit(e)
 
     @staticmethod
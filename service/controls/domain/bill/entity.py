@@ -7,5 +7,7 @@ __all__ = [
     "OriginalBill",
     "LedgerBill",
     "SplitRule",
-    "Bill"
+    "Bill",
+    "BillRow",
+    "BILL_ROW_FIELDS"
 ]
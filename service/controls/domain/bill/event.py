@@ -3,34 +3,77 @@
 # 考虑优化事件与事件处理函数的注册机制，通过在事件处理函数上使用辅助订阅的装饰器进行装饰
 # 考虑优化事件对象的生成机制，不需要让用户为每个事件定义一个类，可以在辅助订阅的装饰器中完成
 
-from typing import Optional
+from typing import Optional, Type
+
+from sqlalchemy.orm import object_session
 
 from common.util.event import EventBase
-from .entity import OriginalBill, LedgerBill, Bill, SplitRule
+from service.models import db_session
+from .entity import BillPeriod, OriginalBill, LedgerBill, Bill, SplitRule
 from .iface import IBillPeriodAggr
+from ..uow import unit_of_work
 
 
 BillPeriodAggr: Optional[IBillPeriodAggr] = None
 
 
+def get_entity(model: Type, entity_id: Optional[int], entity=None):
+    """ 获取事件涉及的实体
+
+    发出事件时携带的实体仍属于当前会话时直接使用；否则（如异步分发时）按ID从会话的身份映射中获取，身份映射中没有时才查询数据库
+
+    """
+    if entity is not None and object_session(entity) is db_session():
+        return entity
+    if entity_id is None:
+        return None
+    return model.query.get(entity_id)
+
+
 class EventBasedOnBillPeriod(EventBase):
     def __init__(self, bill_period_id: int):
         super().__init__()
         self.__bill_period_id = bill_period_id
 
+    @property
+    def bill_period_id(self) -> int:
+        return self.__bill_period_id
+
     @property
     def aggr(self) -> IBillPeriodAggr:
-        return BillPeriodAggr.get_by_id_or_raise_404(self.__bill_period_id)
+        """ 同一次分发内只加载一次，参考unit_of_work """
+        return unit_of_work.get_or_load(('bill_period_aggr', self.__bill_period_id), self.__load_aggr)
+
+    def __load_aggr(self) -> IBillPeriodAggr:
+        bill_period = get_entity(BillPeriod, self.__bill_period_id)
+        if bill_period is None:
+            return BillPeriodAggr.get_by_id_or_raise_404(self.__bill_period_id)
+        return BillPeriodAggr(bill_period)
 
 
 class EventBasedOnBill(EventBasedOnBillPeriod):
-    def __init__(self, bill_id: int):
+    def __init__(self, bill_id: Optional[int], bill: Optional[Bill] = None, bill_period_id: Optional[int] = None):
+        """
+        :param bill_id: 账单ID
+        :param bill: 发出事件时的账单，处理事件时直接使用，不再查询
+        :param bill_period_id: 账单所属计费周期的ID，为空时从账单获取
+        """
         self.__bill_id = bill_id
-        EventBasedOnBillPeriod.__init__(self, self.bill.bill_period_id)
+        self.__bill = bill
+        if bill_period_id is None:
+            bill_period_id = self.bill.bill_period_id
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
+
+    @property
+    def bill_id(self) -> int:
+        if self.__bill_id is None and self.__bill is not None:
+            # 发出事件时账单可能尚未写入数据库
+            return self.__bill.id
+        return self.__bill_id
 
     @property
     def bill(self) -> OriginalBill:
-        return Bill.query.filter_by(id=self.__bill_id).first()
+        return get_entity(Bill, self.bill_id, self.__bill)
 
 
 class BillPeriodCreated(EventBasedOnBillPeriod):
@@ -54,11 +97,42 @@ class BillPeriodOriginBillsReady(EventBasedOnBillPeriod):
         EventBasedOnBillPeriod.__init__(self, bill_period_id)
 
 
+class BillPeriodLocked(EventBasedOnBillPeriod):
+    name = 'bill_period_locked'
+
+    def __init__(self, bill_period_id: int):
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
+
+
+class BillPeriodUnlocked(EventBasedOnBillPeriod):
+    name = 'bill_period_unlocked'
+
+    def __init__(self, bill_period_id: int):
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
+
+
+class BillPeriodLedgerBillsChanged(EventBasedOnBillPeriod):
+    """ 计费周期的总账账单被批量替换 """
+    name = 'bill_period_ledger_bills_changed'
+
+    def __init__(self, bill_period_id: int):
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
+
+
+class OriginalBillsCreated(EventBasedOnBillPeriod):
+    """ 计费周期的原始账单被批量替换，替代逐条发出的原始账单创建事件 """
+    name = 'original_bills_created'
+
+    def __init__(self, bill_period_id: int):
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
+
+
 class OriginalBillCreated(EventBasedOnBill):
     name = 'original_bill_created'
 
-    def __init__(self, original_bill_id: int):
-        EventBasedOnBill.__init__(self, original_bill_id)
+    def __init__(self, original_bill_id: Optional[int],
+                 original_bill: Optional[OriginalBill] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnBill.__init__(self, original_bill_id, original_bill, bill_period_id)
 
     @property
     def original_bill(self) -> OriginalBill:
@@ -68,8 +142,9 @@ class OriginalBillCreated(EventBasedOnBill):
 class LedgerBillCreated(EventBasedOnBill):
     name = 'ledger_bill_created'
 
-    def __init__(self, ledger_bill_id: int):
-        EventBasedOnBill.__init__(self, ledger_bill_id)
+    def __init__(self, ledger_bill_id: Optional[int],
+                 ledger_bill: Optional[LedgerBill] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnBill.__init__(self, ledger_bill_id, ledger_bill, bill_period_id)
 
     @property
     def ledger_bill(self) -> LedgerBill:
@@ -79,8 +154,9 @@ class LedgerBillCreated(EventBasedOnBill):
 class OriginalBillUpdated(EventBasedOnBill):
     name = 'original_bill_updated'
 
-    def __init__(self, original_bill_id: int):
-        EventBasedOnBill.__init__(self, original_bill_id)
+    def __init__(self, original_bill_id: Optional[int],
+                 original_bill: Optional[OriginalBill] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnBill.__init__(self, original_bill_id, original_bill, bill_period_id)
 
     @property
     def original_bill(self) -> OriginalBill:
@@ -90,37 +166,62 @@ class OriginalBillUpdated(EventBasedOnBill):
 class LedgerBillUpdated(EventBasedOnBill):
     name = 'ledger_bill_updated'
 
-    def __init__(self, ledger_bill_id: int):
-        EventBasedOnBill.__init__(self, ledger_bill_id)
+    def __init__(self, ledger_bill_id: Optional[int],
+                 ledger_bill: Optional[LedgerBill] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnBill.__init__(self, ledger_bill_id, ledger_bill, bill_period_id)
 
     @property
     def ledger_bill(self) -> LedgerBill:
         return self.bill
 
 
+class LedgerBillDeleted(EventBasedOnBill):
+    name = 'ledger_bill_deleted'
+
+    def __init__(self, ledger_bill_id: int, bill_period_id: int):
+        EventBasedOnBill.__init__(self, ledger_bill_id, None, bill_period_id)
+
+
 class EventBasedOnSplitRule(EventBasedOnBillPeriod):
-    def __init__(self, split_rule_id: int):
+    def __init__(self, split_rule_id: Optional[int],
+                 split_rule: Optional[SplitRule] = None, bill_period_id: Optional[int] = None):
+        """
+        :param split_rule_id: 分账规则ID
+        :param split_rule: 发出事件时的分账规则，处理事件时直接使用，不再查询
+        :param bill_period_id: 分账规则所属计费周期的ID，为空时从分账规则获取
+        """
         self.__split_rule_id = split_rule_id
-        EventBasedOnBillPeriod.__init__(self, self.split_rule.bill_period_id)
+        self.__split_rule = split_rule
+        if bill_period_id is None:
+            bill_period_id = self.split_rule.bill_period_id
+        EventBasedOnBillPeriod.__init__(self, bill_period_id)
 
     @property
     def raise_on_exception(self):
         return True
 
+    @property
+    def split_rule_id(self) -> int:
+        if self.__split_rule_id is None and self.__split_rule is not None:
+            return self.__split_rule.id
+        return self.__split_rule_id
+
     @property
     def split_rule(self) -> SplitRule:
-        return SplitRule.query.filter_by(id=self.__split_rule_id).first()
+        return get_entity(SplitRule, self.split_rule_id, self.__split_rule)
 
 
 class SplitRuleCreated(EventBasedOnSplitRule):
     name = 'split_rule_created'
 
-    def __init__(self, split_rule_id: int):
-        EventBasedOnSplitRule.__init__(self, split_rule_id)
+    def __init__(self, split_rule_id: Optional[int],
+                 split_rule: Optional[SplitRule] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnSplitRule.__init__(self, split_rule_id, split_rule, bill_period_id)
 
 
 class SplitRuleUpdated(EventBasedOnSplitRule):
     name = 'split_rule_updated'
 
-    def __init__(self, split_rule_id: int):
-        EventBasedOnSplitRule.__init__(self, split_rule_id)
+    def __init__(self, split_rule_id: Optional[int],
+                 split_rule: Optional[SplitRule] = None, bill_period_id: Optional[int] = None):
+        EventBasedOnSplitRule.__init__(self, split_rule_id, split_rule, bill_period_id)
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
-from typing import List, Optional
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
-from .entity import BillPeriod, OriginalBill, LedgerBill, SplitRule
+from .entity import BillPeriod, OriginalBill, LedgerBill, SplitRule, BillRow
+from .val_obj import BillPeriodStatistics
 
 
 class IBillPeriodAggr(metaclass=ABCMeta):
@@ -27,6 +28,21 @@ class IBillPeriodAggr(metaclass=ABCMeta):
     def ledger_bills(self) -> List[LedgerBill]:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_bill_cnt(self, bill_type: int) -> int:
+        """ 获取指定类型的账单数 """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_statistics(self) -> BillPeriodStatistics:
+        """ 获取账单统计，各类型的账单数、异常账单数、实付金额合计 """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_bill_values(self, bill_type: int, attr_names: List[str]) -> Iterator[Tuple[Any, ...]]:
+        """ 按账单ID顺序逐条返回指定类型的账单的属性值，不加载ORM对象，用于导出 """
+        raise NotImplementedError
+
     @property
     @abstractmethod
     def split_rules(self) -> List[SplitRule]:
@@ -84,6 +100,11 @@ class IBillPeriodAggr(metaclass=ABCMeta):
         """ 更新总账账单 """
         raise NotImplementedError
 
+    @abstractmethod
+    def delete_ledger_bill(self, ledger_bill: LedgerBill):
+        """ 删除总账账单 """
+        raise NotImplementedError
+
     @abstractmethod
     def create_split_rule(self, split_rule: SplitRule):
         raise NotImplementedError
@@ -97,14 +118,30 @@ class IBillPeriodAggr(metaclass=ABCMeta):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def set_original_bill_rows(self, original_bill_row_batches: Iterable[List[BillRow]]) -> int:
+        """ 使用分批的账单行设置计费周期的原始账单，返回原始账单数 """
+        raise NotImplementedError
+
     @abstractmethod
     def set_ledger_bills(self, ledger_bills: List[LedgerBill]):
         raise NotImplementedError
 
+    @abstractmethod
+    def set_ledger_bill_rows(self, ledger_bill_rows: List[BillRow]):
+        """ 使用账单行批量设置计费周期的总账账单 """
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_ledger_bill_rows_of_original_bills(self, original_bill_ids: List[int], ledger_bill_rows: List[BillRow]):
+        """ 使用账单行替换指定原始账单的总账账单，其他原始账单的总账账单保持不变 """
+        raise NotImplementedError
+
     @abstractmethod
     def set_split_rules(self, split_rules: List[SplitRule]):
         raise NotImplementedError
 
     @abstractmethod
     def notify_original_bills_ready(self):
+        """ 通知原始账单已就绪，由事件处理函数进行分账 """
         raise NotImplementedError
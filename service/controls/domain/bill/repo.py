@@ -3,12 +3,17 @@
 import datetime
 from dateutil.relativedelta import relativedelta
 from abc import ABCMeta, abstractmethod
-from typing import Optional, Type, List
+from typing import Any, Dict, Iterator, Optional, Type, List, Tuple
 
-from sqlalchemy import desc
+from sqlalchemy import desc, func, and_, or_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.attributes import set_committed_value
 
+import common.static as const
+import common.util.decimal as decimal
 from service.models import db_session
-from .entity import BillPeriod
+from .entity import BillPeriod, Bill, BillRow, BILL_ROW_FIELDS
+from .val_obj import BillPeriodStatistics
 
 __all__ = [
     "db_session",
@@ -34,6 +39,110 @@ class IBillPeriodRepo(object, metaclass=ABCMeta):
         """
         raise NotImplementedError
 
+    @classmethod
+    @abstractmethod
+    def get_bill_rows(
+            cls, bill_period_id: int, bill_type: int,
+            bill_ids: Optional[List[int]] = None,
+            attr_filters: Optional[List[Dict[str, Any]]] = None) -> List[Tuple[int, BillRow]]:
+        """ 获取计费周期内指定类型的账单行，返回(账单ID, 账单行)组成的列表，按账单ID排序
+
+        只查询账单的列，不加载ORM对象
+
+        :param bill_ids: 仅获取指定ID的账单
+        :param attr_filters: 仅获取满足任意一个过滤条件的账单，过滤条件为属性名到属性值的映射，账单的属性需全部相等
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def has_bills(cls, bill_period_id: int, bill_type: int) -> bool:
+        """ 计费周期内是否存在指定类型的账单 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_bill_cnt(cls, bill_period_id: int, bill_type: int) -> int:
+        """ 获取计费周期内指定类型的账单数 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_statistics(cls, bill_period_ids: List[int]) -> Dict[int, BillPeriodStatistics]:
+        """ 批量获取计费周期的账单统计（各类型的账单数、异常账单数、实付金额合计），返回计费周期ID到统计的映射
+
+        只执行一条分组统计的查询，查询次数与计费周期数、账单数无关
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def iter_bill_values(
+            cls, bill_period_id: int, bill_type: int, attr_names: List[str],
+            batch_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        """ 按账单ID顺序逐条返回计费周期内指定类型的账单的属性值，属性值的顺序与attr_names一致
+
+        只查询账单的列，通过服务端游标每次取batch_size条，内存占用与账单数无关；迭代期间不能修改会话
+
+        :param attr_names: 属性名列表
+        :param batch_size: 每次从数据库获取的账单数
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def detach_ledger_bills(cls, bill_period_id: int, parent_ids: Optional[List[int]] = None) -> int:
+        """ 将计费周期内的总账账单移出计费周期，返回受影响的账单数
+
+        与逐条从计费周期中移除总账账单的效果一致（所属计费周期ID置空），但只执行一条UPDATE语句
+
+        :param parent_ids: 仅移出归属于指定原始账单的总账账单
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def delete_original_bills(cls, bill_period_id: int, excluded_ids: Optional[List[int]] = None) -> int:
+        """ 软删除计费周期内的原始账单并将其移出计费周期，返回受影响的账单数
+
+        只执行一条UPDATE语句，会话中有账单时另执行一条查询，找出会话中受影响的账单并同步新的值
+
+        :param excluded_ids: 不删除指定ID的原始账单
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def add_bills(cls, bill_period_id: int, bills: List[Bill]):
+        """ 将账单批量加入计费周期
+
+        已持久化的账单通过一条UPDATE语句移入计费周期，未持久化的账单通过一条INSERT语句写入，
+        未持久化的账单对象本身不会加入会话
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_distinct_attr_values(
+            cls, bill_period_id: int, bill_type: int, attr_names: List[str]) -> List[Tuple[Any, ...]]:
+        """ 获取计费周期内指定类型的账单中，指定属性的不同取值组合 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def append_exception(cls, bill_period_id: int, bill_type: int, attr_values: Dict[str, Any], msg: str) -> int:
+        """ 为计费周期内属性取值与attr_values相同的指定类型的账单追加异常信息，返回受影响的账单数
+
+        与逐条调用Bill.append_exception的效果一致，但只执行一条UPDATE语句
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def bulk_insert_bill_rows(cls, bill_period_id: int, bill_rows: List[BillRow]):
+        """ 将账单行批量写入计费周期，只执行一条INSERT语句 """
+        raise NotImplementedError
+
 
 class BillPeriodRepo(IBillPeriodRepo):
     @classmethod
@@ -42,5 +151,198 @@ class BillPeriodRepo(IBillPeriodRepo):
                                .filter(BillPeriod.id != bill_period.id) \
                                .order_by(desc(BillPeriod.timestamp)).first()
 
+    @classmethod
+    def get_bill_rows(
+            cls, bill_period_id: int, bill_type: int,
+            bill_ids: Optional[List[int]] = None,
+            attr_filters: Optional[List[Dict[str, Any]]] = None) -> List[Tuple[int, BillRow]]:
+        if bill_ids is not None and len(bill_ids) == 0:
+            return []
+
+        if attr_filters is not None and len(attr_filters) == 0:
+            return []
+
+        columns = [getattr(Bill, field) for field in BILL_ROW_FIELDS]
+        query = db_session.query(Bill.id, *columns) \
+                          .filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == bill_type)
+
+        if bill_ids is not None:
+            query = query.filter(Bill.id.in_(bill_ids))
+
+        if attr_filters is not None:
+            query = query.filter(or_(*[
+                and_(*[getattr(Bill, k) == v for k, v in attr_filter.items()])
+                for attr_filter in attr_filters
+            ]))
+
+        query = query.order_by(Bill.id)
+        return [(values[0], BillRow(*values[1:])) for values in query]
+
+    @classmethod
+    def has_bills(cls, bill_period_id: int, bill_type: int) -> bool:
+        query = db_session.query(Bill.id) \
+                          .filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == bill_type)
+        return query.first() is not None
+
+    @classmethod
+    def get_bill_cnt(cls, bill_period_id: int, bill_type: int) -> int:
+        return db_session.query(func.count(Bill.id)) \
+                         .filter(Bill.bill_period_id == bill_period_id) \
+                         .filter(Bill.type == bill_type) \
+                         .scalar()
+
+    @classmethod
+    def get_statistics(cls, bill_period_ids: List[int]) -> Dict[int, BillPeriodStatistics]:
+        statistics = {bill_period_id: BillPeriodStatistics(bill_period_id) for bill_period_id in bill_period_ids}
+        if not bill_period_ids:
+            return statistics
+
+        query = db_session.query(Bill.bill_period_id, Bill.type,
+                                 func.count(Bill.id), func.count(Bill.exception), func.sum(Bill.actually_paid)) \
+                          .filter(Bill.bill_period_id.in_(bill_period_ids)) \
+                          .group_by(Bill.bill_period_id, Bill.type)
+
+        for bill_period_id, bill_type, cnt, abnormal_cnt, total in query:
+            total = decimal.Decimal(str(total or 0))
+            if bill_type == const.BILL_TYPE_ORIGINAL:
+                statistics[bill_period_id] = statistics[bill_period_id]._replace(
+                    original_bill_cnt=cnt, abnormal_original_bill_cnt=abnormal_cnt, original_bill_total=total)
+            elif bill_type == const.BILL_TYPE_LEDGER:
+                statistics[bill_period_id] = statistics[bill_period_id]._replace(
+                    ledger_bill_cnt=cnt, abnormal_ledger_bill_cnt=abnormal_cnt, ledger_bill_total=total)
+
+        return statistics
+
+    @classmethod
+    def iter_bill_values(
+            cls, bill_period_id: int, bill_type: int, attr_names: List[str],
+            batch_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        columns = [getattr(Bill, attr_name) for attr_name in attr_names]
+        query = db_session.query(*columns) \
+                          .filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == bill_type) \
+                          .order_by(Bill.id) \
+                          .execution_options(stream_results=True) \
+                          .yield_per(batch_size)
+        for values in query:
+            yield tuple(values)
+
+    @classmethod
+    def detach_ledger_bills(cls, bill_period_id: int, parent_ids: Optional[List[int]] = None) -> int:
+        if parent_ids is not None and len(parent_ids) == 0:
+            return 0
+
+        db_session.flush()
+
+        query = Bill.query.filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == const.BILL_TYPE_LEDGER)
+
+        if parent_ids is None:
+            return query.update({Bill.bill_period_id: None}, synchronize_session='evaluate')
+        else:
+            query = query.filter(Bill.parent_id.in_(parent_ids))
+            return query.update({Bill.bill_period_id: None}, synchronize_session='fetch')
+
+    @classmethod
+    def delete_original_bills(cls, bill_period_id: int, excluded_ids: Optional[List[int]] = None) -> int:
+        # 批量UPDATE不会触发自动刷新，先写入会话中尚未刷新的账单
+        db_session.flush()
+
+        query = Bill.query.filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == const.BILL_TYPE_ORIGINAL)
+
+        if excluded_ids:
+            query = query.filter(Bill.id.notin_(excluded_ids))
+
+        # 被软删除的账单无法再被查询到，不能使其过期后重新加载，将新的值直接写入会话中受影响的账单
+        bills_in_session = cls.__get_bills_in_session(query)
+
+        deleted_at = datetime.datetime.now()
+        cnt = query.update({Bill.bill_period_id: None, Bill.deleted_at: deleted_at}, synchronize_session=False)
+        for bill in bills_in_session:
+            set_committed_value(bill, 'bill_period_id', None)
+            set_committed_value(bill, 'deleted_at', deleted_at)
+        return cnt
+
+    @classmethod
+    def add_bills(cls, bill_period_id: int, bills: List[Bill]):
+        # 先写入会话中尚未刷新的账单，使其具有ID
+        db_session.flush()
+
+        persisted_bills = [bill for bill in bills if bill.id is not None]
+        if persisted_bills:
+            Bill.query.filter(Bill.id.in_([bill.id for bill in persisted_bills])) \
+                      .update({Bill.bill_period_id: bill_period_id}, synchronize_session=False)
+            for bill in persisted_bills:
+                db_session.expire(bill, ['bill_period_id'])
+
+        cls.bulk_insert_bill_rows(bill_period_id, [
+            BillRow(*[getattr(bill, field) for field in BILL_ROW_FIELDS]) for bill in bills if bill.id is None
+        ])
+
+    @classmethod
+    def get_distinct_attr_values(
+            cls, bill_period_id: int, bill_type: int, attr_names: List[str]) -> List[Tuple[Any, ...]]:
+        query = db_session.query(*[getattr(Bill, attr_name) for attr_name in attr_names]) \
+                          .filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == bill_type) \
+                          .distinct()
+        return [tuple(values) for values in query]
+
+    @classmethod
+    def append_exception(cls, bill_period_id: int, bill_type: int, attr_values: Dict[str, Any], msg: str) -> int:
+        db_session.flush()
+
+        query = Bill.query.filter(Bill.bill_period_id == bill_period_id) \
+                          .filter(Bill.type == bill_type)
+
+        for k, v in attr_values.items():
+            column = getattr(Bill, k)
+            query = query.filter(column.is_(None) if v is None else column == v)
+
+        exception = func.coalesce(Bill.exception, '') + f'{msg}\n'
+        cnt = query.update({Bill.exception: exception}, synchronize_session=False)
+        cls.__expire_bills_in_session(bill_period_id, bill_type, ['exception'])
+        return cnt
+
+    @classmethod
+    def bulk_insert_bill_rows(cls, bill_period_id: int, bill_rows: List[BillRow]):
+        if not bill_rows:
+            return
+
+        values = []
+        for bill_row in bill_rows:
+            item = bill_row._asdict()
+            item['bill_period_id'] = bill_period_id
+            values.append(item)
+
+        db_session.execute(Bill.__table__.insert(), values)
+
+    @staticmethod
+    def __expire_bills_in_session(bill_period_id: int, bill_type: int, attr_names: List[str]):
+        """ 批量UPDATE不会同步会话中的账单，使会话中可能受影响的账单的属性过期，访问时重新加载
+
+        只检查已加载的属性，不会触发查询，属性未加载时视为可能受影响
+        """
+        for obj in list(db_session.identity_map.values()):
+            if not isinstance(obj, Bill):
+                continue
+
+            loaded = sa_inspect(obj).dict
+            if loaded.get('bill_period_id', bill_period_id) == bill_period_id \
+                    and loaded.get('type', bill_type) == bill_type:
+                db_session.expire(obj, attr_names)
+
+    @staticmethod
+    def __get_bills_in_session(query) -> List[Bill]:
+        """ 获取会话中符合查询条件的账单，只查询会话中账单的ID，不会重新加载账单 """
+        bills = dict((sa_inspect(obj).identity[0], obj) for obj in list(db_session.identity_map.values())
+                     if isinstance(obj, Bill))
+        if not bills:
+            return []
+        return [bills[id_] for id_, in query.filter(Bill.id.in_(list(bills))).with_entities(Bill.id)]
+
 
 repo: Type[IBillPeriodRepo] = BillPeriodRepo
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional
+from decimal import Decimal
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 from sqlalchemy.schema import Column
 
@@ -13,19 +14,64 @@ class BillSpec:
         self.__meta_spec = meta_spec_
 
     @property
-    def businesses(self) -> List[str]:
+    def businesses(self) -> Tuple[str, ...]:
         return self.__meta_spec.businesses
 
+    def has_business(self, business: str) -> bool:
+        return self.__meta_spec.has_business(business)
+
     def is_satisfied_by(self, bill: Bill) -> (bool, Optional[str]):
-        ok1, err1 = self._is_business_valid(bill.business_modelx_code)
-        ok2, err2 = self._is_bill_subject_valid(bill.bill_subject_name)
-        ok3, err3 = self._is_provider_valid(bill.provider_name)
+        return self.is_satisfied_by_values(bill.business_modelx_code, bill.bill_subject_name, bill.provider_name)
+
+    def is_satisfied_by_values(
+            self, business: str, bill_subject: str, provider: str) -> (bool, Optional[str]):
+        ok1, err1 = self._is_business_valid(business)
+        ok2, err2 = self._is_bill_subject_valid(bill_subject)
+        ok3, err3 = self._is_provider_valid(provider)
 
         if ok1 and ok2 and ok3:
             return True, None
         else:
             return False, "\n".join([str(e) for e in [err1, err2, err3] if e is not None])
 
+    def mark_exception_of_bill_rows(self, bill_rows: List[BillRow]) -> List[BillRow]:
+        """ 批量校验账单行，返回异常信息已被覆盖的账单行
+
+        校验结果只取决于业务、计费主体、供应商三个属性，相同的取值组合只校验一次
+
+        """
+        triple_2_err: Dict[Tuple[str, str, str], Optional[str]] = dict()
+
+        res = []
+        for bill_row in bill_rows:
+            triple = (bill_row.business_modelx_code, bill_row.bill_subject_name, bill_row.provider_name)
+            if triple not in triple_2_err:
+                _, triple_2_err[triple] = self.is_satisfied_by_values(*triple)
+            res.append(bill_row._replace(exception=triple_2_err[triple]))
+
+        return res
+
+    def append_exception_of_bill_rows(self, bill_rows: List[BillRow]) -> List[BillRow]:
+        """ 批量校验账单行，返回校验不通过时已追加异常信息的账单行
+
+        与mark_exception_of_bill_rows的区别在于保留账单行原有的异常信息，与Bill.append_exception的效果一致
+
+        """
+        triple_2_err: Dict[Tuple[str, str, str], Optional[str]] = dict()
+
+        res = []
+        for bill_row in bill_rows:
+            triple = (bill_row.business_modelx_code, bill_row.bill_subject_name, bill_row.provider_name)
+            if triple not in triple_2_err:
+                _, triple_2_err[triple] = self.is_satisfied_by_values(*triple)
+
+            err = triple_2_err[triple]
+            if err is not None:
+                bill_row = bill_row._replace(exception=f'{bill_row.exception or ""}{err}\n')
+            res.append(bill_row)
+
+        return res
+
     def _is_business_valid(self, business: str) -> (bool, Optional[str]):
         return self.__meta_spec.is_business_valid(business)
 
@@ -36,7 +82,122 @@ class BillSpec:
         return self.__meta_spec.is_provider_valid(provider)
 
 
+class BillColumnCoercionPlan:
+    """ 账单列的类型校验计划，构建后不可修改
+
+    1. 构建时逐列解析一次类型与异常信息，校验时不再访问列定义；字符串类型的列任意值均可转换，不做校验
+    2. 按列批量校验：已是目标类型的值直接通过，其余值尝试转换，同一列中相同的字符串只转换一次
+    3. 异常信息的内容与顺序与逐行、逐列校验的一致
+    """
+    __SKIPPED_COLUMNS = ("create_time", "update_time", "deleted_at")
+
+    # 可以直接通过校验的值类型
+    __PASSED_TYPES = {
+        int: frozenset([int, bool]),
+        float: frozenset([float, int, bool, Decimal]),
+        Decimal: frozenset([Decimal, float, int, bool]),
+    }
+
+    def __init__(self, columns: Iterable[Column]):
+        # (列名, 转换函数, 可直接通过的值类型, 异常信息前缀, 异常信息中的类型名)
+        self.__coercions: Tuple[Tuple[str, Callable[[Any], Any], FrozenSet[type], str, str], ...] = tuple(
+            coercion for coercion in (self.__compile(col) for col in columns) if coercion is not None)
+
+    @property
+    def column_names(self) -> Tuple[str, ...]:
+        return tuple(coercion[0] for coercion in self.__coercions)
+
+    def check_values(self, values: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """ 检测类型不匹配的属性，返回需要置空的属性名及异常信息
+
+        :param values: 属性名到属性值的映射，不包含的属性不检测
+        """
+        res = []
+        for name, cast, passed_types, comment, type_name in self.__coercions:
+            if name in values and not self.__is_valid(values[name], cast, passed_types):
+                res.append((name, self.__format_err(comment, values[name], type_name)))
+        return res
+
+    def fix_bill_rows(self, bill_rows: List[BillRow]) -> List[BillRow]:
+        """ 按列批量校验账单行，返回类型不匹配的属性已置空、异常信息已追加的账单行，校验通过的账单行原样返回 """
+        if not bill_rows:
+            return bill_rows
+
+        field_2_index = {field: i for i, field in enumerate(bill_rows[0]._fields)}
+
+        # 账单行序号 --> [(属性序号, 异常信息)]，按列的顺序追加
+        row_2_errs: Dict[int, List[Tuple[int, str]]] = dict()
+        for name, cast, passed_types, comment, type_name in self.__coercions:
+            index = field_2_index.get(name)
+            if index is None:
+                continue
+
+            value_2_err: Dict[str, Optional[str]] = dict()
+            for i, bill_row in enumerate(bill_rows):
+                value = bill_row[index]
+                if value is None or type(value) in passed_types:
+                    continue
+
+                if type(value) is str:
+                    if value not in value_2_err:
+                        value_2_err[value] = None if self.__is_valid(value, cast, passed_types) \
+                            else self.__format_err(comment, value, type_name)
+                    err = value_2_err[value]
+                else:
+                    err = None if self.__is_valid(value, cast, passed_types) \
+                        else self.__format_err(comment, value, type_name)
+
+                if err is not None:
+                    row_2_errs.setdefault(i, []).append((index, err))
+
+        if not row_2_errs:
+            return bill_rows
+
+        exception_index = field_2_index['exception']
+        res = list(bill_rows)
+        for i, errs in row_2_errs.items():
+            values = list(res[i])
+            for index, _ in errs:
+                values[index] = None
+            values[exception_index] = (values[exception_index] or '') + ''.join(f'{err}\n' for _, err in errs)
+            res[i] = res[i]._make(values)
+
+        return res
+
+    @classmethod
+    def __compile(cls, col: Column) -> Optional[Tuple[str, Callable[[Any], Any], FrozenSet[type], str, str]]:
+        if col.name in cls.__SKIPPED_COLUMNS:
+            return None
+
+        if col.name == 'actually_paid':
+            # 实付金额按浮点数转换后保留两位小数，round不会失败，只需校验能否转换为浮点数
+            return col.name, float, cls.__PASSED_TYPES[Decimal], '实付金额', 'decimal(11, 2)'
+
+        col_type = col.type.python_type
+        if col_type is str:
+            return None
+
+        passed_types = cls.__PASSED_TYPES.get(col_type, frozenset([col_type]))
+        return col.name, col_type, passed_types, col.comment, col_type.__name__
+
+    @staticmethod
+    def __is_valid(value: Any, cast: Callable[[Any], Any], passed_types: FrozenSet[type]) -> bool:
+        if value is None or type(value) in passed_types:
+            return True
+        try:
+            cast(value)
+        except (ValueError, TypeError, ArithmeticError):
+            return False
+        return True
+
+    @staticmethod
+    def __format_err(comment: str, value: Any, type_name: str) -> str:
+        return f'{comment}="{value}"类型({type_name})校验不通过，已置空，请检查并更新该属性；'
+
+
 class OriginalBillAutoFixer:
+    # 原始账单列的类型校验计划，首次使用时构建，参考BillColumnCoercionPlan
+    __plan: Optional[BillColumnCoercionPlan] = None
 
     @classmethod
     def auto_fix_and_mark_exception(cls, original_bill: OriginalBill):
@@ -49,44 +210,43 @@ class OriginalBillAutoFixer:
         #     auto_fix_func = getattr(cls.__dict__[f'_{cls.__name__}__auto_fix_{attr}'], '__func__')
         #     attr_value = getattr(original_bill, attr)
         #     setattr(original_bill, attr, auto_fix_func(attr_value))
-        cls.__auto_fix_type_mistakes(original_bill)
+        values = {name: getattr(original_bill, name) for name in cls.get_plan().column_names}
+
+        for attr_name, err in cls.__auto_fix_type_mistakes(values):
+            original_bill.append_exception(err)
+            setattr(original_bill, attr_name, None)
 
     @classmethod
-    def __auto_fix_type_mistakes(cls, original_bill: OriginalBill):
-        """ 自动修复类型不匹配的属性，修复方法是将值置空 """
-        for col_ in OriginalBill.iter_columns():
-            col: Column = col_
+    def auto_fix_and_mark_exception_of_bill_row(cls, bill_row: BillRow) -> BillRow:
+        """ 检测并修复账单行中已知的异常数据，并标记异常，返回修复后的账单行
 
-            if col.name in ["create_time", "update_time", "deleted_at"]:
-                continue
+        与auto_fix_and_mark_exception的效果一致
 
-            if col.name == 'actually_paid':
-                cls.__auto_fix_actually_paid(original_bill)
-                continue
+        """
+        return cls.auto_fix_and_mark_exception_of_bill_rows([bill_row])[0]
+
+    @classmethod
+    def auto_fix_and_mark_exception_of_bill_rows(cls, bill_rows: List[BillRow]) -> List[BillRow]:
+        """ 按列批量检测并修复账单行中已知的异常数据，并标记异常，返回修复后的账单行
 
-            col_value = getattr(original_bill, col.name)
+        与逐行调用auto_fix_and_mark_exception_of_bill_row的效果一致
 
-            if col_value is not None:
-                col_type = col.type.python_type
-                try:
-                    col_type(col_value)
-                except (ValueError, TypeError):
-                    original_bill.append_exception(
-                        f'{col.comment}="{col_value}"类型({col_type.__name__})校验不通过，已置空，请检查并更新该属性；')
-                    setattr(original_bill, col.name, None)
+        """
+        return cls.get_plan().fix_bill_rows(bill_rows)
 
     @classmethod
-    def __auto_fix_actually_paid(cls, original_bill: OriginalBill):
-        attr_name = 'actually_paid'
-
-        actually_paid = getattr(original_bill, attr_name)
-        if actually_paid is not None:
-            try:
-                round(float(actually_paid), 2)
-            except (ValueError, TypeError):
-                original_bill.append_exception(
-                    f'实付金额="{actually_paid}"类型(decimal(11, 2))校验不通过，已置空，请检查并更新该属性；')
-                setattr(original_bill, attr_name, None)
+    def get_plan(cls) -> BillColumnCoercionPlan:
+        if cls.__plan is None:
+            cls.__plan = BillColumnCoercionPlan(OriginalBill.iter_columns())
+        return cls.__plan
+
+    @classmethod
+    def __auto_fix_type_mistakes(cls, values: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """ 检测类型不匹配的属性，返回需要置空的属性名及异常信息，修复方法是将值置空
+
+        :param values: 属性名到属性值的映射，不包含的属性不检测
+        """
+        return cls.get_plan().check_values(values)
 
     # @classmethod
     # def __get_attrs_that_can_be_auto_fixed(cls) -> List[str]:
@@ -133,13 +293,19 @@ class OriginalBillSpec(BillSpec):
     def fix_known_exception_cases(self, original_bill: OriginalBill):
         self.auto_fixer.auto_fix_and_mark_exception(original_bill)
 
+    def fix_known_exception_cases_of_bill_row(self, bill_row: BillRow) -> BillRow:
+        return self.auto_fixer.auto_fix_and_mark_exception_of_bill_row(bill_row)
+
+    def fix_known_exception_cases_of_bill_rows(self, bill_rows: List[BillRow]) -> List[BillRow]:
+        return self.auto_fixer.auto_fix_and_mark_exception_of_bill_rows(bill_rows)
+
 
 class LedgerBillSpec(BillSpec):
     def __init__(self, meta_spec_: MetaSpec):
         super().__init__(meta_spec_)
 
     def _is_business_valid(self, business: str) -> (bool, Optional[str]):
-        if business in self.businesses:
+        if self.has_business(business):
             return True, None
         else:
             return False, f'业务名称"{business}"非法，参考值：{"、".join(self.businesses[:3])}...'
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import pytest
+
+import common.static as const
 from ..bill.aggr import BillPeriodAggr
+from .entity import Bill, BillRow, BILL_ROW_FIELDS
+from .repo import db_session
 
 
 @pytest.fixture(params=[(2021, 9), (2021, 10), (2021, 11)])
@@ -25,3 +29,60 @@ class TestBillPeriodAggr:
         assert second.previous.bill_period.id == first.bill_period.id
         assert third.previous.bill_period.id == second.bill_period.id
         assert forth.previous.bill_period.id == third.bill_period.id
+
+    def test_set_original_bill_rows(self, bill_period_aggr, original_bill):
+        aggr = bill_period_aggr
+        aggr.set_original_bills([original_bill])
+
+        empty_row = BillRow(*[None for _ in BILL_ROW_FIELDS])
+        batches = [
+            [empty_row._replace(type=const.BILL_TYPE_ORIGINAL, provider_name='p1', actually_paid=100)],
+            [empty_row._replace(type=const.BILL_TYPE_ORIGINAL, provider_name='p2', actually_paid=200)],
+        ]
+
+        assert aggr.set_original_bill_rows(iter(batches)) == 2
+
+        original_bills = aggr.original_bills
+        assert len(original_bills) == 2
+        assert original_bill.id not in [item.id for item in original_bills]
+        # 与逐条创建原始账单一致，校验不通过时标记异常
+        assert all([item.exception is not None for item in original_bills])
+
+    def test_set_original_bills(self, bill_period_aggr, original_bill_factory):
+        aggr = bill_period_aggr
+        old = original_bill_factory(provider_name='p1', actually_paid=100)
+        aggr.set_original_bills([old])
+
+        new = original_bill_factory(provider_name='p2', actually_paid=200)
+        aggr.set_original_bills([new])
+
+        assert [item.id for item in aggr.original_bills] == [new.id]
+        # 原有原始账单被软删除，软删除的账单须显式包含已删除的记录才能查询到
+        bill_period_id, deleted_at = db_session.query(Bill.bill_period_id, Bill.deleted_at) \
+                                               .filter(Bill.id == old.id) \
+                                               .execution_options(include_deleted=True).one()
+        assert bill_period_id is None
+        assert deleted_at is not None
+        # 会话中的原有原始账单同步了新的值，访问时不会重新加载
+        assert (old.bill_period_id, old.deleted_at) == (bill_period_id, deleted_at)
+        # 一次校验所有原始账单，校验不通过时标记异常
+        assert new.exception is not None
+
+    def test_get_statistics(self, bill_period_aggr, original_bill_factory, ledger_bill_factory):
+        aggr = bill_period_aggr
+        aggr.set_original_bills([original_bill_factory(provider_name='p1', actually_paid=100),
+                                 original_bill_factory(provider_name='p2', actually_paid=200)])
+        ledger_bill = ledger_bill_factory(actually_paid=50)
+        aggr.create_ledger_bill(ledger_bill)
+
+        statistics = aggr.get_statistics()
+
+        assert statistics.original_bill_cnt == 2
+        # 供应商不存在，原始账单均被标记异常
+        assert statistics.abnormal_original_bill_cnt == 2
+        assert statistics.original_bill_total == 300
+        assert statistics.ledger_bill_cnt == 1
+        assert statistics.ledger_bill_total == 50
+
+        assert aggr.bill_period.abnormal_original_bill_cnt == statistics.abnormal_original_bill_cnt
+        assert aggr.bill_period.abnormal_ledger_bill_cnt == statistics.abnormal_ledger_bill_cnt
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import common.static as const
+from .entity import BillRow, BILL_ROW_FIELDS, OriginalBill
+from .spec import OriginalBillAutoFixer
+
+
+def make_bill_row(**kwargs) -> BillRow:
+    values = dict.fromkeys(BILL_ROW_FIELDS)
+    values['type'] = const.BILL_TYPE_ORIGINAL
+    values.update(kwargs)
+    return BillRow(**values)
+
+
+class TestOriginalBillAutoFixer:
+    def test_auto_fix_bill_rows(self):
+        bill_rows = [
+            make_bill_row(unit_price=1.5, statistic_cnt='2', actually_paid='3.14'),
+            make_bill_row(unit_price='/', statistic_cnt='/', actually_paid='abc', exception='原有异常\n'),
+            make_bill_row(unit_price='/', total=None),
+        ]
+
+        fixed = OriginalBillAutoFixer.auto_fix_and_mark_exception_of_bill_rows(bill_rows)
+
+        assert fixed[0] == bill_rows[0]
+
+        assert (fixed[1].unit_price, fixed[1].statistic_cnt, fixed[1].actually_paid) == (None, None, None)
+        assert fixed[1].exception == '原有异常\n' \
+                                     '单价="/"类型(float)校验不通过，已置空，请检查并更新该属性；\n' \
+                                     '统计量="/"类型(float)校验不通过，已置空，请检查并更新该属性；\n' \
+                                     '实付金额="abc"类型(decimal(11, 2))校验不通过，已置空，请检查并更新该属性；\n'
+
+        # 与修复原始账单的结果一致
+        original_bill = OriginalBill(**bill_rows[1]._asdict())
+        OriginalBillAutoFixer.auto_fix_and_mark_exception(original_bill)
+        assert original_bill.exception == fixed[1].exception
+        assert original_bill.unit_price is None
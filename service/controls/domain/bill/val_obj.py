@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from typing import NamedTuple
+
+import common.util.decimal as decimal
+
+__all__ = [
+    "BillPeriodStatistics"
+]
+
+
+class BillPeriodStatistics(NamedTuple):
+    """ 计费周期的账单统计，由数据库分组计数、求和得到 """
+    bill_period_id: int
+    original_bill_cnt: int = 0
+    abnormal_original_bill_cnt: int = 0
+    original_bill_total: decimal.Decimal = decimal.Decimal(0)     # 原始账单实付金额合计
+    ledger_bill_cnt: int = 0
+    abnormal_ledger_bill_cnt: int = 0
+    ledger_bill_total: decimal.Decimal = decimal.Decimal(0)       # 总账账单实付金额合计
+
+    def to_dict(self) -> dict:
+        res = self._asdict()
+        res['original_bill_total'] = float(self.original_bill_total)
+        res['ledger_bill_total'] = float(self.ledger_bill_total)
+        return res
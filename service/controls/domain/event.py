@@ -5,19 +5,28 @@ from typing import Type, Optional
 
 from werkzeug.exceptions import BadRequest
 
+import common.static as const
+
 from common.util.event import event_manager, EventBase, IEventHandler
 from common.util.log import get_logger
+from .uow import unit_of_work
 from .bill.entity import OriginalBill, LedgerBill, SplitRule
 from .bill.event import \
+    EventBasedOnBillPeriod, \
     BillPeriodCreated, BillPeriodDeleted, \
-    OriginalBillCreated, LedgerBillCreated, \
+    OriginalBillCreated, OriginalBillsCreated, LedgerBillCreated, \
     BillPeriodOriginBillsReady, \
-    OriginalBillUpdated, LedgerBillUpdated, \
+    BillPeriodLocked, BillPeriodUnlocked, BillPeriodLedgerBillsChanged, \
+    OriginalBillUpdated, LedgerBillUpdated, LedgerBillDeleted, \
     SplitRuleCreated, SplitRuleUpdated
 from .bill.spec import original_bill_spec, ledger_bill_spec
+from .bill.repo import repo as bill_repo
 from .split.spec import bill_matcher_spec, composite_split_policy_spec
 from .split.iface import IBillPeriodSplitService
 from .split.val_obj import CompositeSplitPolicy, BillMatcher
+from .split.cache import split_rule_cache
+from .report.service import ReportSnapshotService
+from .report.cache import export_cache
 
 
 BillPeriodSplitService: Optional[IBillPeriodSplitService] = None
@@ -38,6 +47,21 @@ class OriginalBillSpecMixin:
         original_bill.exception = None
         cls.check_and_append_exception(original_bill)
 
+    @classmethod
+    def check_and_append_exception_of_bill_period(cls, bill_period_id: int):
+        """ 校验计费周期内的所有原始账单
+
+        校验结果只取决于业务、计费主体、供应商三个属性，每种取值组合只校验一次，并通过一条UPDATE语句追加异常信息
+
+        """
+        spec = original_bill_spec()
+        attr_names = ['business_modelx_code', 'bill_subject_name', 'provider_name']
+        for values in bill_repo.get_distinct_attr_values(bill_period_id, const.BILL_TYPE_ORIGINAL, attr_names):
+            ok, err = spec.is_satisfied_by_values(*values)
+            if not ok:
+                bill_repo.append_exception(
+                    bill_period_id, const.BILL_TYPE_ORIGINAL, dict(zip(attr_names, values)), err)
+
 
 class LedgerBillSpecMixin:
     @classmethod
@@ -90,6 +114,7 @@ class OnBillPeriodDeleted(IEventHandler):
         cls.__clean_split_rules(e)
         cls.__clean_original_bills(e)
         cls.__clean_ledger_bills(e)
+        export_cache.invalidate(e.aggr.bill_period.id)
 
     @classmethod
     def __clean_original_bills(cls, e: BillPeriodDeleted):
@@ -115,6 +140,54 @@ class OnBillPeriodOriginalBillsReady(IEventHandler):
         BillPeriodSplitService.split_original_bills_of_bill_period(bill_period_id)
 
 
+class OnBillPeriodLocked(IEventHandler):
+    @classmethod
+    def handle(cls, e: BillPeriodLocked):
+        cls.__generate_report_snapshot(e.aggr.bill_period.id)
+
+    @classmethod
+    def __generate_report_snapshot(cls, bill_period_id: int):
+        """ 计费周期锁定后总账账单不再变化，生成报表快照 """
+        ReportSnapshotService.generate(bill_period_id)
+
+
+class OnBillPeriodUnlocked(IEventHandler):
+    @classmethod
+    def handle(cls, e: BillPeriodUnlocked):
+        cls.__invalidate_report_snapshot(e.aggr.bill_period.id)
+        cls.__invalidate_export_cache(e.aggr.bill_period.id)
+
+    @classmethod
+    def __invalidate_report_snapshot(cls, bill_period_id: int):
+        ReportSnapshotService.invalidate(bill_period_id)
+
+    @classmethod
+    def __invalidate_export_cache(cls, bill_period_id: int):
+        export_cache.invalidate(bill_period_id)
+
+
+class OnBillPeriodLedgerBillsChanged(IEventHandler):
+    @classmethod
+    def handle(cls, e: BillPeriodLedgerBillsChanged):
+        cls.__regenerate_report_snapshot(e.aggr.bill_period.id)
+        export_cache.invalidate(e.aggr.bill_period.id)
+
+    @classmethod
+    def __regenerate_report_snapshot(cls, bill_period_id: int):
+        """ 锁定期间总账账单被批量替换，重新生成报表快照 """
+        ReportSnapshotService.generate(bill_period_id)
+
+
+class ReportSnapshotMixin:
+    @classmethod
+    def invalidate_report_snapshot_if_locked(cls, e: EventBasedOnBillPeriod):
+        """ 锁定期间单条总账账单发生变化时，报表快照与导出文件缓存失效 """
+        aggr = e.aggr
+        if aggr.is_locked:
+            ReportSnapshotService.invalidate(aggr.bill_period.id)
+            export_cache.invalidate(aggr.bill_period.id)
+
+
 class OnOriginalBillCreated(OriginalBillSpecMixin, IEventHandler):
     @classmethod
     def handle(cls, e: OriginalBillCreated):
@@ -125,10 +198,18 @@ class OnOriginalBillCreated(OriginalBillSpecMixin, IEventHandler):
         cls.check_and_append_exception(original_bill)
 
 
-class OnLedgerBillCreated(LedgerBillSpecMixin, IEventHandler):
+class OnOriginalBillsCreated(OriginalBillSpecMixin, IEventHandler):
+    @classmethod
+    def handle(cls, e: OriginalBillsCreated):
+        # 计费周期可能已被删除（如删除计费周期时清空原始账单），不通过聚合根获取
+        cls.check_and_append_exception_of_bill_period(e.bill_period_id)
+
+
+class OnLedgerBillCreated(LedgerBillSpecMixin, ReportSnapshotMixin, IEventHandler):
     @classmethod
     def handle(cls, e: LedgerBillCreated):
         cls.__check_and_mark_exception(e.ledger_bill)
+        cls.invalidate_report_snapshot_if_locked(e)
 
     @classmethod
     def __check_and_mark_exception(cls, ledger_bill: LedgerBill):
@@ -155,21 +236,34 @@ class OnOriginalBillUpdated(OriginalBillSpecMixin, IEventHandler):
         cls.check_and_mark_exception(original_bill)
 
 
-class OnLedgerBillUpdated(LedgerBillSpecMixin, IEventHandler):
+class OnLedgerBillUpdated(LedgerBillSpecMixin, ReportSnapshotMixin, IEventHandler):
     @classmethod
     def handle(cls, e: LedgerBillUpdated):
         cls.__check_and_mark_exception(e.ledger_bill)
+        cls.invalidate_report_snapshot_if_locked(e)
 
     @classmethod
     def __check_and_mark_exception(cls, ledger_bill: LedgerBill):
         cls.check_and_mark_exception(ledger_bill)
 
 
+class OnLedgerBillDeleted(ReportSnapshotMixin, IEventHandler):
+    @classmethod
+    def handle(cls, e: LedgerBillDeleted):
+        cls.invalidate_report_snapshot_if_locked(e)
+
+
 class OnSplitRuleUpdated(SplitRuleSpecMixin, IEventHandler):
     @classmethod
     def handle(cls, e: SplitRuleUpdated):
+        cls.__invalidate_cache(e.split_rule)
         cls.__is_valid_or_raise(e.split_rule)
 
+    @classmethod
+    def __invalidate_cache(cls, split_rule: SplitRule):
+        """ 失效分账规则的分账策略、匹配器缓存 """
+        split_rule_cache.invalidate(split_rule.id)
+
     @classmethod
     def __is_valid_or_raise(cls, split_rule: SplitRule):
         cls._is_valid_or_raise(split_rule)
@@ -184,10 +278,15 @@ class EventManager:
             BillPeriodCreated: OnBillPeriodCreated,
             BillPeriodDeleted: OnBillPeriodDeleted,
             OriginalBillCreated: OnOriginalBillCreated,
+            OriginalBillsCreated: OnOriginalBillsCreated,
             LedgerBillCreated: OnLedgerBillCreated,
             BillPeriodOriginBillsReady: OnBillPeriodOriginalBillsReady,
+            BillPeriodLocked: OnBillPeriodLocked,
+            BillPeriodUnlocked: OnBillPeriodUnlocked,
+            BillPeriodLedgerBillsChanged: OnBillPeriodLedgerBillsChanged,
             OriginalBillUpdated: OnOriginalBillUpdated,
             LedgerBillUpdated: OnLedgerBillUpdated,
+            LedgerBillDeleted: OnLedgerBillDeleted,
             SplitRuleCreated: OnSplitRuleCreated,
             SplitRuleUpdated: OnSplitRuleUpdated
         }
@@ -198,7 +297,8 @@ class EventManager:
     def emit(cls, e: EventBase):
         logger.info(f'dispatching event: {e.name}, {e.arguments}.')
         # cls.__event_manager.emit(e)
-        cls.__event_manager.dispatch_event(e)
+        with unit_of_work.scope():
+            cls.__event_manager.dispatch_event(e)
         logger.info(f'dispatching event: {e.name}, {e.arguments}, done.')
 
     @classmethod
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from .entity import *
+from .repo import repo
+from .runner import JobContext, JobRunner, job_runner
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from service.models import Job
+
+__all__ = [
+    "Job",
+    "JOB_STATE_PENDING",
+    "JOB_STATE_RUNNING",
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_FINISHED_STATES",
+    "JobCancelled"
+]
+
+
+JOB_STATE_PENDING = 'pending'
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_SUCCEEDED = 'succeeded'
+JOB_STATE_FAILED = 'failed'
+JOB_STATE_CANCELLED = 'cancelled'
+
+JOB_FINISHED_STATES = (JOB_STATE_SUCCEEDED, JOB_STATE_FAILED, JOB_STATE_CANCELLED)
+
+
+class JobCancelled(Exception):
+    """ 任务已被请求取消，由汇报进度的任务函数抛出，执行器回滚任务的事务 """
+    def __init__(self, job_id: int):
+        super().__init__(f'Job({job_id}) cancelled.')
+        self.job_id = job_id
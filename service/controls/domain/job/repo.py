@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from abc import ABCMeta, abstractmethod
+from typing import List, Optional, Type
+
+from sqlalchemy import and_, func, select
+
+from service.models import db_session
+from .entity import *
+
+
+__all__ = [
+    "IJobRepo",
+    "repo"
+]
+
+
+class IJobRepo(metaclass=ABCMeta):
+    """ 任务仓库
+
+    任务的状态与进度需要在执行任务的事务提交前对其他请求可见，因此默认使用独立的连接读写并立即提交，不经过当前会话；
+    在请求内直接执行的任务，其执行结果须随请求的事务提交或回滚，通过in_session在当前会话中读写
+    """
+    @classmethod
+    @abstractmethod
+    def create(cls, kind: str, bill_period_id: Optional[int], params: dict) -> int:
+        """ 创建待执行的任务，返回任务ID """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get(cls, job_id: int, in_session: bool = False) -> Optional[dict]:
+        """
+        :param in_session: 是否在当前会话中读取，可读取到当前事务中尚未提交的修改
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_list(cls, bill_period_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        """ 获取任务列表，按创建时间倒序排列 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def claim(cls, job_id: int, worker: str) -> bool:
+        """ 领取待执行的任务，任务已被领取或已取消时返回False """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def claim_pending(cls, worker: str) -> Optional[int]:
+        """ 领取最早创建的待执行任务，没有可领取的任务时返回None """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def update_progress(cls, job_id: int, processed: int, total: Optional[int]) -> bool:
+        """ 更新任务进度，同时更新心跳时间，返回任务是否已被请求取消 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def heartbeat(cls, job_ids: List[int]):
+        """ 更新执行中的任务的心跳时间 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def reset_expired(cls, expire_time: datetime.datetime) -> int:
+        """ 重置心跳时间早于expire_time的执行中任务，返回重置的任务数
+
+        执行任务的进程崩溃或重启时，任务停留在执行中；重置为待执行后由工作线程重新领取，已请求取消的直接取消
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def prune(cls, expire_time: datetime.datetime, limit: int = 100) -> List[dict]:
+        """ 删除结束时间早于expire_time的已结束任务，返回删除的任务，每次最多删除limit个 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def request_cancel(cls, job_id: int) -> bool:
+        """ 请求取消任务，待执行的任务直接取消，执行中的任务在下次汇报进度时取消；任务已结束时返回False """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def finish(cls, job_id: int, state: str, processed: int, total: Optional[int],
+               result: Optional[dict] = None, error: Optional[str] = None, in_session: bool = False):
+        """
+        :param in_session: 是否在当前会话中写入，随当前事务提交或回滚
+        """
+        raise NotImplementedError
+
+
+class JobRepo(IJobRepo):
+    __table = Job.__table__
+
+    @classmethod
+    def create(cls, kind: str, bill_period_id: Optional[int], params: dict) -> int:
+        with cls.__begin() as conn:
+            res = conn.execute(cls.__table.insert().values(
+                kind=kind, bill_period_id=bill_period_id, params=params,
+                state=JOB_STATE_PENDING, processed=0, cancel_requested=False))
+            return res.inserted_primary_key[0]
+
+    @classmethod
+    def get(cls, job_id: int, in_session: bool = False) -> Optional[dict]:
+        stmt = select([cls.__table]).where(and_(cls.__table.c.id == job_id,
+                                                cls.__table.c.deleted_at.is_(None)))
+        if in_session:
+            row = db_session.execute(stmt).first()
+        else:
+            with cls.__begin() as conn:
+                row = conn.execute(stmt).first()
+        return cls.__to_dict(row) if row else None
+
+    @classmethod
+    def get_list(cls, bill_period_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        conditions = [cls.__table.c.deleted_at.is_(None)]
+        if bill_period_id is not None:
+            conditions.append(cls.__table.c.bill_period_id == bill_period_id)
+
+        with cls.__begin() as conn:
+            rows = conn.execute(select([cls.__table])
+                                .where(and_(*conditions))
+                                .order_by(cls.__table.c.id.desc())
+                                .limit(limit)).fetchall()
+        return [cls.__to_dict(row) for row in rows]
+
+    @classmethod
+    def claim(cls, job_id: int, worker: str) -> bool:
+        # 条件更新保证同一任务只会被一个工作线程领取，多个进程共用任务表时同样有效
+        with cls.__begin() as conn:
+            res = conn.execute(cls.__table.update()
+                               .where(and_(cls.__table.c.id == job_id,
+                                           cls.__table.c.state == JOB_STATE_PENDING))
+                               .values(state=JOB_STATE_RUNNING, worker=worker, start_time=func.now(),
+                                       heartbeat_time=datetime.datetime.now()))
+            return res.rowcount == 1
+
+    @classmethod
+    def claim_pending(cls, worker: str) -> Optional[int]:
+        with cls.__begin() as conn:
+            rows = conn.execute(select([cls.__table.c.id])
+                                .where(and_(cls.__table.c.state == JOB_STATE_PENDING,
+                                            cls.__table.c.deleted_at.is_(None)))
+                                .order_by(cls.__table.c.id)
+                                .limit(10)).fetchall()
+
+        for job_id, in rows:
+            if cls.claim(job_id, worker):
+                return job_id
+        return None
+
+    @classmethod
+    def update_progress(cls, job_id: int, processed: int, total: Optional[int]) -> bool:
+        with cls.__begin() as conn:
+            conn.execute(cls.__table.update()
+                         .where(cls.__table.c.id == job_id)
+                         .values(processed=processed, total=total, heartbeat_time=datetime.datetime.now()))
+            return bool(conn.execute(select([cls.__table.c.cancel_requested])
+                                     .where(cls.__table.c.id == job_id)).scalar())
+
+    @classmethod
+    def heartbeat(cls, job_ids: List[int]):
+        if not job_ids:
+            return
+        with cls.__begin() as conn:
+            conn.execute(cls.__table.update()
+                         .where(and_(cls.__table.c.id.in_(job_ids),
+                                     cls.__table.c.state == JOB_STATE_RUNNING))
+                         .values(heartbeat_time=datetime.datetime.now()))
+
+    @classmethod
+    def reset_expired(cls, expire_time: datetime.datetime) -> int:
+        expired = and_(cls.__table.c.state == JOB_STATE_RUNNING,
+                       cls.__table.c.heartbeat_time < expire_time)
+        with cls.__begin() as conn:
+            cancelled = conn.execute(cls.__table.update()
+                                     .where(and_(expired, cls.__table.c.cancel_requested.is_(True)))
+                                     .values(state=JOB_STATE_CANCELLED, finish_time=func.now())).rowcount
+            reset = conn.execute(cls.__table.update()
+                                 .where(expired)
+                                 .values(state=JOB_STATE_PENDING, worker=None, processed=0,
+                                         start_time=None, heartbeat_time=None)).rowcount
+            return cancelled + reset
+
+    @classmethod
+    def prune(cls, expire_time: datetime.datetime, limit: int = 100) -> List[dict]:
+        with cls.__begin() as conn:
+            rows = conn.execute(select([cls.__table])
+                                .where(and_(cls.__table.c.state.in_(JOB_FINISHED_STATES),
+                                            cls.__table.c.finish_time < expire_time,
+                                            cls.__table.c.deleted_at.is_(None)))
+                                .order_by(cls.__table.c.id)
+                                .limit(limit)).fetchall()
+            if rows:
+                conn.execute(cls.__table.update()
+                             .where(cls.__table.c.id.in_([row['id'] for row in rows]))
+                             .values(deleted_at=datetime.datetime.now()))
+        return [cls.__to_dict(row) for row in rows]
+
+    @classmethod
+    def request_cancel(cls, job_id: int) -> bool:
+        with cls.__begin() as conn:
+            cancelled = conn.execute(cls.__table.update()
+                                     .where(and_(cls.__table.c.id == job_id,
+                                                 cls.__table.c.state == JOB_STATE_PENDING))
+                                     .values(state=JOB_STATE_CANCELLED, cancel_requested=True,
+                                             finish_time=func.now())).rowcount
+            requested = conn.execute(cls.__table.update()
+                                     .where(and_(cls.__table.c.id == job_id,
+                                                 cls.__table.c.state == JOB_STATE_RUNNING))
+                                     .values(cancel_requested=True)).rowcount
+            return bool(cancelled or requested)
+
+    @classmethod
+    def finish(cls, job_id: int, state: str, processed: int, total: Optional[int],
+               result: Optional[dict] = None, error: Optional[str] = None, in_session: bool = False):
+        stmt = cls.__table.update() \
+                          .where(cls.__table.c.id == job_id) \
+                          .values(state=state, processed=processed, total=total,
+                                  result=result, error=error, finish_time=func.now())
+        if in_session:
+            db_session.execute(stmt)
+        else:
+            with cls.__begin() as conn:
+                conn.execute(stmt)
+
+    @classmethod
+    def __begin(cls):
+        return db_session.get_bind().begin()
+
+    @classmethod
+    def __to_dict(cls, row) -> dict:
+        res = dict(row)
+        res.pop('deleted_at', None)
+        for k, v in res.items():
+            if isinstance(v, datetime.datetime):
+                res[k] = v.strftime('%Y-%m-%d %H:%M:%S')
+        return res
+
+
+repo: Type[IJobRepo] = JobRepo
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Type
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from common.util.log import get_logger
+from service.models import db_session
+from .entity import *
+from .repo import IJobRepo, repo as job_repo
+
+logger = get_logger('domain:job:runner')
+
+__all__ = [
+    "JobContext",
+    "JobRunner",
+    "job_runner"
+]
+
+
+class JobContext:
+    """ 任务的执行上下文，任务函数通过progress汇报进度
+
+    进度按时间间隔节流写入任务表，每次写入时检查任务是否已被请求取消，已取消时抛出JobCancelled
+    """
+    def __init__(self, job_id: int, repo: Type[IJobRepo], report_interval: float = 1.0):
+        self.job_id = job_id
+        self.processed: int = 0
+        self.total: Optional[int] = None
+
+        self.__repo = repo
+        self.__report_interval = report_interval
+        self.__last_report_time: Optional[float] = None
+
+    def progress(self, processed: int, total: Optional[int] = None):
+        """ 汇报进度
+
+        :param processed: 已处理的条目数
+        :param total: 条目总数，为空时沿用上次汇报的总数
+        """
+        self.processed = processed
+        if total is not None:
+            self.total = total
+
+        now = time.monotonic()
+        if self.__last_report_time is not None and now - self.__last_report_time < self.__report_interval:
+            return
+        self.__last_report_time = now
+
+        try:
+            cancel_requested = self.__repo.update_progress(self.job_id, self.processed, self.total)
+        except SQLAlchemyError:
+            # 进度只用于展示，写入失败（如锁等待超时）时不影响任务本身
+            logger.warning(f'failed to report progress of job {self.job_id}.', exc_info=True)
+            return
+
+        if cancel_requested:
+            raise JobCancelled(self.job_id)
+
+
+# 任务函数：(执行上下文, 计费周期ID, 任务参数) -> 执行结果
+JobHandler = Callable[..., Optional[dict]]
+
+
+class JobRunner:
+    """ 基于任务表的后台任务执行器，不依赖数据库以外的组件
+
+    1. 提交任务时写入任务表并立即提交，返回任务ID，调用方通过任务ID查询状态、进度与结果
+    2. 工作线程通过条件更新领取任务，同一任务只会被执行一次；本进程提交的任务直接通知工作线程，
+       空闲的工作线程每隔poll_interval秒还会领取任务表中待执行的任务，如其他进程提交或重启前未执行的任务
+    3. 每个任务在独立的应用上下文与事务中执行，成功时提交，失败或被取消时回滚，再记录执行状态
+    4. 未启动时，提交的任务在当前请求内直接执行，执行失败时抛出原异常；执行成功的状态在当前会话中写入，
+       随请求的事务提交，请求的事务回滚时任务记录为失败
+    5. 启动后由心跳线程定期更新本进程执行中任务的心跳时间，并重置心跳超过lease_timeout秒未更新的任务，
+       如执行任务的进程崩溃或重启，重置后的任务由工作线程重新领取
+    6. 心跳线程定期删除结束超过retention秒的任务，以及任务参数与执行结果中file_path指向的文件
+
+    """
+    # 心跳线程清理已结束任务的时间间隔，单位秒
+    __PRUNE_INTERVAL = 600.0
+
+    def __init__(self, repo: Type[IJobRepo] = job_repo, report_interval: float = 1.0):
+        self.__repo = repo
+        self.__report_interval = report_interval
+        self.__handlers: Dict[str, JobHandler] = dict()
+
+        self.__app = None
+        self.__queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self.__workers: List[threading.Thread] = []
+        self.__heartbeat: Optional[threading.Thread] = None
+        self.__poll_interval: float = 5.0
+        self.__lease_timeout: float = 600.0
+        self.__retention: float = 86400.0
+        self.__running: Set[int] = set()
+        self.__running_lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def register(self, kind: str, handler: JobHandler):
+        """ 注册任务函数，任务函数的参数为(执行上下文, 计费周期ID, **任务参数)，返回可JSON序列化的执行结果或None """
+        self.__handlers[kind] = handler
+        logger.info(f'job handler registered: {kind} --> {handler.__qualname__}.')
+
+    def start(self, app, worker_num: int = 2, poll_interval: float = 5.0, lease_timeout: float = 600.0,
+              retention: float = 86400.0):
+        """ 启动工作线程与心跳线程
+
+        :param app: Flask应用，工作线程在其应用上下文中执行任务
+        :param worker_num: 工作线程数
+        :param poll_interval: 空闲时领取任务表中待执行任务的时间间隔，单位秒
+        :param lease_timeout: 执行中的任务心跳超时的时间，单位秒，须远大于心跳间隔，超时的任务被重置
+        :param retention: 已结束的任务保留的时间，单位秒，超过后删除任务及其文件
+        """
+        self.stop()
+
+        self.__app = app
+        self.__poll_interval = poll_interval
+        self.__lease_timeout = lease_timeout
+        self.__retention = retention
+        self.__stopped.clear()
+        self.__workers = [threading.Thread(target=self.__run, name=f'job-runner-worker-{i}', daemon=True)
+                          for i in range(max(worker_num, 1))]
+        self.__heartbeat = threading.Thread(target=self.__run_heartbeat, name='job-runner-heartbeat', daemon=True)
+        for worker in self.__workers:
+            worker.start()
+        self.__heartbeat.start()
+        logger.info(f'job runner started, worker num: {len(self.__workers)}.')
+
+    def stop(self):
+        """ 停止工作线程，执行中的任务完成后返回 """
+        if not self.__workers:
+            return
+
+        self.__stopped.set()
+        for _ in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__heartbeat.join()
+
+        self.__workers = []
+        self.__heartbeat = None
+        self.__app = None
+        logger.info(f'job runner stopped.')
+
+    def is_started(self) -> bool:
+        return bool(self.__workers)
+
+    def submit(self, kind: str, bill_period_id: Optional[int] = None, **params) -> dict:
+        """ 提交任务，返回任务 """
+        if kind not in self.__handlers:
+            raise ValueError(f'unknown job kind: {kind}.')
+
+        job_id = self.__repo.create(kind, bill_period_id, params)
+        logger.info(f'job {job_id} submitted: {kind}, bill period: {bill_period_id}, params: {params}.')
+
+        if self.is_started():
+            self.__queue.put(job_id)
+        elif self.__repo.claim(job_id, self.__worker_name):
+            self.__execute(job_id, inline=True)
+            return self.__repo.get(job_id, in_session=True)
+
+        return self.__repo.get(job_id)
+
+    def cancel(self, job_id: int) -> bool:
+        """ 请求取消任务，任务已结束时返回False """
+        return self.__repo.request_cancel(job_id)
+
+    def prune(self, retention: float) -> int:
+        """ 删除结束超过retention秒的任务及其文件，返回删除的任务数
+
+        任务参数与执行结果中的file_path为任务的文件，如待导入的上传文件、导出的文件
+        """
+        expire_time = datetime.datetime.now() - datetime.timedelta(seconds=retention)
+        cnt = 0
+        while True:
+            jobs = self.__repo.prune(expire_time)
+            for job in jobs:
+                file_paths = {(job['params'] or dict()).get('file_path'), (job['result'] or dict()).get('file_path')}
+                for file_path in file_paths:
+                    if file_path:
+                        self.__remove_file(file_path)
+            cnt += len(jobs)
+            if not jobs:
+                return cnt
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            try:
+                job_id = self.__queue.get(timeout=self.__poll_interval)
+            except queue.Empty:
+                job_id = None
+
+            if self.__stopped.is_set():
+                return
+
+            try:
+                if job_id is None:
+                    job_id = self.__repo.claim_pending(self.__worker_name)
+                elif not self.__repo.claim(job_id, self.__worker_name):
+                    # 已被其他工作线程领取，或在执行前被取消
+                    job_id = None
+            except SQLAlchemyError:
+                logger.exception(f'failed to claim job.')
+                continue
+
+            if job_id is not None:
+                self.__execute_in_app_context(job_id)
+
+    def __execute_in_app_context(self, job_id: int):
+        with self.__running_lock:
+            self.__running.add(job_id)
+
+        with self.__app.app_context():
+            try:
+                self.__execute(job_id, inline=False)
+            except Exception:
+                # 工作线程不退出，异常已记录到任务中
+                pass
+            finally:
+                db_session.remove()
+                with self.__running_lock:
+                    self.__running.discard(job_id)
+
+    def __run_heartbeat(self):
+        interval = min(self.__poll_interval, self.__lease_timeout / 3)
+        last_prune_time = None
+        while not self.__stopped.wait(interval):
+            if last_prune_time is None or time.monotonic() - last_prune_time >= self.__PRUNE_INTERVAL:
+                last_prune_time = time.monotonic()
+                try:
+                    cnt = self.prune(self.__retention)
+                except SQLAlchemyError:
+                    logger.exception(f'failed to prune jobs.')
+                else:
+                    if cnt:
+                        logger.info(f'{cnt} finished job(s) pruned.')
+
+            with self.__running_lock:
+                running = list(self.__running)
+
+            try:
+                self.__repo.heartbeat(running)
+                expire_time = datetime.datetime.now() - datetime.timedelta(seconds=self.__lease_timeout)
+                cnt = self.__repo.reset_expired(expire_time)
+            except SQLAlchemyError:
+                logger.exception(f'failed to heartbeat jobs.')
+                continue
+
+            if cnt:
+                logger.warning(f'{cnt} expired job(s) reset, workers executing them may have exited.')
+
+    @staticmethod
+    def __remove_file(file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning(f'failed to remove file of job: {file_path}.', exc_info=True)
+
+    def __execute(self, job_id: int, inline: bool):
+        """ 执行已领取的任务
+
+        :param inline: 是否在当前请求内执行，是则由请求负责提交或回滚事务
+        """
+        job = self.__repo.get(job_id)
+        ctx = JobContext(job_id, self.__repo, self.__report_interval)
+
+        logger.info(f'job {job_id} started: {job["kind"]}.')
+        try:
+            result = self.__handlers[job['kind']](ctx, job['bill_period_id'], **(job['params'] or dict()))
+            if not inline:
+                db_session.commit()
+        except JobCancelled:
+            db_session.rollback()
+            logger.info(f'job {job_id} cancelled.')
+            self.__repo.finish(job_id, JOB_STATE_CANCELLED, ctx.processed, ctx.total)
+            raise
+        except Exception as e:
+            db_session.rollback()
+            logger.exception(f'job {job_id} failed.')
+            self.__repo.finish(job_id, JOB_STATE_FAILED, ctx.processed, ctx.total, error=str(e))
+            raise
+        else:
+            if ctx.total is not None:
+                ctx.processed = ctx.total
+            if inline:
+                # 任务写入的数据由请求提交，执行状态随之提交，请求的事务回滚时记录为失败
+                self.__repo.finish(job_id, JOB_STATE_SUCCEEDED, ctx.processed, ctx.total, result=result,
+                                   in_session=True)
+                db_session().info.setdefault(_INLINE_JOBS, []).append(
+                    (self.__repo, job_id, ctx.processed, ctx.total))
+            else:
+                self.__repo.finish(job_id, JOB_STATE_SUCCEEDED, ctx.processed, ctx.total, result=result)
+            logger.info(f'job {job_id} succeeded.')
+
+
+job_runner = JobRunner()
+
+
+# 通过会话的info记录在请求内直接执行成功、等待请求提交的任务
+_INLINE_JOBS = 'inline_jobs'
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    session.info.pop(_INLINE_JOBS, None)
+
+
+@sa_event.listens_for(Session, 'after_transaction_end')
+def _on_transaction_end(session, transaction):
+    if transaction.parent is not None:
+        return
+    # 提交时已取走，剩余的任务所在的事务已回滚或未提交即结束，在独立的连接中记录为失败
+    for repo, job_id, processed, total in session.info.pop(_INLINE_JOBS, []):
+        repo.finish(job_id, JOB_STATE_FAILED, processed, total, error='提交任务的请求未提交，任务的执行结果已回滚')
+        logger.info(f'job {job_id} failed, transaction of the request rolled back.')
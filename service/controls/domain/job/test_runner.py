@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+
+import pytest
+
+from service.models import db_session
+from .entity import JOB_STATE_PENDING, JOB_STATE_SUCCEEDED, JOB_STATE_FAILED, JOB_STATE_CANCELLED, JobCancelled
+from .repo import repo
+from .runner import JobContext, JobRunner
+
+
+class TestJobRunner:
+    def test_progress(self):
+        runner = JobRunner(report_interval=0)
+
+        def count(ctx: JobContext, bill_period_id: int, n: int) -> dict:
+            for i in range(n):
+                ctx.progress(i, n)
+            return dict(n=n)
+
+        runner.register('count', count)
+        job = runner.submit('count', None, n=10)
+
+        assert job['state'] == JOB_STATE_SUCCEEDED
+        assert (job['processed'], job['total']) == (10, 10)
+        assert job['result'] == dict(n=10)
+
+    def test_inline_job_rolled_back(self):
+        runner = JobRunner(report_interval=0)
+        runner.register('noop', lambda ctx, bill_period_id: None)
+
+        job = runner.submit('noop', 3)
+        assert job['state'] == JOB_STATE_SUCCEEDED
+
+        # 请求的事务回滚时，执行状态一并回滚，任务记录为失败
+        db_session.rollback()
+        assert repo.get(job['id'])['state'] == JOB_STATE_FAILED
+
+    def test_failed(self):
+        runner = JobRunner(report_interval=0)
+
+        def fail(ctx: JobContext, bill_period_id: int):
+            raise ValueError('failed')
+
+        runner.register('fail', fail)
+        with pytest.raises(ValueError):
+            runner.submit('fail', 1)
+
+        job = repo.get_list(bill_period_id=1)[0]
+        assert job['state'] == JOB_STATE_FAILED
+        assert job['error'] == 'failed'
+
+    def test_cancel(self):
+        runner = JobRunner(report_interval=0)
+
+        def cancel_self(ctx: JobContext, bill_period_id: int):
+            ctx.progress(0, 2)
+            runner.cancel(ctx.job_id)
+            ctx.progress(1)
+
+        runner.register('cancel_self', cancel_self)
+        with pytest.raises(JobCancelled):
+            runner.submit('cancel_self', 2)
+
+        job = repo.get_list(bill_period_id=2)[0]
+        assert job['state'] == JOB_STATE_CANCELLED
+        assert (job['processed'], job['total']) == (1, 2)
+        # 已结束的任务不能再取消
+        assert not runner.cancel(job['id'])
+
+    def test_reset_expired(self):
+        job_id = repo.create('count', 4, dict(n=1))
+        assert repo.claim(job_id, 'crashed-worker')
+
+        # 心跳未超时的任务不会被重置
+        assert repo.reset_expired(datetime.datetime.now() - datetime.timedelta(minutes=10)) == 0
+
+        # 心跳超时，执行任务的进程视为已退出，任务被重置后可重新领取
+        assert repo.reset_expired(datetime.datetime.now() + datetime.timedelta(minutes=10)) == 1
+        job = repo.get(job_id)
+        assert (job['state'], job['worker']) == (JOB_STATE_PENDING, None)
+        assert repo.claim(job_id, 'worker')
+
+    def test_prune(self, tmpdir):
+        file_path = str(tmpdir.join('export.xlsx'))
+        open(file_path, 'w').close()
+
+        runner = JobRunner(report_interval=0)
+        runner.register('export', lambda ctx, bill_period_id: dict(file_path=file_path))
+        job = runner.submit('export', 5)
+        db_session.commit()
+
+        # 未超过保留时间的任务不会被删除
+        assert runner.prune(3600) == 0
+        assert repo.get(job['id']) is not None
+
+        # 任务被删除，导出的文件一并删除
+        assert runner.prune(-3600) >= 1
+        assert repo.get(job['id']) is None
+        assert not os.path.exists(file_path)
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
 
 from .spec import *
+from .cache import meta_spec_cache
+from .index import BusinessIndex
 from .repo import repo
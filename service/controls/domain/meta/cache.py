@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from common.util.log import get_logger
+from .entity import Meta
+
+logger = get_logger('domain:meta:cache')
+
+__all__ = [
+    "MetaSpecCache",
+    "meta_spec_cache"
+]
+
+
+class MetaSpecCache:
+    """ 元数据校验规格的进程级快照
+
+    1. 快照在首次使用时构建，之后的校验不再查询元数据表，快照须不可修改
+    2. 元数据（业务、计费主体、供应商）创建、修改、删除时快照失效，事务提交或回滚时再次失效，
+       避免缓存其他事务未提交或已回滚的数据
+    3. 每次失效时版本号加一，构建期间发生失效时，构建结果不会被缓存
+    4. 多进程部署时，其他进程修改元数据无法通知到本进程，快照构建超过ttl（秒）后重新构建，最长在ttl后生效；
+       ttl为None时不过期，仅适用于单进程部署
+    """
+    def __init__(self, ttl: Optional[float] = 60.0):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__version = 0
+        # (构建时间, 快照)
+        self.__snapshot: Optional[Tuple[float, Any]] = None
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+    def get_or_build(self, build: Callable[[], Any]) -> Any:
+        """ 获取快照，未构建、已失效或已过期时构建并缓存
+
+        :param build: 构建函数，抛出异常时不缓存
+        """
+        with self.__lock:
+            version, snapshot = self.__version, self.__snapshot
+
+        if snapshot is not None and not self.__is_expired(snapshot[0]):
+            return snapshot[1]
+
+        value = build()
+
+        with self.__lock:
+            if self.__version == version:
+                self.__snapshot = (time.monotonic(), value)
+
+        return value
+
+    def invalidate(self):
+        with self.__lock:
+            self.__version += 1
+            self.__snapshot = None
+
+        logger.debug(f'meta spec snapshot invalidated, version: {self.__version}.')
+
+    def invalidate_in_session(self, session: Session):
+        """ 批量语句不会触发映射器事件，由执行批量语句的调用方显式失效，并在事务提交或回滚时再次失效 """
+        session.info[_META_CHANGED] = True
+        self.invalidate()
+
+    def __is_expired(self, built_at: float) -> bool:
+        return self.ttl is not None and time.monotonic() - built_at > self.ttl
+
+
+meta_spec_cache = MetaSpecCache()
+
+
+# 通过会话的info记录事务内是否修改过元数据
+_META_CHANGED = 'meta_changed'
+
+
+@event.listens_for(Meta, 'after_insert')
+@event.listens_for(Meta, 'after_update')
+@event.listens_for(Meta, 'after_delete')
+def _on_meta_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_META_CHANGED] = True
+    meta_spec_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _on_transaction_end(session):
+    if session.info.pop(_META_CHANGED, False):
+        meta_spec_cache.invalidate()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+__all__ = [
+    "BusinessIndex",
+    "BusinessRow"
+]
+
+
+# (业务ID, ModelX编码, 名称)
+BusinessRow = Tuple[int, str, str]
+
+
+class BusinessIndex:
+    """ 业务的双向索引：业务ID <--> ModelX编码 <--> 名称，构建后不可修改
+
+    随元数据校验规格的快照一起构建与失效（参考meta_spec_cache），供报表过滤、元数据校验与总账账单校验共用
+    """
+    def __init__(self, businesses: Iterable[BusinessRow]):
+        self.__rows: Tuple[BusinessRow, ...] = tuple(businesses)
+        self.__modelx_codes: Tuple[str, ...] = tuple(code for _, code, _ in self.__rows)
+
+        self.__id_2_code: Dict[int, str] = {id_: code for id_, code, _ in self.__rows}
+        self.__code_2_id: Dict[str, int] = {code: id_ for id_, code, _ in self.__rows}
+        self.__code_2_name: Dict[str, str] = {code: name for _, code, name in self.__rows}
+
+    @property
+    def modelx_codes(self) -> Tuple[str, ...]:
+        return self.__modelx_codes
+
+    def has_modelx_code(self, modelx_code: str) -> bool:
+        return modelx_code in self.__code_2_id
+
+    def get_modelx_code(self, business_id: int) -> Optional[str]:
+        return self.__id_2_code.get(business_id)
+
+    def get_id(self, modelx_code: str) -> Optional[int]:
+        return self.__code_2_id.get(modelx_code)
+
+    def get_name(self, modelx_code: str) -> Optional[str]:
+        return self.__code_2_name.get(modelx_code)
+
+    def get_modelx_codes(self, business_ids: Iterable[int]) -> List[Optional[str]]:
+        """ 业务ID转换为ModelX编码，顺序与业务的顺序一致，不存在的业务ID忽略；业务ID为0时表示不属于任何业务，转换为None """
+        business_ids = frozenset(business_ids)
+        modelx_codes: List[Optional[str]] = [code for id_, code, _ in self.__rows if id_ in business_ids]
+        if 0 in business_ids:
+            modelx_codes.append(None)
+        return modelx_codes
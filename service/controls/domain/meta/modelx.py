@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from abc import ABCMeta, abstractmethod
+from typing import Iterable, List, NamedTuple, Optional, Protocol
+
+__all__ = [
+    "IModelXBusiness",
+    "IModelXSource",
+    "LocalModelXBusiness",
+    "LocalModelXSource"
+]
+
+
+class IModelXBusiness(Protocol):
+    """ ModelX中的业务，同步时只依赖以下属性 """
+    id: str
+    code: str
+    name: str
+    full_name: Optional[str]
+
+
+class IModelXSource(metaclass=ABCMeta):
+    """ ModelX业务数据源 """
+    @abstractmethod
+    def get_businesses(self) -> List[IModelXBusiness]:
+        """ 获取ModelX中的全部业务 """
+        raise NotImplementedError
+
+
+class LocalModelXBusiness(NamedTuple):
+    id: str
+    code: str
+    name: str
+    full_name: Optional[str] = None
+
+
+class LocalModelXSource(IModelXSource):
+    """ 本地的ModelX替身，用于测试与本地开发，不访问ModelX """
+    def __init__(self, businesses: Optional[Iterable[LocalModelXBusiness]] = None):
+        self.businesses: List[LocalModelXBusiness] = list(businesses or [])
+
+    def get_businesses(self) -> List[LocalModelXBusiness]:
+        return list(self.businesses)
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 from abc import ABCMeta, abstractmethod
-from typing import List, Type
+from typing import List, Optional, Tuple, Type
+
+from sqlalchemy import bindparam, func
 
 from service.models import db_session
 from .entity import *
+from .cache import meta_spec_cache
+from .index import BusinessRow
+from .val_obj import BusinessSyncResult
 import common.static as const
 from common.util.log import get_logger
 
@@ -24,6 +31,12 @@ class IMetaRepo(object, metaclass=ABCMeta):
     def get_businesses(cls) -> List[Business]:
         raise NotImplementedError
 
+    @classmethod
+    @abstractmethod
+    def get_business_rows(cls) -> List[BusinessRow]:
+        """ 获取业务的(ID, ModelX编码, 名称)，按ID排序，只查询所需的列，不加载ORM对象 """
+        raise NotImplementedError
+
     @classmethod
     @abstractmethod
     def get_bill_subjects(cls) -> List[BillSubject]:
@@ -35,15 +48,24 @@ class IMetaRepo(object, metaclass=ABCMeta):
         raise NotImplementedError
 
     @classmethod
-    def set_businesses(cls, businesses: List[Business]):
+    def set_businesses(cls, businesses: List[Business]) -> BusinessSyncResult:
+        """ 按ModelX编码同步业务：新增、更新内容有变化的、删除不再存在的，内容未变化的业务不做写入 """
         raise NotImplementedError
 
 
 class MetaRepo(IMetaRepo):
+    # 批量删除时每条语句的业务数量，避免IN列表过长
+    __BATCH_SIZE = 1000
+
     @classmethod
     def get_businesses(cls) -> List[Business]:
         return Meta.query.filter_by(type=const.META_TYPE_BUSINESS).all()
 
+    @classmethod
+    def get_business_rows(cls) -> List[BusinessRow]:
+        query = cls.__query_business_columns(Meta.id, Meta.other, Meta.name)
+        return [(id_, cls.__get_modelx_code(other), name) for id_, other, name in query]
+
     @classmethod
     def get_bill_subjects(cls) -> List[BillSubject]:
         return Meta.query.filter_by(type=const.META_TYPE_BILL_SUBJECT).all()
@@ -53,44 +75,93 @@ class MetaRepo(IMetaRepo):
         return Meta.query.filter_by(type=const.META_TYPE_PROVIDER).all()
 
     @classmethod
-    def set_businesses(cls, businesses: List[Business]):
+    def set_businesses(cls, businesses: List[Business]) -> BusinessSyncResult:
+        # 批量语句不会触发自动刷新，先写入会话中尚未刷新的元数据
+        db_session.flush()
+
         code_2_businesses = dict((business.modelx_code, business) for business in businesses)
-        code_2_current_businesses = dict((business.modelx_code, business) for business in cls.get_businesses())
+        code_2_current = dict((code, (id_, content_hash)) for id_, code, content_hash in cls.__get_business_hashes())
 
+        created_values, updated_values, deleted_ids = [], [], []
+        # 变化的业务的ModelX编码，仅用于日志
+        created_codes, updated_codes, deleted_codes = [], [], []
         for code, business in code_2_businesses.items():
-            current = code_2_current_businesses.get(code)
-            if current:
-                if current.name != business.name:
-                    # 名称有变化时进行更新
-                    logger.info(f'updating name of business({current.id}): '
-                                f'{current.name} --> {business.name}.')
-                    current.name = business.name
-
-                if current.full_name != business.full_name:
-                    # 全称有变化时进行更新
-                    logger.info(f'updating fullname of business({current.id}): '
-                                f'{current.full_name} --> {business.full_name}.')
-                    current.full_name = business.full_name
-
-                if current.modelx_id != business.modelx_id:
-                    # 全称有变化时进行更新
-                    logger.info(f'updating modelx_id of business({current.id}): '
-                                f'{current.modelx_id} --> {business.modelx_id}.')
-                    current.other = business.other
-            else:
-                # 创建新的业务
-                created = Business.create(
-                    type=const.META_TYPE_BUSINESS,
-                    other=business.other,
-                    name=business.name,
-                    full_name=business.full_name)
-                logger.info(f'business created: {created.to_dict()}')
+            values = dict(name=business.name, full_name=business.full_name, other=business.other)
+            current = code_2_current.get(code)
+            if not current:
+                created_values.append(dict(type=const.META_TYPE_BUSINESS, **values))
+                created_codes.append(code)
+            elif current[1] != cls.__hash_business(**values):
+                updated_values.append(dict(b_id=current[0], **{f'b_{k}': v for k, v in values.items()}))
+                updated_codes.append(code)
 
         # 删除不再存在的业务
-        for code, current_business in code_2_current_businesses.items():
+        for code, (id_, _) in code_2_current.items():
             if code not in code_2_businesses:
-                logger.info(f'deleting business: {current_business.to_dict()}')
-                current_business.delete()
+                deleted_ids.append(id_)
+                deleted_codes.append(code)
+
+        table = Meta.__table__
+        if created_values:
+            db_session.execute(table.insert(), created_values)
+        if updated_values:
+            db_session.execute(
+                table.update().where(table.c.id == bindparam('b_id'))
+                              .values(name=bindparam('b_name'), full_name=bindparam('b_full_name'),
+                                      other=bindparam('b_other')),
+                updated_values)
+        for i in range(0, len(deleted_ids), cls.__BATCH_SIZE):
+            db_session.execute(
+                table.update().where(table.c.id.in_(deleted_ids[i:i + cls.__BATCH_SIZE]))
+                              .values(deleted_at=func.now()))
+
+        result = BusinessSyncResult(
+            created=len(created_values),
+            updated=len(updated_values),
+            deleted=len(deleted_ids),
+            unchanged=len(code_2_businesses) - len(created_values) - len(updated_values))
+
+        if result.is_changed:
+            cls.__expire_businesses_in_session()
+            # 批量语句不会触发映射器事件，显式使元数据校验规格的快照失效
+            meta_spec_cache.invalidate_in_session(db_session())
+            logger.debug(f'modelx codes of businesses created: {created_codes}, '
+                         f'updated: {updated_codes}, deleted: {deleted_codes}.')
+
+        logger.info(f'businesses synchronized: {result.to_dict()}.')
+        return result
+
+    @classmethod
+    def __get_business_hashes(cls) -> List[Tuple[int, str, str]]:
+        """ 获取现有业务的(ID, ModelX编码, 内容摘要)，只查询所需的列，不加载ORM对象 """
+        query = cls.__query_business_columns(Meta.id, Meta.name, Meta.full_name, Meta.other)
+        return [(id_, cls.__get_modelx_code(other), cls.__hash_business(name=name, full_name=full_name, other=other))
+                for id_, name, full_name, other in query]
+
+    @staticmethod
+    def __query_business_columns(*columns):
+        """ 查询未删除的业务的指定列，按ID排序，不加载ORM对象 """
+        return db_session.query(*columns) \
+                         .filter(Meta.type == const.META_TYPE_BUSINESS) \
+                         .filter(Meta.deleted_at.is_(None)) \
+                         .order_by(Meta.id)
+
+    @staticmethod
+    def __get_modelx_code(other: Optional[dict]) -> str:
+        return (other or dict()).get('modelx_code', '')
+
+    @staticmethod
+    def __hash_business(name: str, full_name: Optional[str], other: Optional[dict]) -> str:
+        """ 业务内容的摘要，同步时摘要一致的业务不做更新 """
+        content = json.dumps([name, full_name, other or dict()], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def __expire_businesses_in_session():
+        """ 批量语句不会同步会话中的业务，使其过期，访问时重新加载 """
+        for obj in list(db_session.identity_map.values()):
+            if isinstance(obj, Meta) and obj.type == const.META_TYPE_BUSINESS:
+                db_session.expire(obj)
 
 
 repo: Type[IMetaRepo] = MetaRepo
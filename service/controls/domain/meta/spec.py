@@ -1,42 +1,68 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from .cache import meta_spec_cache
+from .index import BusinessIndex
 from .repo import repo
 
 
 class MetaSpec:
-    def __init__(self, businesses: List[str], bill_subjects: List[str], providers: List[str]):
-        self.__businesses = businesses
-        self.__bill_subjects = bill_subjects
-        self.__providers = providers
+    """ 元数据校验规格，合法取值保存为frozenset，校验的时间复杂度为O(1)，构建后不可修改 """
+    def __init__(self, business_index: BusinessIndex, bill_subjects: List[str], providers: List[str]):
+        self.__business_index = business_index
+        self.__businesses = business_index.modelx_codes
+        self.__bill_subjects = tuple(bill_subjects)
+        self.__providers = tuple(providers)
+
+        self.__business_set = frozenset(self.__businesses)
+        self.__bill_subject_set = frozenset(self.__bill_subjects)
+        self.__provider_set = frozenset(self.__providers)
+
+    @property
+    def business_index(self) -> BusinessIndex:
+        return self.__business_index
 
     @property
-    def businesses(self) -> List[str]:
+    def businesses(self) -> Tuple[str, ...]:
         return self.__businesses
 
+    def has_business(self, business: str) -> bool:
+        return business in self.__business_set
+
     def is_business_valid(self, business: str) -> (bool, Optional[str]):
         if not business:
             return True, None
-        elif business in self.__businesses:
+        elif business in self.__business_set:
             return True, None
         else:
             return False, f'业务名称"{business}"非法，参考值：{"、".join(self.__businesses[:3])}...'
 
     def is_bill_subject_valid(self, bill_subject: str) -> (bool, Optional[str]):
-        if bill_subject in self.__bill_subjects:
+        if bill_subject in self.__bill_subject_set:
             return True, None
         else:
             return False, f'计费主体名称"{bill_subject}"非法，参考值：{"、".join(self.__bill_subjects[:3])}...'
 
     def is_provider_valid(self, provider: str) -> (bool, Optional[str]):
-        if provider in self.__providers:
+        if provider in self.__provider_set:
             return True, None
         else:
             return False, f'供应商名称"{provider}"非法，参考值：{"、".join(self.__providers[:3])}...'
 
 
 def meta_spec() -> MetaSpec:
-    businesses = [o.modelx_code for o in repo.get_businesses()]
+    """ 获取元数据校验规格，使用进程级快照，元数据变化时失效，参考meta_spec_cache """
+    return meta_spec_cache.get_or_build(build_meta_spec)
+
+
+def business_index() -> BusinessIndex:
+    """ 获取业务索引，与元数据校验规格共用快照 """
+    return meta_spec().business_index
+
+
+def build_meta_spec() -> MetaSpec:
+    """ 查询元数据表构建元数据校验规格，不使用快照 """
+    business_index_ = BusinessIndex(repo.get_business_rows())
     bill_subjects = [o.name for o in repo.get_bill_subjects()]
     providers = [o.name for o in repo.get_providers()]
-    return MetaSpec(businesses, bill_subjects, providers)
+    return MetaSpec(business_index_, bill_subjects, providers)
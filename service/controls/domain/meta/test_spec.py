@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from .spec import meta_spec, business_index
+from .cache import MetaSpecCache, meta_spec_cache
+
+
+class TestMetaSpec:
+    def test_meta_spec_cached(self, provider_factory):
+        spec = meta_spec()
+        assert meta_spec() is spec
+
+        # 元数据创建后快照失效
+        provider = provider_factory(name='p_test_meta_spec_cached')
+        assert meta_spec() is not spec
+        assert meta_spec().is_provider_valid(provider.name)[0]
+
+    def test_invalidate(self):
+        spec = meta_spec()
+        version = meta_spec_cache.version
+
+        meta_spec_cache.invalidate()
+        assert meta_spec_cache.version == version + 1
+        assert meta_spec() is not spec
+
+    def test_ttl(self):
+        # 默认按ttl过期，其他进程修改的元数据最长在ttl后生效
+        assert meta_spec_cache.ttl is not None
+
+        cache = MetaSpecCache(ttl=None)
+        assert cache.get_or_build(object) is cache.get_or_build(object)
+
+        cache = MetaSpecCache(ttl=-1)
+        assert cache.get_or_build(object) is not cache.get_or_build(object)
+
+
+class TestBusinessIndex:
+    def test_business_index(self, business):
+        index = business_index()
+
+        assert index.get_modelx_code(business.id) == business.modelx_code
+        assert index.get_id(business.modelx_code) == business.id
+        assert index.get_name(business.modelx_code) == business.name
+        assert index.get_modelx_codes([business.id, 0]) == [business.modelx_code, None]
+        assert meta_spec().has_business(business.modelx_code)
+
+    def test_refreshed_on_meta_written(self, business_factory):
+        index = business_index()
+
+        business = business_factory(name='b_test_refreshed', other=dict(modelx_code='b_test_refreshed_code'))
+        assert business_index() is not index
+        assert business_index().get_id('b_test_refreshed_code') == business.id
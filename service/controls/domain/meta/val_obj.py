@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from typing import NamedTuple
+
+__all__ = [
+    "BusinessSyncResult"
+]
+
+
+class BusinessSyncResult(NamedTuple):
+    """ 业务同步的结果，各项为业务数量 """
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+    @property
+    def is_changed(self) -> bool:
+        return bool(self.created or self.updated or self.deleted)
+
+    def to_dict(self) -> dict:
+        return self._asdict()
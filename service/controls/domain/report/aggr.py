@@ -35,4 +35,5 @@ class ReportAggr:
             return None
 
     def get_report_bills_by_business_modelx_codes(self, business_modelx_codes: List[Optional[str]]) -> List[ReportBill]:
-        return [report_bill for report_bill in self.report_bills if report_bill.business_modelx_code in business_modelx_codes]
+        """ 业务过滤由数据库完成，只加载匹配的报表账单 """
+        return repo.get_report_bills([self.bill_period.id], business_modelx_codes)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, IO, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import common.static as const
+from common.util.log import get_logger
+from service.models import db_session
+from .entity import BillPeriod
+
+logger = get_logger('domain:report:cache')
+
+__all__ = [
+    "ExportCache",
+    "export_cache"
+]
+
+
+class ExportCache:
+    """ 已锁定计费周期的导出文件缓存
+
+    1. 缓存键为导出内容的摘要：导出类型、计费周期(ID, 锁定状态, 更新时间)、过滤条件与文件格式，
+       计费周期解锁再锁定后更新时间变化，旧文件不会再被命中
+    2. 文件保存在磁盘上，以缓存键命名，先写入唯一的临时文件再原子地重命名，多个请求、多个进程并发导出时互不影响；
+       每个文件附带记录所属计费周期的元数据文件，用于失效
+    3. 计费周期解锁、总账账单变化时，由事件处理函数失效该计费周期的文件，事务提交或回滚时再次失效，
+       避免失效后、提交前的并发导出缓存了旧数据；每次失效递增计费周期的版本，
+       导出期间计费周期被失效时不放入缓存，避免导出中途失效的旧数据在失效后才写入缓存
+    4. 命中时更新文件的修改时间，文件总大小超过max_bytes时，按修改时间淘汰最近最少使用的文件；
+       进程异常退出时遗留的临时文件，超过__STALE_TMP_SECONDS未修改的在淘汰时一并删除
+    """
+    # 临时文件超过该时长（秒）未写入时视为遗留文件，正在写入的临时文件会持续更新修改时间
+    __STALE_TMP_SECONDS = 60 * 60
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        :param cache_dir: 缓存目录，多个进程可共用
+        :param max_bytes: 缓存文件总大小上限
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__versions: Dict[int, int] = dict()
+
+    @staticmethod
+    def make_key(kind: str, bill_periods: List[BillPeriod], **filters) -> str:
+        """ 生成缓存键
+
+        :param kind: 导出类型
+        :param bill_periods: 导出涉及的计费周期
+        :param filters: 过滤条件、文件格式等影响导出内容的参数，须可JSON序列化
+        """
+        content = dict(
+            kind=kind,
+            bill_periods=sorted([bill_period.id, bool(bill_period.is_locked), str(bill_period.update_time)]
+                                for bill_period in bill_periods),
+            filters=filters)
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def open(self, key: str) -> Optional[IO]:
+        """ 打开缓存的文件，未命中时返回None；文件打开后即使被淘汰或失效，也能读取完整 """
+        try:
+            f = open(self.__get_file_path(key), mode='rb')
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(f.name)
+        except OSError:
+            pass
+        return f
+
+    def get_versions(self, bill_period_ids: List[int]) -> List[int]:
+        """ 获取计费周期的版本，每次失效时递增 """
+        with self.__lock:
+            return self.__get_versions(bill_period_ids)
+
+    def iter_and_put(self, key: str, bill_period_ids: List[int], chunks: Iterator[bytes],
+                     versions: Optional[List[int]] = None) -> Iterator[bytes]:
+        """ 逐块返回文件内容，同时写入临时文件，全部返回后再放入缓存；中途中断、抛出异常或计费周期被失效时放弃缓存
+
+        :param versions: 开始读取导出数据前通过get_versions获取的计费周期版本，为空时取调用时的版本
+        """
+        if versions is None:
+            versions = self.get_versions(bill_period_ids)
+        return self.__iter_and_put(key, bill_period_ids, chunks, versions)
+
+    def __iter_and_put(self, key: str, bill_period_ids: List[int], chunks: Iterator[bytes],
+                       versions: List[int]) -> Iterator[bytes]:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+
+        replaced = False
+        try:
+            with os.fdopen(fd, mode='wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            # 失效时先在锁内递增版本再删除文件，在锁内比较版本并写入，写入的文件不会逃过失效
+            with self.__lock:
+                if self.__get_versions(bill_period_ids) == versions:
+                    self.__put(key, bill_period_ids, tmp_path)
+                    replaced = True
+            if not replaced:
+                logger.info(f'bill period(s) {bill_period_ids} invalidated while exporting, export file not cached.')
+        finally:
+            # 未重命名为缓存文件时删除临时文件，包括调用方未读完即关闭生成器的情况
+            if not replaced:
+                self.__remove(tmp_path)
+
+        self.__evict()
+
+    def invalidate(self, bill_period_id: int):
+        """ 失效计费周期的全部缓存文件，当前事务提交或回滚时再次失效 """
+        db_session().info.setdefault(_INVALIDATED_BILL_PERIOD_IDS, set()).add(bill_period_id)
+        self.invalidate_now(bill_period_id)
+
+    def invalidate_now(self, bill_period_id: int):
+        with self.__lock:
+            self.__versions[bill_period_id] = self.__versions.get(bill_period_id, 0) + 1
+
+        cnt = 0
+        for meta_path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            meta = self.__read_meta(meta_path)
+            if meta is None or bill_period_id in meta['bill_period_ids']:
+                self.__remove_entry(meta_path[:-len('.json')])
+                cnt += 1
+
+        if cnt:
+            logger.info(f'{cnt} export file(s) of bill period {bill_period_id} invalidated.')
+
+    def clear(self):
+        for meta_path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            self.__remove_entry(meta_path[:-len('.json')])
+
+    def __put(self, key: str, bill_period_ids: List[int], tmp_path: str):
+        file_path = self.__get_file_path(key)
+        with open(f'{file_path}.json', mode='w') as f:
+            json.dump(dict(bill_period_ids=bill_period_ids), f)
+        os.replace(tmp_path, file_path)
+
+    def __get_versions(self, bill_period_ids: List[int]) -> List[int]:
+        """ 须在持有锁时调用 """
+        return [self.__versions.get(bill_period_id, 0) for bill_period_id in bill_period_ids]
+
+    def __evict(self):
+        with self.__lock:
+            self.__remove_stale_tmp_files()
+
+            entries = []
+            for meta_path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+                file_path = meta_path[:-len('.json')]
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, file_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.__remove_entry(file_path)
+                total -= size
+                logger.info(f'export file evicted: {file_path}.')
+
+    def __remove_stale_tmp_files(self):
+        expire_time = time.time() - self.__STALE_TMP_SECONDS
+        for tmp_path in glob.glob(os.path.join(self.cache_dir, '*.tmp')):
+            try:
+                if os.stat(tmp_path).st_mtime < expire_time:
+                    self.__remove(tmp_path)
+                    logger.info(f'stale export tmp file removed: {tmp_path}.')
+            except FileNotFoundError:
+                continue
+
+    def __get_file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def __read_meta(meta_path: str) -> Optional[dict]:
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def __remove_entry(cls, file_path: str):
+        cls.__remove(file_path)
+        cls.__remove(f'{file_path}.json')
+
+    @staticmethod
+    def __remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+export_cache = ExportCache(os.path.join(const.STATIC_PATH, 'export_cache'))
+
+
+# 通过会话的info记录事务内失效过的计费周期
+_INVALIDATED_BILL_PERIOD_IDS = 'export_cache_invalidated_bill_period_ids'
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _on_transaction_end(session):
+    for bill_period_id in session.info.pop(_INVALIDATED_BILL_PERIOD_IDS, set()):
+        export_cache.invalidate_now(bill_period_id)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import common.util.decimal as decimal
+from .entity import BillPeriod
+from .repo import repo
+from .val_obj import \
+    ReportCellRow, ReportColumns, ReportStatistics, ServiceTypeConsumptionTrend, \
+    BillPeriodDataPoint, BusinessDataPoint, ServiceTypeDataPoint, TypeLevel1DataPoint
+
+__all__ = [
+    "ReportEngine"
+]
+
+
+# 统计单元的维度：(计费周期ID, 服务类型, 业务, 一级类型)
+CellKey = Tuple[int, Optional[str], Optional[str], Optional[str]]
+
+
+class ReportCell:
+    """ 统计单元，即维度完全相同的报表账单的合计 """
+    __slots__ = ('cnt', 'total', 'first')
+
+    def __init__(self, cnt: int, total: decimal.Decimal, first: decimal.Decimal):
+        self.cnt = cnt
+        self.total = total
+        self.first = first
+
+
+class ReportEngine:
+    """ 列式报表统计引擎
+
+    一次遍历所有报表账单，按(计费周期, 服务类型, 业务, 一级类型)分组求和得到统计单元，
+    消费总额、消费趋势和各类消费分布均由统计单元合并得到，统计单元的数量与账单数无关
+
+    统计结果与逐条生成数据点再合并的结果完全一致：
+
+    1. 金额的计算方式与数据点一致（Decimal(val or 0.0)），合并时以Decimal('0.00')为初始值
+    2. 消费趋势中，只有一条账单的数据点保留该账单的金额，不以Decimal('0.00')为初始值
+    3. 各分组按首次出现的顺序排列，消费趋势的数据点按计费周期的时间戳排序
+    4. 计费周期只查询一次
+
+    统计单元也可以由数据库分组统计得到（aggregate_cell_rows），此时内存占用只与分组数有关
+
+    """
+    @classmethod
+    def aggregate(cls, columns: ReportColumns) -> ReportStatistics:
+        return cls.__aggregate(cls.__aggregate_cells(columns))
+
+    @classmethod
+    def aggregate_cell_rows(cls, cell_rows: Iterable[ReportCellRow]) -> ReportStatistics:
+        """ 基于数据库分组统计的结果进行统计，分组的顺序应为各分组首次出现的顺序 """
+        cells: Dict[CellKey, ReportCell] = dict()
+        for cell_row in cell_rows:
+            key = (cell_row.bill_period_id, cell_row.service_type, cell_row.business_modelx_code, cell_row.type_level_1)
+            total = decimal.Decimal(cell_row.total or 0.0)
+            # 只有一条账单时，合计即为该账单的金额
+            cells[key] = ReportCell(cell_row.cnt, decimal.Decimal('0.00') + total, total)
+        return cls.__aggregate(cells)
+
+    @classmethod
+    def __aggregate(cls, cells: Dict[CellKey, ReportCell]) -> ReportStatistics:
+        bill_periods = cls.__get_bill_periods({key[0] for key in cells.keys()})
+
+        return ReportStatistics(
+            total=cls.__calc_total(cells),
+            bill_cnt=sum([cell.cnt for cell in cells.values()]),
+            consumption_trend=cls.__statistic_consumption_trend(cells, bill_periods),
+            business_distribution=[
+                BusinessDataPoint(business=k, total=v) for k, v in cls.__sum_by_dimension(cells, 2).items()],
+            service_type_distribution=[
+                ServiceTypeDataPoint(service_type=k, total=v) for k, v in cls.__sum_by_dimension(cells, 1).items()],
+            type_level_1_distribution=[
+                TypeLevel1DataPoint(type_level_1=k, total=v) for k, v in cls.__sum_by_dimension(cells, 3).items()])
+
+    @staticmethod
+    def __aggregate_cells(columns: ReportColumns) -> Dict[CellKey, ReportCell]:
+        key_2_values: Dict[CellKey, list] = dict()
+
+        keys = zip(columns.bill_period_ids, columns.service_types, columns.business_modelx_codes, columns.type_level_1s)
+        for key, value in zip(keys, columns.actually_paids):
+            values = key_2_values.get(key)
+            if values is None:
+                key_2_values[key] = [value]
+            else:
+                values.append(value)
+
+        cells: Dict[CellKey, ReportCell] = dict()
+        for key, values in key_2_values.items():
+            values = [decimal.Decimal(value or 0.0) for value in values]
+            cells[key] = ReportCell(len(values), sum(values, decimal.Decimal('0.00')), values[0])
+
+        return cells
+
+    @staticmethod
+    def __get_bill_periods(bill_period_ids: set) -> Dict[int, BillPeriod]:
+        return {bill_period.id: bill_period for bill_period in repo.get_bill_periods_by_ids(list(bill_period_ids))}
+
+    @staticmethod
+    def __calc_total(cells: Dict[CellKey, ReportCell]) -> decimal.Decimal:
+        return sum([cell.total for cell in cells.values()], decimal.Decimal('0.00'))
+
+    @staticmethod
+    def __sum_by_dimension(cells: Dict[CellKey, ReportCell], dimension: int) -> Dict[Optional[str], decimal.Decimal]:
+        res: Dict[Optional[str], decimal.Decimal] = dict()
+        for key, cell in cells.items():
+            k = key[dimension]
+            res[k] = res.get(k, decimal.Decimal('0.00')) + cell.total
+        return res
+
+    @staticmethod
+    def __statistic_consumption_trend(
+            cells: Dict[CellKey, ReportCell],
+            bill_periods: Dict[int, BillPeriod]) -> List[ServiceTypeConsumptionTrend]:
+        # 服务类型 -> 计费周期ID -> [账单数, 合计, 第一条账单的金额]
+        service_type_2_groups: Dict[Optional[str], Dict[int, list]] = dict()
+
+        for (bill_period_id, service_type, _, _), cell in cells.items():
+            groups = service_type_2_groups.setdefault(service_type, dict())
+            group = groups.get(bill_period_id)
+            if group is None:
+                groups[bill_period_id] = [cell.cnt, decimal.Decimal('0.00') + cell.total, cell.first]
+            else:
+                group[0] += cell.cnt
+                group[1] += cell.total
+
+        result: List[ServiceTypeConsumptionTrend] = []
+        for service_type, groups in service_type_2_groups.items():
+            data_points = []
+            for bill_period_id, (cnt, total, first) in groups.items():
+                bill_period = bill_periods.get(bill_period_id)
+                if bill_period is None:
+                    continue
+                data_point = BillPeriodDataPoint(
+                    bill_period=bill_period.pretty_str,
+                    bill_period_timestamp=bill_period.timestamp.timestamp(),
+                    total=first)
+                if cnt > 1:
+                    # 合并后的数据点直接赋值合计，不经过构造时的类型转换
+                    data_point.total = total
+                data_points.append(data_point)
+
+            data_points.sort(key=lambda data_point: data_point.order_key)
+            result.append(ServiceTypeConsumptionTrend(service_type=service_type, data=data_points))
+
+        return result
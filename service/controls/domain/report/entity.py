@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 
+from typing import Optional
+
 import common.static as const
-from service.models import ReportBill, BillPeriod
+from service.models import ReportBill, BillPeriod, ReportSnapshot
 
 __all__ = [
     "Report",
     "ReportBill",
-    "BillPeriod"
+    "BillPeriod",
+    "ReportSnapshot"
 ]
 
 
 class Report:
-    def __init__(self, bill_period: BillPeriod):
+    def __init__(self, bill_period: BillPeriod, ledger_bill_cnt: Optional[int] = None):
+        """
+        :param ledger_bill_cnt: 计费周期的总账账单数，批量获取报表时预先分组统计，为空时由数据库计数
+        """
         self.__bill_period = bill_period
+        self.__ledger_bill_cnt = ledger_bill_cnt
 
     @property
     def id(self):
@@ -30,9 +37,15 @@ class Report:
     def update_time(self):
         return self.__bill_period.update_time
 
+    @property
+    def ledger_bill_cnt(self) -> int:
+        if self.__ledger_bill_cnt is None:
+            self.__ledger_bill_cnt = self.__bill_period.ledger_bill_cnt
+        return self.__ledger_bill_cnt
+
     @property
     def state(self) -> const.ReportStateTYPE:
-        num_of_ledger_bill = len(self.__bill_period.ledger_bills)
+        num_of_ledger_bill = self.ledger_bill_cnt
         if self.__bill_period.is_locked:
             if num_of_ledger_bill > 0:
                 return const.REPORT_STATE_GENERATED
@@ -1,19 +1,23 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional, Type
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type
 from abc import ABCMeta, abstractmethod
 
-from sqlalchemy import desc
+from sqlalchemy import func, or_
 
-from .entity import Report, BillPeriod
+import common.static as const
+from service.models import db_session
+from .entity import Report, ReportBill, BillPeriod, ReportSnapshot
+from .val_obj import ReportCellRow
 
 
 class IReportRepo(metaclass=ABCMeta):
     @classmethod
     @abstractmethod
-    def get_reports(cls) -> List[Report]:
-        """ 获取报表列表
+    def get_reports_of_bill_periods(cls, bill_periods: List[BillPeriod]) -> List[Report]:
+        """ 获取已查询出的一页计费周期的报表，顺序与bill_periods一致
 
+        各计费周期的总账账单数由一条分组统计的查询得到，查询次数与计费周期数、账单数无关
         """
         raise NotImplementedError
 
@@ -27,11 +31,117 @@ class IReportRepo(metaclass=ABCMeta):
         """
         raise NotImplementedError
 
+    @classmethod
+    @abstractmethod
+    def get_bill_periods_by_ids(cls, bill_period_ids: List[int]) -> List[BillPeriod]:
+        """ 批量获取计费周期，不存在的计费周期忽略
+
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_bill_periods_in_range(cls, start_bill_period_id: int, end_bill_period_id: int) -> List[BillPeriod]:
+        """ 获取账期在起始、截止计费周期之间（含两端）的计费周期，按账期排序
+
+        起止计费周期的账期由一条IN查询同时得到，共执行两条查询；起始或截止计费周期不存在时返回空列表
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_report_bills(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]) -> List[ReportBill]:
+        """ 获取多个计费周期中属于指定业务的报表账单，按ID排序，业务过滤由数据库完成，只执行一条查询 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_report_cell_rows(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]) -> List[ReportCellRow]:
+        """ 按(计费周期ID, 服务类型, 业务, 一级类型)分组统计报表账单的账单数及实付金额合计
+
+        统计由数据库完成（GROUP BY），返回结果的数量只与分组数有关，与账单数无关；已生成报表快照的计费周期直接读取快照；
+        分组按其第一条账单的ID排序，即各分组首次出现的顺序
+
+        :param bill_period_ids: 计费周期ID列表
+        :param business_modelx_codes: 仅统计属于指定业务的报表账单，可包含None，表示统计不属于任何业务的报表账单
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_report_bills_after(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]],
+            after_id: Optional[int], limit: int) -> List[ReportBill]:
+        """ 按ID顺序获取ID大于after_id的报表账单，最多limit条，用于键集分页
+
+        :param bill_period_ids: 计费周期ID列表
+        :param business_modelx_codes: 仅获取属于指定业务的报表账单，可包含None，表示不属于任何业务的报表账单
+        :param after_id: 上一页最后一条报表账单的ID，为None时获取第一页
+        :param limit: 最多获取的报表账单数
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def iter_report_bill_values(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]],
+            attr_names: List[str], batch_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        """ 按(计费周期ID, 账单ID)顺序逐条返回报表账单的属性值，属性值的顺序与attr_names一致，用于导出
+
+        只查询账单的列，通过服务端游标每次取batch_size条，内存占用与账单数无关；迭代期间不能修改会话
+
+        :param bill_period_ids: 计费周期ID列表
+        :param business_modelx_codes: 仅获取属于指定业务的报表账单，可包含None，表示不属于任何业务的报表账单
+        :param attr_names: 属性名列表
+        :param batch_size: 每次从数据库获取的账单数
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def get_bill_period_ids_with_snapshot(cls, bill_period_ids: List[int]) -> Set[int]:
+        """ 获取已生成报表快照的计费周期ID
+
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def generate_snapshot(cls, bill_period_id: int) -> int:
+        """ 生成计费周期的报表快照，覆盖已有的报表快照，返回统计单元数
+
+        快照由一条INSERT ... SELECT ... GROUP BY语句生成，账单不会加载到内存
+        """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def delete_snapshot(cls, bill_period_id: int) -> int:
+        """ 删除计费周期的报表快照，返回删除的统计单元数
+
+        """
+        raise NotImplementedError
+
 
 class ReportRepo(IReportRepo):
     @classmethod
-    def get_reports(cls) -> List[Report]:
-        return [Report(bill_period) for bill_period in BillPeriod.query.order_by(desc(BillPeriod.timestamp))]
+    def get_reports_of_bill_periods(cls, bill_periods: List[BillPeriod]) -> List[Report]:
+        ledger_bill_cnts = cls.__get_ledger_bill_cnts([bill_period.id for bill_period in bill_periods])
+        return [Report(bill_period, ledger_bill_cnts.get(bill_period.id, 0)) for bill_period in bill_periods]
+
+    @staticmethod
+    def __get_ledger_bill_cnts(bill_period_ids: List[int]) -> Dict[int, int]:
+        """ 分组统计各计费周期的总账账单数，没有总账账单的计费周期不在结果中 """
+        if not bill_period_ids:
+            return dict()
+
+        query = db_session.query(ReportBill.bill_period_id, func.count(ReportBill.id)) \
+                          .filter(ReportBill.bill_period_id.in_(bill_period_ids)) \
+                          .filter(ReportBill.type == const.BILL_TYPE_LEDGER) \
+                          .group_by(ReportBill.bill_period_id)
+        return dict(query.all())
 
     @classmethod
     def get_report_by_bill_period_id(cls, bill_period_id: int) -> Optional[Report]:
@@ -41,5 +151,152 @@ class ReportRepo(IReportRepo):
         else:
             return None
 
+    @classmethod
+    def get_bill_periods_by_ids(cls, bill_period_ids: List[int]) -> List[BillPeriod]:
+        if not bill_period_ids:
+            return []
+        return BillPeriod.query.filter(BillPeriod.id.in_(bill_period_ids)).all()
+
+    @classmethod
+    def get_bill_periods_in_range(cls, start_bill_period_id: int, end_bill_period_id: int) -> List[BillPeriod]:
+        timestamps = dict(db_session.query(BillPeriod.id, BillPeriod.timestamp)
+                                    .filter(BillPeriod.id.in_([start_bill_period_id, end_bill_period_id])).all())
+        if start_bill_period_id not in timestamps or end_bill_period_id not in timestamps:
+            return []
+        return BillPeriod.query.filter(BillPeriod.timestamp.between(timestamps[start_bill_period_id],
+                                                                    timestamps[end_bill_period_id])) \
+                               .order_by(BillPeriod.timestamp).all()
+
+    @classmethod
+    def get_report_bills(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]) -> List[ReportBill]:
+        if not bill_period_ids or not business_modelx_codes:
+            return []
+        return ReportBill.query.filter(ReportBill.bill_period_id.in_(bill_period_ids)) \
+                               .filter(ReportBill.type == const.BILL_TYPE_LEDGER) \
+                               .filter(cls.__filter_by_business(ReportBill.business_modelx_code, business_modelx_codes)) \
+                               .order_by(ReportBill.id).all()
+
+    @classmethod
+    def get_report_cell_rows(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]) -> List[ReportCellRow]:
+        if not bill_period_ids or not business_modelx_codes:
+            return []
+
+        # 已生成报表快照的计费周期读取快照，其余计费周期实时统计
+        bill_period_ids_with_snapshot = cls.get_bill_period_ids_with_snapshot(bill_period_ids)
+        bill_period_ids_without_snapshot = [bill_period_id for bill_period_id in bill_period_ids
+                                            if bill_period_id not in bill_period_ids_with_snapshot]
+
+        rows = []
+        if bill_period_ids_with_snapshot:
+            rows.extend(cls.__query_snapshot_cells(list(bill_period_ids_with_snapshot), business_modelx_codes))
+        if bill_period_ids_without_snapshot:
+            rows.extend(cls.__query_report_bill_cells(bill_period_ids_without_snapshot, business_modelx_codes))
+
+        # 按统计单元的第一条账单的ID排序
+        rows.sort(key=lambda row: row[-1])
+        return [ReportCellRow(*row[:-1]) for row in rows]
+
+    @classmethod
+    def get_report_bills_after(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]],
+            after_id: Optional[int], limit: int) -> List[ReportBill]:
+        if not bill_period_ids or not business_modelx_codes:
+            return []
+
+        query = ReportBill.query.filter(ReportBill.bill_period_id.in_(bill_period_ids)) \
+                                .filter(ReportBill.type == const.BILL_TYPE_LEDGER) \
+                                .filter(cls.__filter_by_business(ReportBill.business_modelx_code, business_modelx_codes))
+
+        if after_id is not None:
+            query = query.filter(ReportBill.id > after_id)
+
+        return query.order_by(ReportBill.id).limit(limit).all()
+
+    @classmethod
+    def iter_report_bill_values(
+            cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]],
+            attr_names: List[str], batch_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        if not bill_period_ids or not business_modelx_codes:
+            return
+
+        columns = [getattr(ReportBill, attr_name) for attr_name in attr_names]
+        query = db_session.query(*columns) \
+                          .filter(ReportBill.bill_period_id.in_(bill_period_ids)) \
+                          .filter(ReportBill.type == const.BILL_TYPE_LEDGER) \
+                          .filter(cls.__filter_by_business(ReportBill.business_modelx_code, business_modelx_codes)) \
+                          .order_by(ReportBill.bill_period_id, ReportBill.id) \
+                          .execution_options(stream_results=True) \
+                          .yield_per(batch_size)
+        for values in query:
+            yield tuple(values)
+
+    @classmethod
+    def get_bill_period_ids_with_snapshot(cls, bill_period_ids: List[int]) -> Set[int]:
+        if not bill_period_ids:
+            return set()
+
+        query = db_session.query(ReportSnapshot.bill_period_id) \
+                          .filter(ReportSnapshot.bill_period_id.in_(bill_period_ids)) \
+                          .distinct()
+        return {values[0] for values in query}
+
+    @classmethod
+    def generate_snapshot(cls, bill_period_id: int) -> int:
+        # INSERT ... SELECT不会触发自动刷新，先写入会话中尚未刷新的总账账单
+        db_session.flush()
+        cls.delete_snapshot(bill_period_id)
+
+        query = cls.__group_report_bills(
+            db_session.query(ReportBill.bill_period_id).filter(ReportBill.bill_period_id == bill_period_id))
+
+        columns = ['bill_period_id', 'service_type', 'business_modelx_code', 'type_level_1',
+                   'bill_cnt', 'actually_paid', 'first_bill_id']
+        result = db_session.execute(ReportSnapshot.__table__.insert().from_select(columns, query.statement))
+        return result.rowcount
+
+    @classmethod
+    def delete_snapshot(cls, bill_period_id: int) -> int:
+        return ReportSnapshot.query.filter(ReportSnapshot.bill_period_id == bill_period_id) \
+                                   .delete(synchronize_session=False)
+
+    @classmethod
+    def __query_report_bill_cells(cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]):
+        query = db_session.query(ReportBill.bill_period_id) \
+                          .filter(ReportBill.bill_period_id.in_(bill_period_ids)) \
+                          .filter(cls.__filter_by_business(ReportBill.business_modelx_code, business_modelx_codes))
+        return cls.__group_report_bills(query).all()
+
+    @classmethod
+    def __query_snapshot_cells(cls, bill_period_ids: List[int], business_modelx_codes: List[Optional[str]]):
+        query = db_session.query(ReportSnapshot.bill_period_id, ReportSnapshot.service_type,
+                                 ReportSnapshot.business_modelx_code, ReportSnapshot.type_level_1,
+                                 ReportSnapshot.bill_cnt, ReportSnapshot.actually_paid, ReportSnapshot.first_bill_id) \
+                          .filter(ReportSnapshot.bill_period_id.in_(bill_period_ids)) \
+                          .filter(cls.__filter_by_business(ReportSnapshot.business_modelx_code, business_modelx_codes))
+        return query.all()
+
+    @staticmethod
+    def __group_report_bills(query):
+        """ 按(计费周期ID, 服务类型, 业务, 一级类型)分组统计总账账单的账单数、实付金额合计及第一条账单的ID """
+        keys = [ReportBill.service_type, ReportBill.business_modelx_code, ReportBill.type_level_1]
+        return query.add_columns(*keys,
+                                 func.count(ReportBill.id),
+                                 func.sum(ReportBill.actually_paid),
+                                 func.min(ReportBill.id)) \
+                    .filter(ReportBill.type == const.BILL_TYPE_LEDGER) \
+                    .group_by(ReportBill.bill_period_id, *keys)
+
+    @staticmethod
+    def __filter_by_business(column, business_modelx_codes: List[Optional[str]]):
+        filters = []
+        codes = [code for code in business_modelx_codes if code is not None]
+        if codes:
+            filters.append(column.in_(codes))
+        if None in business_modelx_codes:
+            filters.append(column.is_(None))
+        return or_(*filters)
+
 
 repo: Type[IReportRepo] = ReportRepo
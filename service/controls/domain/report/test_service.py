@@ -2,7 +2,9 @@
 
 import pytest
 
+from .repo import repo
 from .service import *
+from ..bill.aggr import BillPeriodAggr
 
 
 @pytest.fixture
@@ -91,9 +93,100 @@ class TestReportService:
             if p.type_level_1 == 'tl1':
                 assert p.total == 550000.0
 
+    def test_statistic(self, report_bills_belongs_to_bill_periods):
+        report_bills = report_bills_belongs_to_bill_periods
+        res: ReportStatistics = ReportService.statistic(report_bills)
+
+        assert res.total == 1100000.0
+        assert len(res.consumption_trend) == 2
+        assert sum([p.total for p in res.business_distribution]) == res.total
+        assert sum([p.total for p in res.service_type_distribution]) == res.total
+        assert sum([p.total for p in res.type_level_1_distribution]) == res.total
+
+        for trend in res.consumption_trend:
+            timestamps = [p.bill_period_timestamp for p in trend.data]
+            assert timestamps == sorted(timestamps)
+
+    def test_statistic_bill_periods(self, report_bills_belongs_to_bill_periods):
+        report_bills = report_bills_belongs_to_bill_periods
+        bill_period_ids = list({report_bill.bill_period_id for report_bill in report_bills})
+
+        res: ReportStatistics = ReportService.statistic_bill_periods(bill_period_ids, ['b1', None])
+        expected: ReportStatistics = ReportService.statistic(report_bills)
+
+        assert res.total == expected.total
+        assert len(res.consumption_trend) == len(expected.consumption_trend)
+        assert {p.business: p.total for p in res.business_distribution} \
+            == {p.business: p.total for p in expected.business_distribution}
+
+        res = ReportService.statistic_bill_periods(bill_period_ids, ['b1'])
+        assert res.total == 220000.0
+
 
 class TestBillPeriodDataPoint:
     def test_create(self):
         # TODO 无法正常初始化属性，暂时通过实例话后设置属性的方式设置规避
         p = BillPeriodDataPoint(total=1.0)
         assert p.total == 1.0
+
+
+class TestReportSnapshotService:
+    def test_generate_on_lock_and_invalidate_on_unlock(
+            self, report_bills_belongs_to_bill_periods):
+        report_bills = report_bills_belongs_to_bill_periods
+        bill_period_ids = list({report_bill.bill_period_id for report_bill in report_bills})
+        expected: ReportStatistics = ReportService.statistic_bill_periods(bill_period_ids, ['b1', None])
+
+        aggrs = [BillPeriodAggr.get_by_id(bill_period_id) for bill_period_id in bill_period_ids]
+        for aggr in aggrs:
+            aggr.lock()
+
+        assert repo.get_bill_period_ids_with_snapshot(bill_period_ids) == set(bill_period_ids)
+
+        res: ReportStatistics = ReportService.statistic_bill_periods(bill_period_ids, ['b1', None])
+        assert res.total == expected.total
+        assert {p.business: p.total for p in res.business_distribution} \
+            == {p.business: p.total for p in expected.business_distribution}
+
+        for aggr in aggrs:
+            aggr.unlock()
+
+        assert repo.get_bill_period_ids_with_snapshot(bill_period_ids) == set()
+
+    def test_invalidate_on_ledger_bill_deleted(self, report_bills_belongs_to_bill_periods):
+        report_bills = report_bills_belongs_to_bill_periods
+        bill_period_ids = list({report_bill.bill_period_id for report_bill in report_bills})
+
+        aggrs = [BillPeriodAggr.get_by_id(bill_period_id) for bill_period_id in bill_period_ids]
+        for aggr in aggrs:
+            aggr.lock()
+
+        deleted = report_bills[0]
+        BillPeriodAggr.get_by_id(deleted.bill_period_id).delete_ledger_bill(deleted)
+
+        assert repo.get_bill_period_ids_with_snapshot(bill_period_ids) == set(bill_period_ids) - {deleted.bill_period_id}
+
+        res: ReportStatistics = ReportService.statistic_bill_periods(bill_period_ids, ['b1', None])
+        assert res.total == sum([report_bill.actually_paid for report_bill in report_bills[1:]])
+
+        for aggr in aggrs:
+            aggr.unlock()
+
+
+class TestReportRepo:
+    def test_get_bill_periods_in_range(self, report_bills_belongs_to_bill_periods):
+        bill_period_ids = sorted({report_bill.bill_period_id for report_bill in report_bills_belongs_to_bill_periods})
+
+        bill_periods = repo.get_bill_periods_in_range(bill_period_ids[0], bill_period_ids[-1])
+        assert [bill_period.id for bill_period in bill_periods] == bill_period_ids
+
+        # 起始晚于截止
+        assert repo.get_bill_periods_in_range(bill_period_ids[-1], bill_period_ids[0]) == []
+
+    def test_get_report_bills(self, report_bills_belongs_to_bill_periods):
+        report_bills = report_bills_belongs_to_bill_periods
+        bill_period_ids = list({report_bill.bill_period_id for report_bill in report_bills})
+
+        assert len(repo.get_report_bills(bill_period_ids, ['b1'])) == 2
+        assert len(repo.get_report_bills(bill_period_ids, ['b1', None])) == 6
+        assert repo.get_report_bills(bill_period_ids, []) == []
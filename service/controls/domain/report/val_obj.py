@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from typing import List, Optional, Sequence
+
+from ex_dataclass import ex_dataclass, field, EXpack
+
+import common.util.decimal as decimal
+from .entity import ReportBill
+
+
+@ex_dataclass
+class DataPoint(EXpack, metaclass=ABCMeta):
+    total: decimal.Decimal = field(default_factory=decimal.Decimal)
+
+    @property
+    @abstractmethod
+    def key(self):
+        raise NotImplementedError
+
+    @property
+    def order_key(self):
+        return self.key
+
+    @staticmethod
+    def loads_total(val: float):
+        return decimal.Decimal(val or 0.0)
+
+    def copy(self, **kwargs):
+        new = type(self)(**self.asdict())
+        for k, v in kwargs.items():
+            setattr(new, k, v)
+        return new
+
+
+@ex_dataclass
+class BillPeriodDataPoint(DataPoint):
+    bill_period_timestamp: float = field(default=None)  # 用于排序
+    bill_period: str = field(default=None)                # 格式：YYYY-MM
+
+    @property
+    def key(self):
+        return self.bill_period
+
+    @property
+    def order_key(self):
+        return self.bill_period_timestamp
+
+
+@ex_dataclass
+class BusinessDataPoint(DataPoint):
+    business: str = field(default=None)
+
+    @property
+    def key(self):
+        return self.business
+
+
+@ex_dataclass
+class ServiceTypeDataPoint(DataPoint):
+    service_type: str = field(default=None)
+
+    @property
+    def key(self):
+        return self.service_type
+
+
+@ex_dataclass
+class TypeLevel1DataPoint(DataPoint):
+    type_level_1: str = field(default=None)
+
+    @property
+    def key(self):
+        return self.type_level_1
+
+
+@ex_dataclass
+class ServiceTypeConsumptionTrend:
+    service_type: str = field(default=None)
+    data: List[BillPeriodDataPoint] = field(default_factory=list)
+
+
+@ex_dataclass
+class ReportStatistics:
+    """ 报表的各类统计数据 """
+    total: decimal.Decimal = field(default_factory=decimal.Decimal)
+    bill_cnt: int = field(default=0)
+    consumption_trend: List[ServiceTypeConsumptionTrend] = field(default_factory=list)
+    business_distribution: List[BusinessDataPoint] = field(default_factory=list)
+    service_type_distribution: List[ServiceTypeDataPoint] = field(default_factory=list)
+    type_level_1_distribution: List[TypeLevel1DataPoint] = field(default_factory=list)
+
+
+# 按(计费周期ID, 服务类型, 业务, 一级类型)分组统计的报表账单，cnt为账单数，total为实付金额合计
+ReportCellRow = namedtuple(
+    'ReportCellRow', ['bill_period_id', 'service_type', 'business_modelx_code', 'type_level_1', 'cnt', 'total'])
+
+
+class ReportColumns:
+    """ 列式存储的报表账单
+
+    仅包含统计所需的列，同一下标的各列元素属于同一条报表账单
+    """
+    def __init__(self,
+                 bill_period_ids: Sequence[int],
+                 service_types: Sequence[Optional[str]],
+                 business_modelx_codes: Sequence[Optional[str]],
+                 type_level_1s: Sequence[Optional[str]],
+                 actually_paids: Sequence[Optional[decimal.Decimal]]):
+        self.bill_period_ids = bill_period_ids
+        self.service_types = service_types
+        self.business_modelx_codes = business_modelx_codes
+        self.type_level_1s = type_level_1s
+        self.actually_paids = actually_paids
+
+    def __len__(self):
+        return len(self.actually_paids)
+
+    @classmethod
+    def from_report_bills(cls, report_bills: List[ReportBill]) -> "ReportColumns":
+        return cls(
+            [report_bill.bill_period_id for report_bill in report_bills],
+            [report_bill.service_type for report_bill in report_bills],
+            [report_bill.business_modelx_code for report_bill in report_bills],
+            [report_bill.type_level_1 for report_bill in report_bills],
+            [report_bill.actually_paid for report_bill in report_bills])
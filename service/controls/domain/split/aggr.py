@@ -3,9 +3,11 @@
 # 分账子领域内的计费周期聚合依赖了账单子领域的计费周期聚合
 # 考虑通过事件机制移除依赖
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import common.static as const
 from ..bill.aggr import BillPeriodAggr as AggrFromSubdomainOfBill
+from ..bill.repo import repo as repo_from_subdomain_of_bill
 from .entity import *
 
 
@@ -21,10 +23,36 @@ class BillPeriodAggr:
     def original_bills(self) -> List[OriginalBill]:
         return self.__aggr_from_subdomain_of_bill.original_bills
 
+    @property
+    def original_bill_rows(self) -> List[Tuple[int, BillRow]]:
+        """ 原始账单行，(原始账单ID, 账单行)组成的列表 """
+        return repo_from_subdomain_of_bill.get_bill_rows(self.bill_period.id, const.BILL_TYPE_ORIGINAL)
+
+    def get_original_bill_rows(
+            self, original_bill_ids: Optional[List[int]] = None,
+            attr_filters: Optional[List[Dict[str, Any]]] = None) -> List[Tuple[int, BillRow]]:
+        """ 按原始账单ID或属性过滤原始账单行，参考IBillPeriodRepo.get_bill_rows """
+        return repo_from_subdomain_of_bill.get_bill_rows(
+            self.bill_period.id, const.BILL_TYPE_ORIGINAL, bill_ids=original_bill_ids, attr_filters=attr_filters)
+
     @property
     def ledger_bills(self) -> List[LedgerBill]:
         return self.__aggr_from_subdomain_of_bill.ledger_bills
 
+    @property
+    def ledger_bill_rows(self) -> List[BillRow]:
+        """ 总账账单行 """
+        return [ledger_bill_row for _, ledger_bill_row in
+                repo_from_subdomain_of_bill.get_bill_rows(self.bill_period.id, const.BILL_TYPE_LEDGER)]
+
+    @property
+    def has_ledger_bills(self) -> bool:
+        return repo_from_subdomain_of_bill.has_bills(self.bill_period.id, const.BILL_TYPE_LEDGER)
+
+    @property
+    def is_locked(self) -> bool:
+        return self.__aggr_from_subdomain_of_bill.is_locked
+
     @property
     def split_rules(self) -> List[SplitRule]:
         return self.__aggr_from_subdomain_of_bill.split_rules
@@ -36,8 +64,11 @@ class BillPeriodAggr:
 
     @classmethod
     def get_by_id(cls, bill_period_id: int) -> Optional["BillPeriodAggr"]:
-        aggr_from_subdomain_of_bill = AggrFromSubdomainOfBill.get_by_id_or_raise_404(bill_period_id)
-        return cls(aggr_from_subdomain_of_bill)
+        aggr_from_subdomain_of_bill = AggrFromSubdomainOfBill.get_by_id(bill_period_id)
+        if not aggr_from_subdomain_of_bill:
+            return None
+        else:
+            return cls(aggr_from_subdomain_of_bill)
 
     def delete(self):
         self.__aggr_from_subdomain_of_bill.delete()
@@ -45,6 +76,13 @@ class BillPeriodAggr:
     def set_ledger_bills(self, ledger_bills: List[LedgerBill]):
         self.__aggr_from_subdomain_of_bill.set_ledger_bills(ledger_bills)
 
+    def set_ledger_bill_rows(self, ledger_bill_rows: List[BillRow]):
+        self.__aggr_from_subdomain_of_bill.set_ledger_bill_rows(ledger_bill_rows)
+
+    def replace_ledger_bill_rows_of_original_bills(self, original_bill_ids: List[int], ledger_bill_rows: List[BillRow]):
+        self.__aggr_from_subdomain_of_bill.replace_ledger_bill_rows_of_original_bills(
+            original_bill_ids, ledger_bill_rows)
+
     def split_ledger_bill(self, ledger_bill: LedgerBill, ledger_bills: List[LedgerBill]):
         """ 拆分总账账单
 
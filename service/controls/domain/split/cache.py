@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+from common.util.log import get_logger
+from .entity import SplitRule
+
+logger = get_logger('domain:split:cache')
+
+__all__ = [
+    "SplitRuleCache",
+    "split_rule_cache"
+]
+
+
+class SplitRuleCache:
+    """ 分账规则解析结果缓存
+
+    按(分账规则ID, 更新时间)缓存分账策略、匹配器等解析结果，缓存的对象须不可修改且可重入，可修改的对象（如匹配器）由调用方返回副本
+
+    1. 命中时还会比对解析时的原始数据（分账策略、匹配器的JSON），同一事务内修改分账规则但更新时间未变化时不会命中旧结果
+    2. 分账规则更新时，由SplitRuleUpdated事件的处理函数显式失效
+    3. 按最近最少使用淘汰，缓存条目数不超过max_size
+    4. 未持久化的分账规则（ID为空）不缓存
+    """
+    def __init__(self, max_size: int = 4096):
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        # (类别, 分账规则ID, 更新时间) -> (原始数据, 解析结果)
+        self.__entries: "OrderedDict[Tuple[str, int, Hashable], Tuple[Any, Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_or_build(self, kind: str, split_rule: SplitRule, source: Any, build: Callable[[SplitRule], Any]) -> Any:
+        """ 获取缓存的解析结果，未命中时解析并缓存
+
+        :param kind: 解析结果的类别，如分账策略、匹配器
+        :param split_rule: 分账规则
+        :param source: 解析所使用的原始数据
+        :param build: 解析函数，抛出异常时不缓存
+        """
+        if split_rule.id is None:
+            return build(split_rule)
+
+        key = (kind, split_rule.id, split_rule.update_time)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] == source:
+                self.__entries.move_to_end(key)
+                return entry[1]
+
+        value = build(split_rule)
+
+        with self.__lock:
+            self.__entries[key] = (copy.deepcopy(source), value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, split_rule_id: int):
+        """ 失效指定分账规则的所有解析结果 """
+        with self.__lock:
+            for key in [key for key in self.__entries.keys() if key[1] == split_rule_id]:
+                del self.__entries[key]
+
+        logger.debug(f'cache of split rule {split_rule_id} invalidated.')
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+split_rule_cache = SplitRuleCache()
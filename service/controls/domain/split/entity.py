@@ -6,5 +6,7 @@ __all__ = [
     "BillPeriod",
     "OriginalBill",
     "LedgerBill",
-    "SplitRule"
+    "SplitRule",
+    "BillRow",
+    "BILL_ROW_FIELDS"
 ]
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from .entity import OriginalBill, LedgerBill
+from .entity import OriginalBill, LedgerBill, BillRow
 import common.static as const
 
 
@@ -18,3 +18,11 @@ def build_ledger_bill_by_original_bill(original_bill: OriginalBill) -> LedgerBil
     ledger_bill.parent_id = original_bill.id
 
     return ledger_bill
+
+
+def build_ledger_bill_row_by_original_bill_row(original_bill_id: int, original_bill_row: BillRow) -> BillRow:
+    """ 与build_ledger_bill_by_original_bill等价，但不创建ORM对象
+
+    异常信息置空，由总账账单的校验重新标记
+    """
+    return original_bill_row._replace(type=const.BILL_TYPE_LEDGER, parent_id=original_bill_id, exception=None)
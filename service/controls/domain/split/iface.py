@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
+from typing import Callable, Iterator, List, Optional
 
 
 class IBillPeriodSplitService(metaclass=ABCMeta):
@@ -15,5 +16,25 @@ class IBillPeriodSplitService(metaclass=ABCMeta):
     """
     @classmethod
     @abstractmethod
-    def split_original_bills_of_bill_period(cls, bill_period_id: int):
+    def split_original_bills_of_bill_period(
+            cls, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None):
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def split_original_bills_incrementally(cls, bill_period_id: int, original_bill_ids: List[int]):
+        """ 增量分账，仅对指定的原始账单重新分账 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def split_original_bills_affected_by_split_rule(
+            cls, split_rule_id: int, previous_bill_matchers: Optional[dict] = None):
+        """ 增量分账，仅对最佳匹配的分账规则可能发生变化的原始账单重新分账 """
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def preview_split_original_bills_of_bill_period(cls, bill_period_id: int) -> Iterator[dict]:
+        """ 预览分账，返回预览分账结果与现有总账账单的差异记录，不修改计费周期 """
         raise NotImplementedError
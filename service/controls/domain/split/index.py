@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from .entity import SplitRule, OriginalBill
+from .val_obj import BillMatcher
+
+
+class SplitRuleIndex:
+    """ 分账规则索引
+
+    分账开始前，对分账规则进行一次编译，编译结果按匹配器中值非None的属性（签名）分组：
+
+    1. 同一分组内的分账规则的分数相同，以匹配值组成的元组为key建立字典
+    2. 分组按分数从高到低排序
+
+    选择分账规则时，对每个分组仅需一次字典查找，分数更低的分组在找到匹配后即可跳过；
+    结果与逐条遍历分账规则一致：选择分数最高的分账规则，分数相同时选择排在前面的分账规则，分数为0的规则不会被选中。
+
+    索引仅保存分账规则的位置，不持有分账规则对象本身，可以被序列化后在其他进程中使用。
+    """
+    def __init__(self, groups: List[Tuple[int, Tuple[str, ...], Dict[tuple, int]]]):
+        self.__groups = groups
+
+    @classmethod
+    def build(cls, split_rules: List[SplitRule]) -> "SplitRuleIndex":
+        return cls.build_by_bill_matchers([BillMatcher.get_by_split_rule(split_rule) for split_rule in split_rules])
+
+    @classmethod
+    def build_by_bill_matchers(cls, bill_matchers: List[Optional[BillMatcher]]) -> "SplitRuleIndex":
+        signature_2_group: Dict[Tuple[str, ...], Dict[tuple, int]] = dict()
+        signature_2_score: Dict[Tuple[str, ...], int] = dict()
+
+        for position, bill_matcher in enumerate(bill_matchers):
+            if not bill_matcher:
+                continue
+
+            score = bill_matcher.score
+            if score <= 0:
+                # 逐条遍历时，分数需大于当前最高分（初始为0）才会被选中
+                continue
+
+            signature = tuple(k for k in bill_matcher.asdict().keys() if getattr(bill_matcher, k, None) is not None)
+            values = tuple(getattr(bill_matcher, k) for k in signature)
+
+            try:
+                hash(values)
+            except TypeError:
+                # 不可哈希的匹配值（如列表）与账单属性永远不相等，该规则不会被选中
+                continue
+
+            group = signature_2_group.setdefault(signature, dict())
+            signature_2_score[signature] = score
+
+            # 同一分组内分数相同，排在前面的分账规则优先
+            group.setdefault(values, position)
+
+        groups = [(signature_2_score[signature], signature, group) for signature, group in signature_2_group.items()]
+        groups.sort(key=lambda item: item[0], reverse=True)
+
+        return cls(groups)
+
+    def __len__(self):
+        return sum(len(group) for _, _, group in self.__groups)
+
+    def match(self, original_bill: Any) -> Optional[int]:
+        """ 返回与原始账单最佳匹配的分账规则的位置，未匹配任何分账规则时返回None
+
+        :param original_bill: 原始账单，或者具有相同属性名的对象（如账单行元组）
+        """
+        best_position: Optional[int] = None
+        best_score = 0
+
+        for score, signature, group in self.__groups:
+            if score < best_score:
+                break
+
+            try:
+                position = group.get(tuple(getattr(original_bill, k, None) for k in signature))
+            except TypeError:
+                # 账单属性值不可哈希时，不可能与任何匹配值相等
+                continue
+
+            if position is None:
+                continue
+
+            if best_position is None or score > best_score or position < best_position:
+                best_position = position
+                best_score = score
+
+        return best_position
+
+    def select(self, split_rules: List[SplitRule], original_bill: OriginalBill) -> Optional[SplitRule]:
+        """ 从构建索引时使用的分账规则列表中，选出与原始账单最佳匹配的分账规则 """
+        position = self.match(original_bill)
+        if position is None:
+            return None
+        else:
+            return split_rules[position]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from . import factory
+from .entity import BillRow
+from .index import SplitRuleIndex
+from .val_obj import CompositeSplitPolicy
+
+__all__ = [
+    "ParallelSplitConfig",
+    "split_original_bill_rows",
+    "split_original_bill_rows_in_parallel"
+]
+
+
+class ParallelSplitConfig:
+    """ 并行分账配置
+
+    :param enabled: 是否开启并行分账，默认关闭
+    :param workers: 工作进程数，默认为CPU核数
+    :param chunk_size: 每个分片包含的原始账单数，原始账单数不超过分片大小时不开启并行
+    """
+    def __init__(self, enabled: bool = False, workers: Optional[int] = None, chunk_size: int = 5000):
+        self.enabled = enabled
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(chunk_size, 1)
+
+
+# 分片的分账结果：(总账账单行, 未能分账的分账规则位置)
+# 匹配到的分账规则的分账策略解析失败时，停止处理该分片，由调用方抛出异常
+ChunkResult = Tuple[List[BillRow], Optional[int]]
+
+
+def split_original_bill_rows(
+        split_rule_index: SplitRuleIndex,
+        composite_split_policies: List[Optional[CompositeSplitPolicy]],
+        original_bill_rows: List[Tuple[int, BillRow]]) -> ChunkResult:
+    """ 对原始账单行进行分账，按原始账单的顺序返回总账账单行
+
+    :param split_rule_index: 分账规则索引
+    :param composite_split_policies: 与分账规则一一对应的分账策略，解析失败的分账策略为None
+    :param original_bill_rows: (原始账单ID, 账单行)组成的列表
+    """
+    ledger_bill_rows: List[BillRow] = []
+
+    for original_bill_id, original_bill_row in original_bill_rows:
+        ledger_bill_row = factory.build_ledger_bill_row_by_original_bill_row(original_bill_id, original_bill_row)
+
+        position = split_rule_index.match(original_bill_row)
+        if position is None:
+            # 未与任何分账规则匹配，直接转为总账账单
+            ledger_bill_rows.append(ledger_bill_row)
+            continue
+
+        composite_split_policy = composite_split_policies[position]
+        if composite_split_policy is None:
+            return ledger_bill_rows, position
+
+        ledger_bill_rows.extend(composite_split_policy.split_bill_row(ledger_bill_row))
+
+    return ledger_bill_rows, None
+
+
+def _split_chunk(args) -> ChunkResult:
+    return split_original_bill_rows(*args)
+
+
+def split_original_bill_rows_in_parallel(
+        split_rule_index: SplitRuleIndex,
+        composite_split_policies: List[Optional[CompositeSplitPolicy]],
+        original_bill_rows: List[Tuple[int, BillRow]],
+        config: ParallelSplitConfig,
+        progress: Optional[Callable[[int, int], None]] = None) -> ChunkResult:
+    """ 将原始账单行分片后交由进程池分账，按分片顺序合并结果，与split_original_bill_rows的结果一致
+
+    工作进程只进行匹配与计算，不访问数据库，分账结果由调用方在当前事务内写入
+
+    :param progress: 每个分片完成后调用，参数为(已分账的原始账单数, 原始账单总数)
+    """
+    chunk_size = config.chunk_size
+    chunks = [(split_rule_index, composite_split_policies, original_bill_rows[i:i + chunk_size])
+              for i in range(0, len(original_bill_rows), chunk_size)]
+
+    ledger_bill_rows: List[BillRow] = []
+
+    with ProcessPoolExecutor(max_workers=min(config.workers, len(chunks))) as executor:
+        # map按提交顺序返回结果，保证合并后的总账账单与原始账单的顺序一致
+        for i, (chunk_ledger_bill_rows, failed_position) in enumerate(executor.map(_split_chunk, chunks)):
+            ledger_bill_rows.extend(chunk_ledger_bill_rows)
+            if failed_position is not None:
+                return ledger_bill_rows, failed_position
+            if progress is not None:
+                progress(min((i + 1) * chunk_size, len(original_bill_rows)), len(original_bill_rows))
+
+    return ledger_bill_rows, None
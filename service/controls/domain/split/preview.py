@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import common.util.decimal as decimal
+from .entity import BillRow
+
+__all__ = [
+    "diff_ledger_bill_rows"
+]
+
+
+# 总账账单的比较单元：(业务, 实付金额)
+Item = Tuple[Optional[str], Optional[decimal.Decimal]]
+
+
+def diff_ledger_bill_rows(
+        original_bill_ids: List[int],
+        current_ledger_bill_rows: List[BillRow],
+        preview_ledger_bill_rows: List[BillRow]) -> Iterator[dict]:
+    """ 比较计费周期现有的总账账单与预览分账得到的总账账单，逐条生成差异记录
+
+    总账账单按所属原始账单（parent_id）分组，同一原始账单下按(业务, 实付金额)比较，金额按数据库精度（两位小数）比较，
+    依次生成以下记录：
+
+    1. type=original_bill：每条分账结果有变化的原始账单一条，包含新增、移除的总账账单及实付金额变化
+    2. type=business：每个业务一条，包含现有、预览的实付金额合计及其变化，新增、移除的总账账单数
+    3. type=summary：汇总记录
+
+    不属于任何原始账单的总账账单（如手工创建的总账账单）在重新分账后会被移除，归入original_bill_id为None的分组
+
+    :param original_bill_ids: 按分账顺序排列的原始账单ID
+    :param current_ledger_bill_rows: 计费周期现有的总账账单
+    :param preview_ledger_bill_rows: 预览分账得到的总账账单
+    """
+    current_by_parent = _group_by_parent(current_ledger_bill_rows)
+    preview_by_parent = _group_by_parent(preview_ledger_bill_rows)
+
+    parent_ids: List[Optional[int]] = list(original_bill_ids)
+    known_parent_ids = set(parent_ids)
+    parent_ids.extend([parent_id for parent_id in current_by_parent.keys() if parent_id not in known_parent_ids])
+
+    # 业务 -> [现有合计, 预览合计, 新增数, 移除数]
+    business_2_stats: Dict[Optional[str], list] = OrderedDict()
+
+    changed_cnt = 0
+    for parent_id in parent_ids:
+        current = Counter(current_by_parent.get(parent_id, []))
+        preview = Counter(preview_by_parent.get(parent_id, []))
+
+        for (business, amount), cnt in current.items():
+            _get_stats(business_2_stats, business)[0] += (amount or 0) * cnt
+        for (business, amount), cnt in preview.items():
+            _get_stats(business_2_stats, business)[1] += (amount or 0) * cnt
+
+        if current == preview:
+            continue
+
+        added = list((preview - current).elements())
+        removed = list((current - preview).elements())
+
+        for business, _ in added:
+            _get_stats(business_2_stats, business)[2] += 1
+        for business, _ in removed:
+            _get_stats(business_2_stats, business)[3] += 1
+
+        changed_cnt += 1
+        yield {
+            'type': 'original_bill',
+            'original_bill_id': parent_id,
+            'added': [_item_2_dict(item) for item in added],
+            'removed': [_item_2_dict(item) for item in removed],
+            'amount_delta': str(_sum(preview) - _sum(current))
+        }
+
+    for business, (current_total, preview_total, added_cnt, removed_cnt) in business_2_stats.items():
+        yield {
+            'type': 'business',
+            'business_modelx_code': business,
+            'current_actually_paid': str(current_total),
+            'preview_actually_paid': str(preview_total),
+            'amount_delta': str(preview_total - current_total),
+            'added': added_cnt,
+            'removed': removed_cnt
+        }
+
+    yield {
+        'type': 'summary',
+        'original_bill_cnt': len(original_bill_ids),
+        'changed_original_bill_cnt': changed_cnt,
+        'current_ledger_bill_cnt': len(current_ledger_bill_rows),
+        'preview_ledger_bill_cnt': len(preview_ledger_bill_rows)
+    }
+
+
+def _group_by_parent(ledger_bill_rows: List[BillRow]) -> Dict[Optional[int], List[Item]]:
+    res: Dict[Optional[int], List[Item]] = dict()
+    for ledger_bill_row in ledger_bill_rows:
+        amount = ledger_bill_row.actually_paid
+        if amount is not None:
+            amount = decimal.quantize(amount)
+        res.setdefault(ledger_bill_row.parent_id, []).append((ledger_bill_row.business_modelx_code, amount))
+    return res
+
+
+def _get_stats(business_2_stats: Dict[Optional[str], list], business: Optional[str]) -> list:
+    if business not in business_2_stats:
+        business_2_stats[business] = [decimal.Decimal('0.00'), decimal.Decimal('0.00'), 0, 0]
+    return business_2_stats[business]
+
+
+def _sum(items: Counter) -> decimal.Decimal:
+    return sum([(amount or 0) * cnt for (_, amount), cnt in items.items()], decimal.Decimal('0.00'))
+
+
+def _item_2_dict(item: Item) -> dict:
+    business, amount = item
+    return {
+        'business_modelx_code': business,
+        'actually_paid': None if amount is None else str(amount)
+    }
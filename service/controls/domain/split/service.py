@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from werkzeug.exceptions import InternalServerError
 
 from common.util.log import get_logger
-import service.controls.domain.split.factory as factory
+from service.models import db_session
 from .aggr import BillPeriodAggr
-from .entity import OriginalBill, LedgerBill, SplitRule, BillPeriod
-from .val_obj import CompositeSplitPolicy, BillMatcher
+from .entity import LedgerBill, SplitRule, BillPeriod, BillRow
+from .val_obj import BillMatcher, CompositeSplitPolicy
+from .index import SplitRuleIndex
+from .preview import diff_ledger_bill_rows
+from .parallel import ParallelSplitConfig, split_original_bill_rows, split_original_bill_rows_in_parallel
 from .iface import IBillPeriodSplitService
 
 logger = get_logger('domain:split:service')
@@ -22,8 +27,25 @@ class BillPeriodSplitService(IBillPeriodSplitService):
     3. 所有原始账单都处理完成后，汇总所有的总账账单，一次性覆盖计费周期的总账账单
 
     """
+    # 并行分账配置，默认关闭，应用启动时按应用配置调用configure_parallel，参考init_app
+    parallel_config: ParallelSplitConfig = ParallelSplitConfig()
+
     @classmethod
-    def split_original_bills_of_bill_period(cls, bill_period_id: int):
+    def configure_parallel(cls, enabled: bool = True, workers: Optional[int] = None, chunk_size: int = 5000):
+        """ 配置并行分账
+
+        :param enabled: 是否开启并行分账
+        :param workers: 工作进程数，默认为CPU核数
+        :param chunk_size: 每个分片包含的原始账单数
+        """
+        cls.parallel_config = ParallelSplitConfig(enabled, workers, chunk_size)
+
+    @classmethod
+    def split_original_bills_of_bill_period(
+            cls, bill_period_id: int, progress: Optional[Callable[[int, int], None]] = None):
+        """
+        :param progress: 汇报分账进度，参数为(已分账的原始账单数, 原始账单总数)
+        """
         aggr = BillPeriodAggr.get_by_id(bill_period_id)
 
         if not aggr:
@@ -32,52 +54,193 @@ class BillPeriodSplitService(IBillPeriodSplitService):
 
         logger.info(f'start splitting original bills of bill period {aggr.bill_period.pretty_str}.')
 
-        ledger_bills = []
-        for original_bill in aggr.original_bills:
-            split_rule = cls.__select_split_rule(aggr.split_rules, original_bill)
-            if split_rule:
-                for ledger_bill in cls.__split_original_bill_by_split_rule(original_bill, split_rule):
-                    ledger_bills.append(ledger_bill)
-            else:
-                # 未与任何分账规则匹配，直接转为总账账单
-                ledger_bill = factory.build_ledger_bill_by_original_bill(original_bill)
-                ledger_bills.append(ledger_bill)
+        original_bill_rows = aggr.original_bill_rows
+        if progress is not None:
+            progress(0, len(original_bill_rows))
+
+        ledger_bill_rows = cls.__split_original_bill_rows(aggr, original_bill_rows, progress)
 
         logger.info(f'splitting original bills of bill period {aggr.bill_period.pretty_str} '
-                    f'into {len(ledger_bills)} ledger bills, will be set.')
+                    f'into {len(ledger_bill_rows)} ledger bills, will be set.')
 
-        cls.__overwrite_ledger_bills_of_bill_period(aggr, ledger_bills)
+        cls.__overwrite_ledger_bills_of_bill_period(aggr, ledger_bill_rows)
 
     @classmethod
-    def __select_split_rule(cls, split_rules: List[SplitRule], original_bill: OriginalBill) -> Optional[SplitRule]:
-        best_match: Optional[SplitRule] = None
-        best_match_score = 0
+    def preview_split_original_bills_of_bill_period(cls, bill_period_id: int) -> Iterator[dict]:
+        """ 预览分账，返回预览分账结果与现有总账账单的差异记录，参考diff_ledger_bill_rows
 
-        for split_rule in split_rules:
-            bill_matcher = BillMatcher.get_by_split_rule(split_rule)
+        只读：仅查询账单的列，不加载、不修改、不写入任何ORM对象，也不会触发会话的自动刷新
+        """
+        aggr = BillPeriodAggr.get_by_id(bill_period_id)
+
+        if not aggr:
+            BillPeriod.raise_not_found(id=bill_period_id)
+
+        with db_session.no_autoflush:
+            original_bill_rows = aggr.original_bill_rows
+            preview_ledger_bill_rows = cls.__split_original_bill_rows(aggr, original_bill_rows)
+            current_ledger_bill_rows = aggr.ledger_bill_rows
+
+        logger.info(f'preview splitting original bills of bill period {aggr.bill_period.pretty_str}, '
+                    f'{len(current_ledger_bill_rows)} ledger bills currently, '
+                    f'{len(preview_ledger_bill_rows)} ledger bills in preview.')
+
+        return diff_ledger_bill_rows([original_bill_id for original_bill_id, _ in original_bill_rows],
+                                     current_ledger_bill_rows, preview_ledger_bill_rows)
+
+    @classmethod
+    def split_original_bills_incrementally(cls, bill_period_id: int, original_bill_ids: List[int]):
+        """ 增量分账，仅对指定的原始账单重新分账，替换其总账账单
+
+        计费周期不存在、已锁定，或者还未进行过分账（不存在总账账单）时，不进行处理
+        """
+        aggr = cls.__get_aggr_to_split_incrementally(bill_period_id)
+        if not aggr:
+            return
+
+        original_bill_rows = aggr.get_original_bill_rows(original_bill_ids=original_bill_ids)
+        cls.__split_original_bill_rows_incrementally(aggr, original_bill_rows)
+
+    @classmethod
+    def split_original_bills_affected_by_split_rule(
+            cls, split_rule_id: int, previous_bill_matchers: Optional[dict] = None):
+        """ 增量分账，仅对最佳匹配的分账规则可能发生变化的原始账单重新分账
+
+        分账规则创建或更新后，只有与其新、旧匹配器之一匹配的原始账单，最佳匹配的分账规则或者分账结果才可能发生变化
+
+        :param split_rule_id: 创建或更新的分账规则ID
+        :param previous_bill_matchers: 分账规则更新前的匹配器，创建分账规则时为None
+        """
+        split_rule: SplitRule = SplitRule.query.filter_by(id=split_rule_id).first()
+        if not split_rule:
+            SplitRule.raise_not_found(id=split_rule_id)
+
+        aggr = cls.__get_aggr_to_split_incrementally(split_rule.bill_period_id)
+        if not aggr:
+            return
+
+        bill_matchers = [BillMatcher.get_by_split_rule(split_rule)]
+        if previous_bill_matchers is not None:
+            bill_matchers.append(BillMatcher.get_by_bill_matchers(previous_bill_matchers))
 
-            if bill_matcher and bill_matcher.is_match(original_bill):
-                match_score = bill_matcher.score
-                if match_score > best_match_score:
-                    best_match = split_rule
-                    best_match_score = match_score
+        attr_filters = [attr_filter
+                        for attr_filter in [cls.__to_attr_filter(bm) for bm in bill_matchers if bm]
+                        if attr_filter]
 
-        if best_match:
-            logger.info(f'original bill {original_bill.id} best match '
-                        f'split rule {best_match.id} with score: {best_match_score}')
+        original_bill_rows = aggr.get_original_bill_rows(attr_filters=attr_filters)
+        cls.__split_original_bill_rows_incrementally(aggr, original_bill_rows)
 
-        return best_match
+    @classmethod
+    def __get_aggr_to_split_incrementally(cls, bill_period_id: int) -> Optional[BillPeriodAggr]:
+        aggr = BillPeriodAggr.get_by_id(bill_period_id)
+
+        if not aggr:
+            logger.warn(f'bill period of id {bill_period_id} not found, incremental split skipped.')
+            return None
+
+        if aggr.is_locked:
+            logger.info(f'bill period {aggr.bill_period.pretty_str} is locked, incremental split skipped.')
+            return None
+
+        if not aggr.has_ledger_bills:
+            logger.info(f'bill period {aggr.bill_period.pretty_str} has not been split yet, incremental split skipped.')
+            return None
+
+        return aggr
 
     @classmethod
-    def __split_original_bill_by_split_rule(
-            cls, original_bill: OriginalBill, split_rule: SplitRule) -> List[LedgerBill]:
-        composite_split_policy: CompositeSplitPolicy = CompositeSplitPolicy.get_by_split_rule(split_rule)
-        ledger_bills = composite_split_policy.split(original_bill)
-        return ledger_bills
+    def __split_original_bill_rows_incrementally(
+            cls, aggr: BillPeriodAggr, original_bill_rows: List[Tuple[int, BillRow]]):
+        if not original_bill_rows:
+            return
+
+        ledger_bill_rows = cls.__split_original_bill_rows(aggr, original_bill_rows)
+
+        logger.info(f'splitting {len(original_bill_rows)} original bills of bill period '
+                    f'{aggr.bill_period.pretty_str} incrementally into {len(ledger_bill_rows)} ledger bills.')
+
+        aggr.replace_ledger_bill_rows_of_original_bills(
+            [original_bill_id for original_bill_id, _ in original_bill_rows], ledger_bill_rows)
+
+    @staticmethod
+    def __to_attr_filter(bill_matcher: BillMatcher) -> Optional[Dict[str, Any]]:
+        """ 将匹配器转为属性过滤条件，匹配器不可能匹配任何账单时返回None """
+        if bill_matcher.score <= 0:
+            # 分数为0的规则不会被选中
+            return None
+
+        attr_filter = {k: v for k, v in bill_matcher.asdict().items() if v is not None}
+        for v in attr_filter.values():
+            if not isinstance(v, (str, int, float)):
+                # 匹配值为列表等类型时，与账单属性永远不相等
+                return None
+
+        return attr_filter
+
+    @classmethod
+    def __split_original_bill_rows(
+            cls, aggr: BillPeriodAggr, original_bill_rows: List[Tuple[int, BillRow]],
+            progress: Optional[Callable[[int, int], None]] = None) -> List[BillRow]:
+        """ 使用计费周期的全部分账规则，对给定的原始账单行进行分账 """
+        split_rules = aggr.split_rules
+        split_rule_index = SplitRuleIndex.build(split_rules)
+
+        # 分账策略按分账规则解析一次，而不是每条原始账单解析一次
+        composite_split_policies = cls.__parse_composite_split_policies(split_rules)
+
+        if cls.parallel_config.enabled and len(original_bill_rows) > cls.parallel_config.chunk_size:
+            logger.info(f'splitting {len(original_bill_rows)} original bills in parallel, '
+                        f'workers: {cls.parallel_config.workers}, chunk size: {cls.parallel_config.chunk_size}.')
+            ledger_bill_rows, failed_position = split_original_bill_rows_in_parallel(
+                split_rule_index, composite_split_policies, original_bill_rows, cls.parallel_config, progress)
+        elif progress is not None:
+            ledger_bill_rows, failed_position = cls.__split_original_bill_rows_in_chunks(
+                split_rule_index, composite_split_policies, original_bill_rows, progress)
+        else:
+            ledger_bill_rows, failed_position = split_original_bill_rows(
+                split_rule_index, composite_split_policies, original_bill_rows)
+
+        if failed_position is not None:
+            # 重新解析以抛出与逐条分账时一致的异常
+            CompositeSplitPolicy.get_by_split_rule(split_rules[failed_position])
+
+        return ledger_bill_rows
+
+    @classmethod
+    def __split_original_bill_rows_in_chunks(
+            cls, split_rule_index: SplitRuleIndex,
+            composite_split_policies: List[Optional[CompositeSplitPolicy]],
+            original_bill_rows: List[Tuple[int, BillRow]],
+            progress: Callable[[int, int], None]) -> Tuple[List[BillRow], Optional[int]]:
+        """ 按分片依次分账，每个分片完成后汇报进度，结果与split_original_bill_rows一致 """
+        chunk_size = cls.parallel_config.chunk_size
+        ledger_bill_rows: List[BillRow] = []
+
+        for i in range(0, len(original_bill_rows), chunk_size):
+            chunk_ledger_bill_rows, failed_position = split_original_bill_rows(
+                split_rule_index, composite_split_policies, original_bill_rows[i:i + chunk_size])
+            ledger_bill_rows.extend(chunk_ledger_bill_rows)
+            if failed_position is not None:
+                return ledger_bill_rows, failed_position
+            progress(min(i + chunk_size, len(original_bill_rows)), len(original_bill_rows))
+
+        return ledger_bill_rows, None
+
+    @classmethod
+    def __parse_composite_split_policies(
+            cls, split_rules: List[SplitRule]) -> List[Optional[CompositeSplitPolicy]]:
+        """ 解析每条分账规则的分账策略，解析失败的分账策略为None，仅当被原始账单匹配到时才抛出异常 """
+        composite_split_policies = []
+        for split_rule in split_rules:
+            try:
+                composite_split_policies.append(CompositeSplitPolicy.get_by_split_rule(split_rule))
+            except InternalServerError:
+                composite_split_policies.append(None)
+        return composite_split_policies
 
     @classmethod
-    def __overwrite_ledger_bills_of_bill_period(cls, aggr: BillPeriodAggr, ledger_bills: List[LedgerBill]):
-        aggr.set_ledger_bills(ledger_bills)
+    def __overwrite_ledger_bills_of_bill_period(cls, aggr: BillPeriodAggr, ledger_bill_rows: List[BillRow]):
+        aggr.set_ledger_bill_rows(ledger_bill_rows)
 
 
 class LedgerBillSplitService:
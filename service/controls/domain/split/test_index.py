@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from .index import SplitRuleIndex
+from .val_obj import BillMatcher
+
+
+class TestSplitRuleIndex:
+    def test_match(self):
+        bill_matchers = [
+            BillMatcher(service_type='cdn'),
+            BillMatcher(service_type='cdn', service_name='static'),
+            BillMatcher(service_type='cdn', tag1='t1'),
+            BillMatcher(),
+        ]
+        index = SplitRuleIndex.build_by_bill_matchers(bill_matchers)
+
+        assert index.match(BillMatcher(service_type='cdn', service_name='static', tag1='t1')) == 1
+        assert index.match(BillMatcher(service_type='cdn', service_name='dynamic', tag1='t1')) == 2
+        assert index.match(BillMatcher(service_type='cdn')) == 0
+        assert index.match(BillMatcher(service_type='ecs')) is None
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import common.static as const
+import common.util.decimal as decimal
+from .index import SplitRuleIndex
+from .parallel import ParallelSplitConfig, split_original_bill_rows, split_original_bill_rows_in_parallel
+from .val_obj import BillMatcher, CompositeSplitPolicy, FixedValueSplitPolicy, ProportionalSplitPolicy
+from .entity import BILL_ROW_FIELDS, BillRow
+
+
+class TestParallelSplit:
+    def test_split_original_bill_rows_in_parallel(self):
+        empty_row = BillRow(*[None for _ in BILL_ROW_FIELDS])
+        original_bill_rows = [
+            (i, empty_row._replace(type=const.BILL_TYPE_ORIGINAL,
+                                   provider_name=f'p{i % 3}',
+                                   actually_paid=decimal.Decimal(1000 + i)))
+            for i in range(100)
+        ]
+
+        split_rule_index = SplitRuleIndex.build_by_bill_matchers([BillMatcher(provider_name='p1')])
+        composite_split_policies = [
+            CompositeSplitPolicy([FixedValueSplitPolicy('b1', decimal.Decimal('100'))],
+                                 [ProportionalSplitPolicy('b2', decimal.Decimal('0.2')),
+                                  ProportionalSplitPolicy('b3', decimal.Decimal('0.8'))])
+        ]
+
+        expected, _ = split_original_bill_rows(split_rule_index, composite_split_policies, original_bill_rows)
+        actual, failed_position = split_original_bill_rows_in_parallel(
+            split_rule_index, composite_split_policies, original_bill_rows, ParallelSplitConfig(True, 3, 7))
+
+        assert failed_position is None
+        assert actual == expected
+        assert all(row.type == const.BILL_TYPE_LEDGER for row in actual)
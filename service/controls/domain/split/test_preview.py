@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import common.static as const
+import common.util.decimal as decimal
+from .entity import BILL_ROW_FIELDS, BillRow
+from .preview import diff_ledger_bill_rows
+
+
+def ledger_bill_row(parent_id: int, business: str, actually_paid: str) -> BillRow:
+    empty_row = BillRow(*[None for _ in BILL_ROW_FIELDS])
+    return empty_row._replace(type=const.BILL_TYPE_LEDGER, parent_id=parent_id,
+                              business_modelx_code=business, actually_paid=decimal.Decimal(actually_paid))
+
+
+class TestDiffLedgerBillRows:
+    def test_diff(self):
+        current = [ledger_bill_row(1, 'b1', '100'), ledger_bill_row(2, 'b1', '50'), ledger_bill_row(2, 'b2', '50')]
+        preview = [ledger_bill_row(1, 'b1', '100'), ledger_bill_row(2, 'b1', '20'), ledger_bill_row(2, 'b2', '80')]
+
+        records = list(diff_ledger_bill_rows([1, 2], current, preview))
+
+        original_bill_records = [r for r in records if r['type'] == 'original_bill']
+        assert len(original_bill_records) == 1
+        assert original_bill_records[0]['original_bill_id'] == 2
+        assert original_bill_records[0]['amount_delta'] == '0.00'
+        assert len(original_bill_records[0]['added']) == 2
+        assert len(original_bill_records[0]['removed']) == 2
+
+        business_records = {r['business_modelx_code']: r for r in records if r['type'] == 'business'}
+        assert business_records['b1']['amount_delta'] == '-30.00'
+        assert business_records['b2']['amount_delta'] == '30.00'
+
+        assert records[-1]['type'] == 'summary'
+        assert records[-1]['changed_original_bill_cnt'] == 1
@@ -75,6 +75,51 @@ class TestBillPeriodSplitService:
         total = decimal.quantize(sum([ledger_bill.actually_paid for ledger_bill in aggr.ledger_bills]))
         assert total == aggr.original_bills[0].actually_paid
 
+    def test_split_original_bills_of_bill_period_twice(self, bill_period_aggr_with_original_bills_and_split_rules):
+        aggr = bill_period_aggr_with_original_bills_and_split_rules
+
+        BillPeriodSplitService.split_original_bills_of_bill_period(aggr.bill_period.id)
+        BillPeriodSplitService.split_original_bills_of_bill_period(aggr.bill_period.id)
+
+        assert len(aggr.ledger_bills) == 3
+
+        for ledger_bill in aggr.ledger_bills:
+            assert ledger_bill.type == const.BILL_TYPE_LEDGER
+            assert ledger_bill.parent_id == aggr.original_bills[0].id
+
+    def test_split_original_bills_incrementally(self, bill_period_aggr_with_original_bills_and_split_rules):
+        aggr = bill_period_aggr_with_original_bills_and_split_rules
+
+        BillPeriodSplitService.split_original_bills_of_bill_period(aggr.bill_period.id)
+
+        original_bill = aggr.original_bills[0]
+        original_bill.actually_paid = 2000000
+
+        BillPeriodSplitService.split_original_bills_incrementally(aggr.bill_period.id, [original_bill.id])
+
+        assert len(aggr.ledger_bills) == 3
+
+        total = decimal.quantize(sum([ledger_bill.actually_paid for ledger_bill in aggr.ledger_bills]))
+        assert total == decimal.quantize(2000000)
+
+    def test_split_original_bills_incrementally_of_missing_bill_period(self):
+        # 计费周期不存在时跳过，不抛出异常
+        BillPeriodSplitService.split_original_bills_incrementally(-1, [1])
+
+    def test_split_original_bills_affected_by_split_rule(self, bill_period_aggr_with_original_bills_and_split_rules):
+        aggr = bill_period_aggr_with_original_bills_and_split_rules
+
+        BillPeriodSplitService.split_original_bills_of_bill_period(aggr.bill_period.id)
+
+        split_rule = aggr.split_rules[0]
+        previous_bill_matchers = dict(split_rule.bill_matchers)
+        split_rule.bill_matchers = dict(provider_name='p2')
+
+        BillPeriodSplitService.split_original_bills_affected_by_split_rule(split_rule.id, previous_bill_matchers)
+
+        assert len(aggr.ledger_bills) == 1
+        assert aggr.ledger_bills[0].parent_id == aggr.original_bills[0].id
+
 
 @pytest.fixture
 def ledger_bill_on_bill_period(bill_period_aggr, ledger_bill):
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from .val_obj import CompositePolicy
+from .cache import split_rule_cache
+from .val_obj import BillMatcher, CompositePolicy, CompositeSplitPolicy
 
 
 class TestCompositePolicy:
@@ -33,3 +34,31 @@ class TestCompositePolicy:
         }
 
         CompositePolicy(**body)
+
+
+class TestCompositeSplitPolicy:
+    def test_get_by_split_rule_cached(self, split_rule):
+        composite_split_policy = CompositeSplitPolicy.get_by_split_rule(split_rule)
+        assert CompositeSplitPolicy.get_by_split_rule(split_rule) is composite_split_policy
+
+        split_rule_cache.invalidate(split_rule.id)
+        assert CompositeSplitPolicy.get_by_split_rule(split_rule) is not composite_split_policy
+
+    def test_split_reentrant(self, split_rule, original_bill_factory):
+        composite_split_policy = CompositeSplitPolicy.get_by_split_rule(split_rule)
+
+        first = composite_split_policy.split(original_bill_factory(provider_name='p1', actually_paid=1000000))
+        second = composite_split_policy.split(original_bill_factory(provider_name='p1', actually_paid=2000000))
+
+        assert len(first) == len(second) == 3
+        assert sum([ledger_bill.actually_paid for ledger_bill in first]) == 1000000
+        assert sum([ledger_bill.actually_paid for ledger_bill in second]) == 2000000
+
+
+class TestBillMatcher:
+    def test_get_by_split_rule_returns_copy(self, split_rule):
+        bill_matcher = BillMatcher.get_by_split_rule(split_rule)
+        provider_name = bill_matcher.provider_name
+
+        bill_matcher.provider_name = 'p_modified'
+        assert BillMatcher.get_by_split_rule(split_rule).provider_name == provider_name
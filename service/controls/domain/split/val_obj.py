@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import json
 from abc import ABCMeta, abstractmethod
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from ex_dataclass import ex_dataclass, field, EXpack
 from werkzeug.exceptions import InternalServerError
@@ -11,7 +12,8 @@ import common.static as const
 import common.util.decimal as decimal
 from common.util.log import get_logger
 from . import factory
-from .entity import SplitRule, OriginalBill, LedgerBill
+from .cache import split_rule_cache
+from .entity import SplitRule, OriginalBill, LedgerBill, BillRow
 
 logger = get_logger('domain:split:val_obj')
 
@@ -86,11 +88,22 @@ class BillMatcher(EXpack):
 
     @classmethod
     def get_by_split_rule(cls, split_rule: SplitRule) -> Optional["BillMatcher"]:
+        """ 获取分账规则的匹配器，解析结果按分账规则缓存
+
+        匹配器可被修改，返回缓存的匹配器的副本，调用方的修改不会影响缓存
+        """
+        bill_matcher = split_rule_cache.get_or_build(
+            'bill_matcher', split_rule, split_rule.bill_matchers,
+            lambda o: cls.get_by_bill_matchers(o.bill_matchers))
+        return copy.copy(bill_matcher) if bill_matcher is not None else None
+
+    @classmethod
+    def get_by_bill_matchers(cls, bill_matchers: dict) -> Optional["BillMatcher"]:
         bm: Optional[BillMatcher] = None
         try:
-            bm = BillMatcher(**split_rule.bill_matchers)
+            bm = BillMatcher(**bill_matchers)
         except Exception as e:
-            logger.error(f'build BillMatcher failed, bill_matchers: {json.dumps(split_rule.bill_matchers)}', exc=e)
+            logger.error(f'build BillMatcher failed, bill_matchers: {json.dumps(bill_matchers)}', exc=e)
         return bm
 
     def is_match(self, original_bill: OriginalBill) -> bool:
@@ -114,64 +127,93 @@ class BillMatcher(EXpack):
 
 class ISplitPolicy(metaclass=ABCMeta):
     @abstractmethod
-    def split(self, original_bill: OriginalBill) -> LedgerBill:
+    def split(self, original_bill: OriginalBill) -> List[LedgerBill]:
+        raise NotImplementedError
+
+
+class ISubSplitPolicy(metaclass=ABCMeta):
+    """ 子分账策略，决定一条总账账单的业务及其实付金额 """
+    @property
+    @abstractmethod
+    def business_modelx_code(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_actually_paid(self, proportional_value_total: decimal.Decimal) -> decimal.Decimal:
+        """ 计算该子分账策略分得的实付金额
+
+        :param proportional_value_total: 原始账单实付金额扣除所有固定值后，剩余的按比例分摊的金额
+        """
         raise NotImplementedError
 
 
-class ProportionalSplitPolicy(ISplitPolicy):
+class ProportionalSplitPolicy(ISubSplitPolicy):
     def __init__(self, business_modelx_code: str, percent: decimal.Decimal):
-        self.business_modelx_code = business_modelx_code
-        self.percent = percent
-        self.base = None
+        self.__business_modelx_code = business_modelx_code
+        self.__percent = percent
+
+    @property
+    def business_modelx_code(self) -> str:
+        return self.__business_modelx_code
 
-    def split(self, original_bill: OriginalBill) -> LedgerBill:
-        ledger_bill = factory.build_ledger_bill_by_original_bill(original_bill)
-        ledger_bill.business_modelx_code = self.business_modelx_code
-        ledger_bill.actually_paid = self.base * self.percent
-        return ledger_bill
+    @property
+    def percent(self) -> decimal.Decimal:
+        return self.__percent
 
-    def set_base(self, base: decimal.Decimal):
-        self.base = base
+    def get_actually_paid(self, proportional_value_total: decimal.Decimal) -> decimal.Decimal:
+        return proportional_value_total * self.__percent
 
 
-class FixedValueSplitPolicy(ISplitPolicy):
+class FixedValueSplitPolicy(ISubSplitPolicy):
     def __init__(self, business_modelx_code: str, value: decimal.Decimal):
-        self.business_modelx_code = business_modelx_code
-        self.value = value
+        self.__business_modelx_code = business_modelx_code
+        self.__value = value
+
+    @property
+    def business_modelx_code(self) -> str:
+        return self.__business_modelx_code
 
-    def split(self, original_bill: OriginalBill) -> LedgerBill:
-        ledger_bill = factory.build_ledger_bill_by_original_bill(original_bill)
-        ledger_bill.business_modelx_code = self.business_modelx_code
-        ledger_bill.actually_paid = self.value
-        return ledger_bill
+    @property
+    def value(self) -> decimal.Decimal:
+        return self.__value
+
+    def get_actually_paid(self, proportional_value_total: decimal.Decimal) -> decimal.Decimal:
+        return self.__value
 
 
 class CompositeSplitPolicy(ISplitPolicy):
+    """ 组合分账策略
+
+    创建后不可修改，分账过程中不保存任何状态，同一实例可被多次、并发地用于分账，
+    因此可以按分账规则缓存，参考split_rule_cache
+    """
     def __init__(self,
                  fixed_value_policies: List[FixedValueSplitPolicy],
                  proportional_policies: List[ProportionalSplitPolicy]):
-        self.__fixed_value_policies = fixed_value_policies
-        self.__proportional_policies = proportional_policies
-
-        self.__fixed_value_total: decimal.Decimal = sum([p.value for p in fixed_value_policies])
+        self.__fixed_value_policies: Tuple[FixedValueSplitPolicy, ...] = tuple(fixed_value_policies)
+        self.__proportional_policies: Tuple[ProportionalSplitPolicy, ...] = tuple(proportional_policies)
 
-        # will be set when split start
-        self.__original_bill: Optional[OriginalBill] = None
+        # 先按固定值分账，再按比例分账
+        self.__policies: Tuple[ISubSplitPolicy, ...] = self.__fixed_value_policies + self.__proportional_policies
 
-        # will be set empty when split start
-        # ledger bill will be appended while splitting
-        self.__ledger_bills: List[LedgerBill] = []
+        self.__fixed_value_total: decimal.Decimal = sum([p.value for p in fixed_value_policies])
 
     @property
-    def fixed_value_policies(self):
+    def fixed_value_policies(self) -> Tuple[FixedValueSplitPolicy, ...]:
         return self.__fixed_value_policies
 
     @property
-    def proportional_policies(self):
+    def proportional_policies(self) -> Tuple[ProportionalSplitPolicy, ...]:
         return self.__proportional_policies
 
     @classmethod
     def get_by_split_rule(cls, split_rule: SplitRule) -> "CompositeSplitPolicy":
+        """ 获取分账规则的分账策略，解析结果按分账规则缓存 """
+        return split_rule_cache.get_or_build(
+            'composite_split_policy', split_rule, split_rule.split_policy, cls.parse_split_rule)
+
+    @classmethod
+    def parse_split_rule(cls, split_rule: SplitRule) -> "CompositeSplitPolicy":
         split_policy = split_rule.split_policy
 
         try:
@@ -192,29 +234,27 @@ class CompositeSplitPolicy(ISplitPolicy):
         return cls(fixed_policies, prop_policies)
 
     def split(self, original_bill: OriginalBill) -> List[LedgerBill]:
-        self.__pre_split(original_bill)
-        self.__split_by_fixed_value_policies()
-        self.__split_by_proportional_policies()
-        return self.__ledger_bills
-
-    def __pre_split(self, original_bill: OriginalBill):
-        self.__original_bill = original_bill
-        self.__ledger_bills = []
-
         # proportional_value_total = original_bill.actually_paid - self.__fixed_value_total
         # 不知为何，测试用例执行时，访问actually_paid得到的不是Decimal，而是float；
         # 实际运行没问题。
         proportional_value_total = decimal.Decimal(original_bill.actually_paid) - self.__fixed_value_total
 
-        for p in self.__proportional_policies:
-            p.set_base(proportional_value_total)
+        ledger_bills = []
+
+        for p in self.__policies:
+            ledger_bill = factory.build_ledger_bill_by_original_bill(original_bill)
+            ledger_bill.business_modelx_code = p.business_modelx_code
+            ledger_bill.actually_paid = p.get_actually_paid(proportional_value_total)
+            ledger_bills.append(ledger_bill)
+
+        return ledger_bills
 
-    def __split_by_fixed_value_policies(self):
-        for p in self.__fixed_value_policies:
-            ledger_bill = p.split(self.__original_bill)
-            self.__ledger_bills.append(ledger_bill)
+    def split_bill_row(self, bill_row: BillRow) -> List[BillRow]:
+        """ 与split的分账结果一致，但输入输出均为账单行，不创建ORM对象 """
+        proportional_value_total = decimal.Decimal(bill_row.actually_paid) - self.__fixed_value_total
 
-    def __split_by_proportional_policies(self):
-        for p in self.__proportional_policies:
-            ledger_bill = p.split(self.__original_bill)
-            self.__ledger_bills.append(ledger_bill)
+        return [
+            bill_row._replace(business_modelx_code=p.business_modelx_code,
+                              actually_paid=p.get_actually_paid(proportional_value_total))
+            for p in self.__policies
+        ]
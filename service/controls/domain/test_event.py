@@ -2,6 +2,8 @@
 
 import pytest
 from .bill.aggr import BillPeriodAggr
+from .bill.event import OriginalBillCreated
+from .uow import unit_of_work
 
 
 class TestEvent:
@@ -55,3 +57,16 @@ class TestEvent:
         ledger_bill.provider = 'p1'
         aggr.update_ledger_bill(ledger_bill)
         assert ledger_bill.exception is None
+
+    def test_event_carries_entities(self, bill_period_aggr, original_bill):
+        aggr: BillPeriodAggr = bill_period_aggr
+        e = OriginalBillCreated(original_bill.id, original_bill, aggr.bill_period.id)
+
+        # 发出事件时携带的实体直接使用，不再查询
+        assert e.bill_period_id == aggr.bill_period.id
+        assert e.original_bill is original_bill
+
+        # 同一次分发内聚合根只加载一次
+        with unit_of_work.scope():
+            assert e.aggr is e.aggr
+        assert e.aggr is not e.aggr
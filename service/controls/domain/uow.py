@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable
+
+__all__ = [
+    "UnitOfWorkCache",
+    "unit_of_work"
+]
+
+
+class UnitOfWorkCache:
+    """ 单次事件分发内的实体缓存
+
+    1. 事件处理函数多次访问事件的聚合根等实体时只加载一次
+    2. 缓存只在同一线程的同一次分发内有效，分发期间同步发出的事件共用外层分发的缓存
+    3. 最外层的分发结束后清空，实体不会跨会话复用
+    4. 不在分发内时不缓存
+
+    """
+    def __init__(self):
+        self.__local = threading.local()
+
+    @contextmanager
+    def scope(self):
+        depth = getattr(self.__local, 'depth', 0)
+        if depth == 0:
+            self.__local.entries = dict()
+
+        self.__local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.__local.depth = depth
+            if depth == 0:
+                self.__local.entries = None
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """ 获取缓存的实体，未命中时加载并缓存，加载函数抛出异常时不缓存 """
+        entries = getattr(self.__local, 'entries', None)
+        if entries is None:
+            return load()
+
+        if key not in entries:
+            entries[key] = load()
+        return entries[key]
+
+
+unit_of_work = UnitOfWorkCache()
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from .entity import User
 from .exception import *
+from .service import UserPrincipalService
+from .val_obj import UserPrincipal
 
 
 class UserAggr:
-    def __init__(self, user: User):
+    def __init__(self, user: Union[User, UserPrincipal]):
+        """
+        :param user: 用户或已解析的用户身份，权限校验只读取两者共有的属性
+        """
         self.__user = user
 
     @property
@@ -34,6 +39,23 @@ class UserAggr:
         else:
             return None
 
+    @classmethod
+    def get_by_uc_user_id(cls, uc_user_id: int) -> Optional["UserAggr"]:
+        """ 通过用户中心的用户ID获取，使用缓存的用户身份 """
+        principal = UserPrincipalService.get_principal(uc_user_id)
+        if principal:
+            return cls(principal)
+        else:
+            return None
+
+    @classmethod
+    def get_by_uc_user_id_or_401(cls, uc_user_id: int) -> "UserAggr":
+        aggr = cls.get_by_uc_user_id(uc_user_id)
+        if aggr:
+            return aggr
+        else:
+            cls.raise_401()
+
     @classmethod
     def get_by_email_or_404(cls, email: str) -> "UserAggr":
         aggr = cls.get_by_email(email)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from common.util.log import get_logger
+from .entity import User
+from .val_obj import UserPrincipal
+
+logger = get_logger('domain:user:cache')
+
+__all__ = [
+    "UserPrincipalCache",
+    "user_principal_cache"
+]
+
+
+class UserPrincipalCache:
+    """ 用户身份缓存，键为用户中心的用户ID
+
+    1. 同一请求内只解析一次，结果记录在请求上下文中，请求内多次权限校验看到的身份一致
+    2. 跨请求按ttl（秒）缓存，未注册的用户同样缓存，避免反复访问用户中心
+    3. 用户创建、修改（如UserCtl.patch）、删除时全部失效，事务提交或回滚时再次失效；
+       每次失效时版本号加一，解析期间发生失效时，解析结果不会被缓存
+    4. 多进程部署时，其他进程修改用户无法通知到本进程，最长在ttl后生效
+    """
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__version = 0
+        # 用户中心的用户ID --> (解析时间, 用户身份)
+        self.__principals: Dict[int, Tuple[float, Optional[UserPrincipal]]] = dict()
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+    def get_or_build(self, uc_user_id: int,
+                     build: Callable[[int], Optional[UserPrincipal]]) -> Optional[UserPrincipal]:
+        """ 获取用户身份，未缓存或已过期时解析并缓存
+
+        :param build: 解析函数，用户未注册时返回None，抛出异常时不缓存
+        """
+        memo = self.__get_request_memo()
+        if memo is not None and memo[0] == self.__version and uc_user_id in memo[1]:
+            return memo[1][uc_user_id]
+
+        with self.__lock:
+            version, cached = self.__version, self.__principals.get(uc_user_id)
+
+        if cached is not None and time.monotonic() - cached[0] <= self.ttl:
+            principal = cached[1]
+        else:
+            principal = build(uc_user_id)
+            with self.__lock:
+                if self.__version == version:
+                    self.__principals[uc_user_id] = (time.monotonic(), principal)
+
+        if memo is not None:
+            if memo[0] != version:
+                memo[:] = [version, dict()]
+            memo[1][uc_user_id] = principal
+        return principal
+
+    def invalidate(self):
+        with self.__lock:
+            self.__version += 1
+            self.__principals.clear()
+
+        logger.debug(f'user principals invalidated, version: {self.__version}.')
+
+    @staticmethod
+    def __get_request_memo() -> Optional[list]:
+        """ 请求上下文中的[版本号, 用户中心的用户ID --> 用户身份]，不在应用上下文中时返回None """
+        if not has_app_context():
+            return None
+        if not hasattr(g, _REQUEST_MEMO):
+            setattr(g, _REQUEST_MEMO, [None, dict()])
+        return getattr(g, _REQUEST_MEMO)
+
+
+user_principal_cache = UserPrincipalCache()
+
+
+_REQUEST_MEMO = 'user_principals'
+
+# 通过会话的info记录事务内是否修改过用户
+_USER_CHANGED = 'user_changed'
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _on_user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_USER_CHANGED] = True
+    user_principal_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _on_transaction_end(session):
+    if session.info.pop(_USER_CHANGED, False):
+        user_principal_cache.invalidate()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from typing import Optional
+
+from .cache import user_principal_cache
+from .entity import User
+from .uc import IUcClient, UnconfiguredUcClient
+from .val_obj import UserPrincipal
+
+__all__ = [
+    "UserPrincipalService"
+]
+
+
+class UserPrincipalService:
+    """ 解析用户身份：用户中心的用户ID --> 邮箱 --> 本系统的用户
+
+    解析结果经user_principal_cache缓存，命中时不访问用户中心与数据库；
+    uc_client须由接入用户中心的应用层在启动时设置，未设置时访问用户中心抛出异常
+    """
+    uc_client: IUcClient = UnconfiguredUcClient()
+
+    @classmethod
+    def get_principal(cls, uc_user_id: int) -> Optional[UserPrincipal]:
+        """ 获取用户身份，用户中心或本系统中不存在该用户时返回None """
+        return user_principal_cache.get_or_build(uc_user_id, cls.__build)
+
+    @classmethod
+    def __build(cls, uc_user_id: int) -> Optional[UserPrincipal]:
+        uc_user = cls.uc_client.get_user(uc_user_id)
+        if not uc_user:
+            return None
+
+        user = User.query.filter_by(email=uc_user.email).first()
+        if not user:
+            return None
+
+        return UserPrincipal.from_user(uc_user_id, user)
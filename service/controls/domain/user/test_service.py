@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from typing import List
+
+import pytest
+from werkzeug.exceptions import InternalServerError
+
+import common.static as const
+from .entity import User
+from .service import UserPrincipalService
+from .uc import LocalUcClient, UnconfiguredUcClient
+
+
+@pytest.fixture
+def uc_calls(monkeypatch) -> List[int]:
+    """ 注入本地的用户中心替身，返回访问用户中心的用户ID列表 """
+    uc_client = LocalUcClient({1: 'user1@test.com'})
+    uc_calls = []
+    get_user = uc_client.get_user
+
+    def wrapped(uc_user_id: int):
+        uc_calls.append(uc_user_id)
+        return get_user(uc_user_id)
+
+    monkeypatch.setattr(uc_client, 'get_user', wrapped)
+    monkeypatch.setattr(UserPrincipalService, 'uc_client', uc_client)
+    return uc_calls
+
+
+@pytest.fixture
+def user():
+    user = User.create(email='user1@test.com', is_admin=False,
+                       role=const.USER_ROLE_BUSINESS, business_ids=[1, 2])
+    yield user
+    user.delete()
+
+
+class TestUserPrincipalService:
+    def test_get_principal(self, uc_calls, user):
+        principal = UserPrincipalService.get_principal(1)
+
+        assert principal.is_business
+        assert principal.business_ids == frozenset([1, 2])
+        assert principal.has_permission_of_all_given_business_ids([1])
+        assert not principal.has_permission_of_all_given_business_ids([1, 3])
+
+        # 再次获取时命中缓存，不访问用户中心
+        assert UserPrincipalService.get_principal(1) is principal
+        assert uc_calls == [1]
+
+        # 用户中心中不存在的用户
+        assert UserPrincipalService.get_principal(2) is None
+
+    def test_get_principal_after_user_patched(self, uc_calls, user):
+        assert UserPrincipalService.get_principal(1).is_business
+
+        user.patch(role=const.USER_ROLE_COMMERCIAL)
+
+        assert UserPrincipalService.get_principal(1).is_commercial
+        assert uc_calls == [1, 1]
+
+    def test_get_principal_without_uc_client(self, monkeypatch):
+        monkeypatch.setattr(UserPrincipalService, 'uc_client', UnconfiguredUcClient())
+
+        with pytest.raises(InternalServerError):
+            UserPrincipalService.get_principal(3)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from abc import ABCMeta, abstractmethod
+from typing import Dict, NamedTuple, Optional
+
+from werkzeug.exceptions import InternalServerError
+
+__all__ = [
+    "IUcClient",
+    "UnconfiguredUcClient",
+    "LocalUcUser",
+    "LocalUcClient"
+]
+
+
+class IUcClient(metaclass=ABCMeta):
+    """ 用户中心客户端，只依赖用户中心的用户ID与邮箱 """
+    @abstractmethod
+    def get_user(self, uc_user_id: int) -> Optional[object]:
+        """ 获取用户中心的用户，用户不存在时返回None，返回的用户须包含email属性 """
+        raise NotImplementedError
+
+
+class UnconfiguredUcClient(IUcClient):
+    """ 未配置的用户中心客户端，访问时抛出异常，避免未接入用户中心时所有用户均被解析为不存在 """
+    def get_user(self, uc_user_id: int) -> Optional[object]:
+        raise InternalServerError('未配置用户中心客户端，请在应用启动时设置UserPrincipalService.uc_client')
+
+
+class LocalUcUser(NamedTuple):
+    id: int
+    email: str
+
+
+class LocalUcClient(IUcClient):
+    """ 本地的用户中心替身，用于测试，不访问用户中心 """
+    def __init__(self, emails: Optional[Dict[int, str]] = None):
+        """
+        :param emails: 用户中心的用户ID --> 邮箱
+        """
+        self.emails: Dict[int, str] = dict(emails or {})
+
+    def get_user(self, uc_user_id: int) -> Optional[LocalUcUser]:
+        email = self.emails.get(uc_user_id)
+        return LocalUcUser(uc_user_id, email) if email else None
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from typing import FrozenSet, Iterable, NamedTuple, Optional
+
+import common.static as const
+from .entity import User
+
+__all__ = [
+    "UserPrincipal"
+]
+
+
+class UserPrincipal(NamedTuple):
+    """ 已解析的用户身份，用于权限校验，不可修改，可在请求间缓存 """
+    uc_user_id: int
+    email: str
+    is_admin: bool
+    role: Optional[str]
+    business_ids: FrozenSet[int]
+
+    @classmethod
+    def from_user(cls, uc_user_id: int, user: User) -> "UserPrincipal":
+        return cls(
+            uc_user_id=uc_user_id,
+            email=user.email,
+            is_admin=bool(user.is_admin),
+            role=user.role,
+            business_ids=frozenset(user.business_ids or []))
+
+    @property
+    def is_commercial(self) -> bool:
+        return self.role == const.USER_ROLE_COMMERCIAL
+
+    @property
+    def is_financial(self) -> bool:
+        return self.role == const.USER_ROLE_FINANCIAL
+
+    @property
+    def is_business(self) -> bool:
+        return self.role == const.USER_ROLE_BUSINESS
+
+    def has_permission_of_all_given_business_ids(self, business_ids: Iterable[int]) -> bool:
+        return self.business_ids.issuperset(business_ids)
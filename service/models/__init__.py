@@ -2,10 +2,12 @@
 
 from .base import db, db_session
 from .bill_period import BillPeriod
-from .bill import Bill
+from .bill import Bill, BillRow, BILL_ROW_FIELDS
 from .meta import Meta
 from .split_rule import SplitRule
+from .report_snapshot import ReportSnapshot
 from .user import User
+from .job import Job
 
 ReportBill = OriginalBill = LedgerBill = Bill
 Provider = Business = BillSubject = Meta
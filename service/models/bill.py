@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
+from typing import Tuple
+
 from sqlalchemy import ForeignKey, func
 from *****_service.model.fields import DB_INDEX_MAX_SIZE
 from .base import db, ModelBase
@@ -58,3 +61,13 @@ class Bill(ModelBase):
         if is_exception == 'true':
             query = query.filter(Bill.exception.isnot(None))
         return query
+
+
+# 账单行包含账单表中除主键、时间戳、软删除标记以外的所有列
+BILL_ROW_FIELDS: Tuple[str, ...] = tuple(
+    col.name for col in Bill.__table__.columns
+    if col.name not in ['id', 'create_time', 'update_time', 'deleted_at']
+)
+
+# 账单行，不受ORM会话管理的账单数据，用于批量生成、校验、写入账单，属性名与账单模型一致
+BillRow = namedtuple('BillRow', BILL_ROW_FIELDS)
@@ -5,6 +5,7 @@ from sqlalchemy.orm import RelationshipProperty
 
 import common.static as const
 from .base import db, ModelBase
+from .bill import Bill
 
 
 class BillPeriod(ModelBase):
@@ -36,13 +37,17 @@ class BillPeriod(ModelBase):
         return f'{self.year}-{self.month}'
 
     @property
-    def abnormal_original_bill_cnt(self):
-        return len([original_bill
-                    for original_bill in self.original_bills
-                    if original_bill.exception is not None])
+    def abnormal_original_bill_cnt(self) -> int:
+        return self.__count_bills(const.BILL_TYPE_ORIGINAL, Bill.exception.isnot(None))
 
     @property
-    def abnormal_ledger_bill_cnt(self):
-        return len([ledger_bill
-                    for ledger_bill in self.ledger_bills
-                    if ledger_bill.exception is not None])
+    def abnormal_ledger_bill_cnt(self) -> int:
+        return self.__count_bills(const.BILL_TYPE_LEDGER, Bill.exception.isnot(None))
+
+    @property
+    def ledger_bill_cnt(self) -> int:
+        return self.__count_bills(const.BILL_TYPE_LEDGER)
+
+    def __count_bills(self, bill_type: int, *criteria) -> int:
+        """ 由数据库计数，不加载账单 """
+        return self.bills.filter(Bill.type == bill_type, *criteria).with_entities(func.count(Bill.id)).scalar()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import func
+from *****_service.model.fields import DB_INDEX_MAX_SIZE, JSONEncodedDict
+from .base import db, ModelBase
+
+
+class Job(ModelBase):
+    """ 后台任务，如分账、导入导出，由任务执行器的工作线程执行，参考JobRunner """
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    create_time = db.Column(db.TIMESTAMP, index=True, server_default=func.now())
+    update_time = db.Column(db.TIMESTAMP, index=True, server_default=func.now(), onupdate=func.now())
+
+    kind = db.Column(db.String(DB_INDEX_MAX_SIZE), index=True, comment='任务类型')
+    bill_period_id = db.Column(db.Integer, index=True, comment='所属计费周期ID')
+    params = db.Column(JSONEncodedDict(4096), comment='任务参数')
+
+    state = db.Column(db.String(16), index=True, default='pending',
+                      comment='执行状态，pending/running/succeeded/failed/cancelled')
+    processed = db.Column(db.Integer, default=0, comment='已处理的条目数')
+    total = db.Column(db.Integer, nullable=True, comment='条目总数，未知时为空')
+    cancel_requested = db.Column(db.Boolean, default=False, comment='是否已请求取消')
+
+    result = db.Column(JSONEncodedDict(4096), nullable=True, comment='执行结果，如导出文件的路径')
+    error = db.Column(db.Text, nullable=True, comment='失败原因')
+    worker = db.Column(db.String(DB_INDEX_MAX_SIZE), nullable=True, comment='执行任务的主机与进程')
+
+    start_time = db.Column(db.TIMESTAMP, nullable=True, comment='开始执行的时间')
+    heartbeat_time = db.Column(db.TIMESTAMP, nullable=True, index=True,
+                               comment='执行中的任务最近一次心跳的时间，超时未更新时视为执行任务的进程已退出')
+    finish_time = db.Column(db.TIMESTAMP, nullable=True, comment='执行结束的时间')
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import ForeignKey, func
+from *****_service.model.fields import DB_INDEX_MAX_SIZE
+from .base import db, ModelBase
+
+
+class ReportSnapshot(ModelBase):
+    """ 报表快照，计费周期锁定时生成，解锁时失效
+
+    每条记录为计费周期内(服务类型, 业务, 一级类型)相同的总账账单的统计单元
+    """
+    __tablename__ = 'report_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    create_time = db.Column(db.TIMESTAMP, index=True, server_default=func.now())
+    update_time = db.Column(db.TIMESTAMP, index=True, server_default=func.now(), onupdate=func.now())
+
+    bill_period_id = db.Column(db.Integer, ForeignKey('bill_period.id'), index=True, comment='所属计费周期ID')
+
+    service_type = db.Column(db.String(DB_INDEX_MAX_SIZE), comment='服务类型')
+    business_modelx_code = db.Column(db.String(DB_INDEX_MAX_SIZE), index=True, comment='业务在ModelX的code')
+    type_level_1 = db.Column(db.String(DB_INDEX_MAX_SIZE), comment='一级类型')
+
+    bill_cnt = db.Column(db.Integer, comment='总账账单数')
+    actually_paid = db.Column(db.DECIMAL(precision=20, scale=2), nullable=True, comment='实付金额合计')
+    first_bill_id = db.Column(db.Integer, comment='统计单元内第一条总账账单的ID，用于保持统计单元的顺序')
@@ -7,6 +7,7 @@ from .split_rule import api as split_rule_api
 from .original_bill import api as original_bill_api
 from .ledger_bill import api as ledger_bill_api
 from .report import api as report_api
+from .job import api as job_api
 
 __all__ = [
     "apis"
@@ -20,5 +21,6 @@ apis = [
     split_rule_api,
     original_bill_api,
     ledger_bill_api,
-    report_api
+    report_api,
+    job_api
 ]
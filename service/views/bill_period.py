@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import io
-from flask import send_file
+from flask import send_file, Response, stream_with_context
 from flask_restplus import Namespace
 from *****_service.web.static import HTTP_OK
 from *****_service.web.view_models import *
@@ -26,6 +26,9 @@ class VM:
         ['is_lock', '是否锁定', bool, False],
         _location='form')
     patch = post
+    export = make_params(
+        ['format', '文件格式，xlsx或csv，默认xlsx；数据量大时建议使用csv，查询完成前即开始输出', str, False],
+        _location='args')
 
 
 @route_set(api, '/')
@@ -59,10 +62,12 @@ class BillPeriodRes(ImportMixin, ExportMixin, AdvModelResource, ResourceSet):
     @wrap_assure_is_admin_or_is_commercial
     def get_one(self, id_):
         obj_ctl = self.control.get_or_404(id_)
-        extend_fields = self.extend_fields or []
-        extend_fields.append('abnormal_original_bill_cnt')
-        extend_fields.append('abnormal_ledger_bill_cnt')
-        return obj_ctl.to_dict(extends=extend_fields, excludes=self.exclude_fields)
+        res = obj_ctl.to_dict(extends=self.extend_fields, excludes=self.exclude_fields)
+        # 各类型的账单数、异常账单数及实付金额合计，由一次分组统计得到
+        statistics = self.control.get_statistics([id_])[0].to_dict()
+        statistics.pop('bill_period_id')
+        res.update(statistics)
+        return res
 
     @login_check
     @wrap_assure_is_admin_or_is_commercial
@@ -118,23 +123,30 @@ class BillPeriodRes(ImportMixin, ExportMixin, AdvModelResource, ResourceSet):
         return HTTP_OK
 
     @login_check
-    @api.response(200, HTTP_OK)
+    @api.response(200, 'Success')
     @route('/<int:id_>/split/', method='POST')
     @wrap_assure_is_admin_or_is_commercial
     @wrap_log(resource_type=__res_type)
     def split(self, id_):
-        self.control.split(id_)
-        return HTTP_OK
+        # 分账、导入均提交为后台任务，返回任务，可通过/jobs/<id_>/查询进度
+        return self.control.submit_split(id_)
 
     @login_check
-    @api.response(200, HTTP_OK)
+    @api.response(200, 'Success')
+    @route('/<int:id_>/split_preview/', method='POST')
+    @wrap_assure_is_admin_or_is_commercial
+    def split_preview(self, id_):
+        lines = self.control.preview_split(id_)
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    @login_check
+    @api.response(200, 'Success')
     @route('/<int:id_>/import_original_bills/', method='POST')
     @wrap_assure_is_admin_or_is_commercial
     @wrap_log(resource_type=__res_type)
     def import_original_bills(self, id_):
         storage_obj: IO = self._decode_file_or_raise_2()
-        self.control.import_original_bills_from_storage_obj(storage_obj, id_)
-        return HTTP_OK
+        return self.control.submit_import_original_bills(storage_obj, id_)
 
     @login_check
     @api.response(200, HTTP_OK)
@@ -147,20 +159,37 @@ class BillPeriodRes(ImportMixin, ExportMixin, AdvModelResource, ResourceSet):
         return HTTP_OK
 
     @login_check
+    @api.expect(VM.export)
     @api.response(200, HTTP_OK)
     @route('/<int:id_>/export_original_bills/', method='GET')
     @wrap_assure_is_admin_or_is_commercial
     def export_original_bills(self, id_):
-        storage_obj: IO = self.control.export_original_bills(id_)
-        return self._send_file(storage_obj.name)
+        file_format = request.args.get('format', self.control.FILE_FORMAT_XLSX)
+        return self._send_stream(*self.control.stream_original_bills(id_, file_format))
 
     @login_check
+    @api.expect(VM.export)
     @api.response(200, HTTP_OK)
     @route('/<int:id_>/export_ledger_bills/', method='GET')
     @wrap_assure_is_admin_or_is_commercial
     def export_ledger_bills(self, id_):
-        storage_obj: IO = self.control.export_ledger_bills(id_)
-        return self._send_file(storage_obj.name)
+        file_format = request.args.get('format', self.control.FILE_FORMAT_XLSX)
+        return self._send_stream(*self.control.stream_ledger_bills(id_, file_format))
+
+    @login_check
+    @api.response(200, 'Success')
+    @route('/<int:id_>/export_original_bills/job/', method='POST')
+    @wrap_assure_is_admin_or_is_commercial
+    def submit_export_original_bills(self, id_):
+        # 导出为文件的后台任务，任务完成后通过/jobs/<id_>/file/下载
+        return self.control.submit_export_original_bills(id_)
+
+    @login_check
+    @api.response(200, 'Success')
+    @route('/<int:id_>/export_ledger_bills/job/', method='POST')
+    @wrap_assure_is_admin_or_is_commercial
+    def submit_export_ledger_bills(self, id_):
+        return self.control.submit_export_ledger_bills(id_)
 
     @login_check
     @api.response(200, HTTP_OK)
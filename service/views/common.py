@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import io
-from typing import IO
+import mimetypes
+from typing import IO, Iterator
+from urllib.parse import quote
 
 from werkzeug.exceptions import BadRequest
-from flask import send_file
+from flask import send_file, Response, stream_with_context
 from *****_service.web.view_models import *
 from werkzeug.datastructures import FileStorage
 
@@ -48,3 +50,10 @@ class ExportMixin:
     @staticmethod
     def _send_file(fp: str):
         return send_file(fp)
+
+    @staticmethod
+    def _send_stream(file_name: str, chunks: Iterator[bytes]):
+        """ 将逐块生成的文件内容直接写入响应，生成期间保持请求上下文（如数据库会话） """
+        mimetype = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(file_name)}"}
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from typing import IO
+
+from flask_restplus import Namespace
+from *****_service.web.static import HTTP_OK
+from *****_service.web.view_models import *
+from *****_service.web.views import AdvModelResource, ResourceSet, route, route_set
+
+from common.util.auth import login_check
+from service.controls.apps.job import JobApp
+from service.models.bill_period import BillPeriod
+from service.controls.apps.user import wrap_assure_is_admin_or_is_commercial
+from .common import ExportMixin
+
+
+api = Namespace('jobs')
+
+
+class VM:
+    get = make_params(
+        ['bill_period_id', '计费周期ID，仅获取指定计费周期的任务', int, False],
+        _location='args')
+
+
+@route_set(api, '/')
+class JobRes(ExportMixin, AdvModelResource, ResourceSet):
+    app = JobApp
+    model = BillPeriod
+
+    @login_check
+    @wrap_assure_is_admin_or_is_commercial
+    @api.expect(VM.get)
+    def get(self):
+        bill_period_id = request.args.get('bill_period_id', type=int)
+        return self.app.get_jobs(bill_period_id)
+
+    @login_check
+    @api.response(200, 'Success')
+    @route('/<int:id_>/', method='GET')
+    @wrap_assure_is_admin_or_is_commercial
+    def get_one(self, id_):
+        return self.app.get_job(id_)
+
+    @login_check
+    @api.response(200, 'Success')
+    @route('/<int:id_>/cancel/', method='POST')
+    @wrap_assure_is_admin_or_is_commercial
+    def cancel(self, id_):
+        return self.app.cancel_job(id_)
+
+    @login_check
+    @api.response(200, HTTP_OK)
+    @route('/<int:id_>/file/', method='GET')
+    @wrap_assure_is_admin_or_is_commercial
+    def get_file(self, id_):
+        storage_obj: IO = self.app.get_job_file(id_)
+        return self._send_file(storage_obj.name)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from flask_restplus import Namespace
+from flask_restplus import Namespace, fields
 from *****_service.web.static import HTTP_OK
 from *****_service.web.view_models import *
 from *****_service.web.views import AdvModelResource, ResourceSet, route, route_set
@@ -20,6 +20,12 @@ class VM:
         ['full_name', '全称', str, True],
         _location='form')
     patch = model
+    sync_result = api.model('BusinessSyncResult', {
+        'created': fields.Integer(description='新增的业务数'),
+        'updated': fields.Integer(description='更新的业务数'),
+        'deleted': fields.Integer(description='删除的业务数'),
+        'unchanged': fields.Integer(description='内容未变化的业务数'),
+    })
 
 
 @route_set(api, '/providers/')
@@ -152,10 +158,9 @@ class BusinessRes(AdvModelResource, ResourceSet):
         return self.get_page(request, query_op=lambda q: q.filter_by(type=const.META_TYPE_BUSINESS))
 
     @login_check
-    @api.response(200, HTTP_OK)
+    @api.response(200, 'Success', VM.sync_result)
     @route('/businesses/sync/', method='POST')
     @wrap_assure_is_admin_or_is_commercial
     @wrap_log(resource_type=const.META_TYPE_BUSINESS)
     def sync(self):
-        self.control.sync_businesses()
-        return HTTP_OK
+        return self.control.sync_businesses().to_dict()
@@ -1,13 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from typing import IO
-
 from flask_restplus import Namespace
 from *****_service.web.view_models import *
 from *****_service.web.views import AdvModelResource, ResourceSet, route, route_set
 
 from common.util.auth import login_check
-from common.util.paginator import *****Paginator, *****PagingResult
 from service.controls.apps.report import ReportApp
 from service.models.bill_period import BillPeriod
 from service.controls.apps.user import wrap_assure_is_admin_or_is_any_roles
@@ -24,6 +21,15 @@ class VM:
         ['end_bill_period_id', '截止计费周期ID', int, True],
         ['filter_type', '过滤类型，business或department', str, True],
         ['business_ids', '业务ID列表，filter_type为business时必填', list, False],
+        ['cursor', '报表账单分页游标，即上一页返回的next_cursor，不传时获取第一页', int, False],
+        ['page_size', '每页的报表账单数', int, False],
+        _location='args')
+    export_report_bills = make_params(
+        ['start_bill_period_id', '起始计费周期ID', int, True],
+        ['end_bill_period_id', '截止计费周期ID', int, True],
+        ['filter_type', '过滤类型，business或department', str, True],
+        ['business_ids', '业务ID列表，filter_type为business时必填', list, False],
+        ['format', '文件格式，xlsx或csv，默认xlsx；数据量大时建议使用csv，查询完成前即开始输出', str, False],
         _location='args')
 
 
@@ -34,12 +40,14 @@ class ReportRes(ExportMixin, AdvModelResource, ResourceSet):
 
     @login_check
     @wrap_assure_is_admin_or_is_any_roles
+    @api.expect(page_model_args)
     def get(self):
-        reports = self.app.get_reports()
+        # 计费周期在数据库中分页，当前页的报表状态由一次分组统计得到
         return self.get_page(
             request,
-            delay_page=True,
-            get_list_data_list=lambda x: [report.to_dict() for report in reports])
+            query_op=self.app.get_query_op_func_of_reports(),
+            get_list_data_list=lambda bill_periods: [
+                report.to_dict() for report in self.app.get_reports_of_bill_periods(bill_periods)])
 
     @login_check
     @api.expect(VM.get_details)
@@ -51,18 +59,16 @@ class ReportRes(ExportMixin, AdvModelResource, ResourceSet):
         end_bill_period_id = int(request.args.get('end_bill_period_id'))
         business_ids = [int(id_) for id_ in request.args.get('business_ids').split(',')]
 
-        report_details_struct = self.app.get_report_details_filter_by_business_ids(
-            start_bill_period_id, end_bill_period_id, business_ids)
+        cursor = request.args.get('cursor', type=int)
+        page_size = request.args.get('page_size', type=int)
 
-        bills = report_details_struct.overview.bills
-        bills_paged_result = *****Paginator.paging_with_paging_params_from_request(bills)
-        result = report_details_struct.asdict()
-        self.__replace_with_bills_paged_result(result, bills_paged_result)
+        report_details_struct = self.app.get_report_details_filter_by_business_ids(
+            start_bill_period_id, end_bill_period_id, business_ids, cursor, page_size)
 
-        return result
+        return report_details_struct.asdict()
 
     @login_check
-    @api.expect(VM.get_details)
+    @api.expect(VM.export_report_bills)
     @route('/details/export_report_bills/', method='GET')
     @wrap_assure_is_admin_or_is_any_roles
     def export_report_bills(self):
@@ -71,18 +77,7 @@ class ReportRes(ExportMixin, AdvModelResource, ResourceSet):
         end_bill_period_id = int(request.args.get('end_bill_period_id'))
         business_ids = [int(id_) for id_ in request.args.get('business_ids').split(',')]
 
-        storage_obj: IO = self.app.export_report_bills_filter_by_business_ids(
-            start_bill_period_id, end_bill_period_id, business_ids)
-
-        return self._send_file(storage_obj.name)
-
-    @classmethod
-    def __replace_with_bills_paged_result(cls, result: dict, bills_paged_result: *****PagingResult):
-        bill_dict_list = []
-
-        result['overview']['bills'] = bills_paged_result.asdict()
-
-        for bill in bills_paged_result.data:
-            bill_dict_list.append(bill.to_dict(excludes=['type', 'parent_id']))
+        file_format = request.args.get('format', self.app.FILE_FORMAT_XLSX)
 
-        result['overview']['bills']['data'] = bill_dict_list
+        return self._send_stream(*self.app.stream_report_bills_filter_by_business_ids(
+            start_bill_period_id, end_bill_period_id, business_ids, file_format))